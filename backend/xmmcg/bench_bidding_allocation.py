@@ -0,0 +1,179 @@
+"""
+竞标分配性能基准脚本
+在 1k / 10k / 100k 条竞标规模下测量 BiddingService.allocate_bids 的
+SQL 查询数量与耗时
+
+测量两项：
+1. 分配引擎（快照读取 + 内存计算 + 批量写回），读取语句数固定，
+   BidResult 按批写入，写入语句数为 ceil(分配结果数 / 批大小) + 1
+2. 完整的 allocate_bids（包含代币结算与作者奖励）
+
+使用方法：
+    python bench_bidding_allocation.py              # 默认 1000 10000 100000
+    python bench_bidding_allocation.py 1000 5000    # 自定义规模
+
+注意：脚本会批量创建以 benchbid_ 开头的用户及其歌曲、竞标，结束后自动清除。
+"""
+
+import os
+import sys
+import time
+import random
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from songs.models import Song, BiddingRound, Bid, BidResult, MAX_BIDS_PER_USER
+from songs.bidding_service import BiddingService
+from users.models import UserProfile
+
+USER_PREFIX = 'benchbid_'
+ROUND_PREFIX = '基准测试竞标轮次'
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def clear_bench_data():
+    """清除之前的基准测试数据"""
+    bench_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    # 占位歌曲没有真实文件，直接用 QuerySet 删除，避免逐条 delete()
+    Song.objects.filter(user__in=bench_users).delete()
+    UserProfile.objects.filter(user__in=bench_users).delete()
+    bench_users.delete()
+
+
+def create_bench_data(bid_count):
+    """
+    批量创建基准测试数据
+
+    每个用户竞标 MAX_BIDS_PER_USER 首不同的歌曲，歌曲数量约为用户数的一半，
+    出价取 10 的倍数以制造大量同价竞标，从而同时覆盖竞价中标和保底随机分配。
+
+    Args:
+        bid_count: 竞标总数
+
+    Returns:
+        BiddingRound: 创建好的竞标轮次
+    """
+    user_count = max(bid_count // MAX_BIDS_PER_USER, 2)
+    song_count = max(user_count // 2, MAX_BIDS_PER_USER)
+
+    User.objects.bulk_create(
+        [User(username=f'{USER_PREFIX}{i}') for i in range(user_count)],
+        batch_size=1000
+    )
+    user_ids = list(
+        User.objects.filter(username__startswith=USER_PREFIX).values_list('id', flat=True)
+    )
+    UserProfile.objects.bulk_create(
+        [UserProfile(user_id=user_id, token=100000) for user_id in user_ids],
+        batch_size=1000
+    )
+
+    Song.objects.bulk_create(
+        [
+            Song(
+                user_id=user_ids[i % len(user_ids)],
+                title=f'基准测试歌曲 {i}',
+                audio_file=f'songs/bench_{i}.mp3',
+                audio_hash=f'bench_hash_{i}',
+                file_size=0,
+            )
+            for i in range(song_count)
+        ],
+        batch_size=1000
+    )
+    song_ids = list(
+        Song.objects.filter(user_id__in=user_ids).values_list('id', flat=True)
+    )
+
+    bidding_round = BiddingRound.objects.create(
+        name=f'{ROUND_PREFIX} - {bid_count}',
+        bidding_type='song',
+        status='active',
+        started_at=timezone.now()
+    )
+
+    bids = []
+    for user_id in user_ids:
+        for song_id in random.sample(song_ids, MAX_BIDS_PER_USER):
+            bids.append(Bid(
+                bidding_round=bidding_round,
+                user_id=user_id,
+                bid_type='song',
+                song_id=song_id,
+                amount=random.randint(1, 50) * 10,
+            ))
+            if len(bids) >= bid_count:
+                break
+        if len(bids) >= bid_count:
+            break
+    Bid.objects.bulk_create(bids, batch_size=1000)
+
+    return bidding_round
+
+
+def measure(func):
+    """执行 func 并返回 (结果, 执行的查询, 耗时秒)"""
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+    return result, ctx.captured_queries, elapsed
+
+
+def run_engine_only(bidding_round):
+    """只运行分配引擎，结束后回滚，不影响后续完整分配的测量"""
+    with transaction.atomic():
+        BidResult.objects.filter(bidding_round=bidding_round).delete()
+        snapshot = BiddingService._load_allocation_snapshot(bidding_round)
+        plan = BiddingService._compute_allocation(snapshot)
+        BiddingService._apply_allocation(bidding_round, plan)
+        transaction.set_rollback(True)
+    return plan
+
+
+def run_benchmark(bid_count):
+    """运行单个规模的基准测试并打印结果"""
+    clear_bench_data()
+    bidding_round = create_bench_data(bid_count)
+    actual_bids = Bid.objects.filter(bidding_round=bidding_round).count()
+
+    plan, engine_queries, engine_time = measure(lambda: run_engine_only(bidding_round))
+    result, total_queries, total_time = measure(
+        lambda: BiddingService.allocate_bids(bidding_round.id)
+    )
+
+    print(f"竞标数: {actual_bids}")
+    inserts = sum(q['sql'].startswith(f'INSERT INTO "{BidResult._meta.db_table}"') for q in engine_queries)
+    results = len(plan['winners']) + len(plan['random_assignments'])
+    print(f"  分配引擎:        {len(engine_queries):>6} 条查询, {engine_time:8.3f} 秒"
+          f"（其中 {results} 条分配结果分 {inserts} 批写入，批数随结果数增长）")
+    print(f"  完整 allocate_bids: {len(total_queries):>6} 条查询, {total_time:8.3f} 秒")
+    print(f"  中标 {result['winners']} 人 / 竞标者 {result['total_bidders']} 人, "
+          f"已分配目标 {result['allocated_targets']} / {result['total_targets']}")
+    print()
+
+    clear_bench_data()
+
+
+def main():
+    """主函数"""
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+
+    print("\n" + "=" * 60)
+    print("竞标分配性能基准")
+    print("=" * 60 + "\n")
+
+    for bid_count in sizes:
+        run_benchmark(bid_count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""
+互评分配性能基准脚本
+在 100 / 1k / 10k 张谱面规模下测量 PeerReviewService 的互评分配耗时，
+并校验分配结果满足平衡条件
+
+测量两项：
+1. 分配算法本身（纯内存计算，greedy 与 flow 两种模式）
+2. 完整的 allocate_peer_reviews（读取谱面 + 计算 + 批量写入）
+3. 增量调整 rebalance_peer_reviews（一名评分者退出），查询数应与谱面数量无关
+
+校验：
+- 每张谱面收到相同数量的评分
+- 每个评分者的任务数相同
+- 没有人评自己参与的谱面（包括第二部分续写者）
+- 没有重复的 (评分者, 谱面) 组合
+
+使用方法：
+    python bench_peer_review_allocation.py              # 默认 100 1000 10000
+    python bench_peer_review_allocation.py 500 2000     # 自定义规模
+
+注意：脚本会批量创建以 benchpr_ 开头的用户及其歌曲、谱面，结束后自动清除。
+"""
+
+import os
+import sys
+import time
+import random
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from songs.models import Song, BiddingRound, BidResult, Chart, PeerReviewAllocation
+from songs.bidding_service import PeerReviewService
+
+USER_PREFIX = 'benchpr_'
+ROUND_PREFIX = '基准测试互评轮次'
+DEFAULT_SIZES = [100, 1000, 10000]
+
+# 有第二部分续写者的谱面比例
+COMPLETION_RATIO = 0.3
+
+
+def clear_bench_data():
+    """清除之前的基准测试数据"""
+    bench_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    # 占位歌曲/谱面没有真实文件，直接用 QuerySet 删除，避免逐条 delete()
+    Chart.objects.filter(user__in=bench_users).delete()
+    Song.objects.filter(user__in=bench_users).delete()
+    bench_users.delete()
+
+
+def create_bench_data(chart_count):
+    """
+    批量创建基准测试数据
+
+    每个用户上传一首歌并提交一张谱面；约 COMPLETION_RATIO 的谱面由另一位用户续写
+    第二部分，使贡献者集合互相重叠。
+
+    Args:
+        chart_count: 谱面数量
+
+    Returns:
+        BiddingRound: 创建好的竞标轮次
+    """
+    User.objects.bulk_create(
+        [User(username=f'{USER_PREFIX}{i}') for i in range(chart_count)],
+        batch_size=1000
+    )
+    user_ids = list(
+        User.objects.filter(username__startswith=USER_PREFIX).order_by('id').values_list('id', flat=True)
+    )
+
+    Song.objects.bulk_create(
+        [
+            Song(
+                user_id=user_id,
+                title=f'基准测试歌曲 {i}',
+                audio_file=f'songs/benchpr_{i}.mp3',
+                audio_hash=f'benchpr_hash_{i}',
+                file_size=0,
+            )
+            for i, user_id in enumerate(user_ids)
+        ],
+        batch_size=1000
+    )
+    song_ids = list(
+        Song.objects.filter(user_id__in=user_ids).order_by('user_id').values_list('id', flat=True)
+    )
+
+    bidding_round = BiddingRound.objects.create(
+        name=f'{ROUND_PREFIX} - {chart_count}',
+        bidding_type='chart',
+        status='completed'
+    )
+
+    # 续写者的分配结果：第 i 张谱面由第 i+1 位用户续写
+    completion_indexes = random.sample(range(chart_count), int(chart_count * COMPLETION_RATIO))
+    BidResult.objects.bulk_create(
+        [
+            BidResult(
+                bidding_round=bidding_round,
+                user_id=user_ids[(i + 1) % chart_count],
+                bid_type='song',
+                song_id=song_ids[i],
+                bid_amount=0,
+                allocation_type='random',
+            )
+            for i in completion_indexes
+        ],
+        batch_size=1000
+    )
+    completion_map = dict(
+        BidResult.objects.filter(bidding_round=bidding_round).values_list('song_id', 'id')
+    )
+
+    Chart.objects.bulk_create(
+        [
+            Chart(
+                bidding_round=bidding_round,
+                user_id=user_id,
+                song_id=song_id,
+                status='final_submitted',
+                completion_bid_result_id=completion_map.get(song_id),
+            )
+            for user_id, song_id in zip(user_ids, song_ids)
+        ],
+        batch_size=1000
+    )
+
+    return bidding_round
+
+
+def verify_allocations(bidding_round, reviews_per_user):
+    """校验分配结果满足平衡条件，返回错误信息列表"""
+    errors = []
+    pairs = list(
+        PeerReviewAllocation.objects.filter(bidding_round=bidding_round).values_list('reviewer_id', 'chart_id')
+    )
+    contributors = {}
+    for chart_id, owner_id, completion_user_id in Chart.objects.filter(
+        bidding_round=bidding_round
+    ).values_list('id', 'user_id', 'completion_bid_result__user_id'):
+        contributors[chart_id] = {owner_id, completion_user_id}
+
+    chart_counts = Counter(chart_id for _, chart_id in pairs)
+    reviewer_counts = Counter(reviewer_id for reviewer_id, _ in pairs)
+
+    if len(set(chart_counts.values())) != 1 or len(chart_counts) != len(contributors):
+        errors.append(f'谱面评分数不均衡: {sorted(set(chart_counts.values()))}')
+    if set(reviewer_counts.values()) != {reviews_per_user}:
+        errors.append(f'评分者任务数不均衡: {sorted(set(reviewer_counts.values()))}')
+    if len(set(pairs)) != len(pairs):
+        errors.append('存在重复的 (评分者, 谱面) 组合')
+    self_reviews = sum(1 for reviewer_id, chart_id in pairs if reviewer_id in contributors[chart_id])
+    if self_reviews:
+        errors.append(f'{self_reviews} 条分配是评自己参与的谱面')
+    return errors
+
+
+def run_benchmark(chart_count, reviews_per_user):
+    """运行单个规模的基准测试并打印结果"""
+    clear_bench_data()
+    bidding_round = create_bench_data(chart_count)
+
+    # 分配算法本身
+    chart_contributors = {}
+    for chart_id, owner_id, completion_user_id in Chart.objects.filter(
+        bidding_round=bidding_round
+    ).values_list('id', 'user_id', 'completion_bid_result__user_id'):
+        chart_contributors[chart_id] = {owner_id} | ({completion_user_id} if completion_user_id else set())
+    reviewer_ids = set().union(*chart_contributors.values())
+    reviews_per_chart = len(reviewer_ids) * reviews_per_user // len(chart_contributors)
+
+    plan_times = {}
+    for mode in ('greedy', 'flow'):
+        start = time.perf_counter()
+        try:
+            PeerReviewService._plan_peer_reviews(
+                chart_contributors, reviewer_ids, reviews_per_chart, reviews_per_user,
+                rng=random.Random(0), mode=mode
+            )
+            plan_times[mode] = f'{time.perf_counter() - start:8.3f} 秒'
+        except ValidationError:
+            plan_times[mode] = '  分配失败'
+
+    # 完整的 allocate_peer_reviews
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        result = PeerReviewService.allocate_peer_reviews(bidding_round.id, reviews_per_user)
+        total_time = time.perf_counter() - start
+
+    errors = verify_allocations(bidding_round, reviews_per_user)
+
+    # 增量调整：一名评分者退出，其待完成任务转给其他评分者
+    quitter_id = PeerReviewAllocation.objects.filter(
+        bidding_round=bidding_round
+    ).values_list('reviewer_id', flat=True).first()
+    with CaptureQueriesContext(connection) as rebalance_ctx:
+        start = time.perf_counter()
+        rebalance = PeerReviewService.rebalance_peer_reviews(bidding_round.id, reviewer_id=quitter_id)
+        rebalance_time = time.perf_counter() - start
+    reviewer_counts = Counter(
+        PeerReviewAllocation.objects.filter(bidding_round=bidding_round)
+        .exclude(reviewer_id=quitter_id).values_list('reviewer_id', flat=True)
+    )
+    if max(reviewer_counts.values()) - reviews_per_user > 1:
+        errors.append(f'调整后评分者任务数不均衡: {sorted(set(reviewer_counts.values()))}')
+
+    print(f"谱面数: {chart_count}（评分者 {result['reviewers_count']}，"
+          f"每谱面 {result['reviews_per_chart']} 次，每人 {result['tasks_per_reviewer']} 个）")
+    print(f"  分配算法 (greedy):     {plan_times['greedy']}")
+    print(f"  分配算法 (flow):       {plan_times['flow']}")
+    print(f"  完整 allocate_peer_reviews: {total_time:8.3f} 秒, {len(ctx.captured_queries)} 条查询")
+    print(f"  增量 rebalance_peer_reviews: {rebalance_time:8.3f} 秒, {len(rebalance_ctx.captured_queries)} 条查询"
+          f"（移动 {rebalance['moved']} 个任务）")
+    if errors:
+        for error in errors:
+            print(f"  ✗ {error}")
+    else:
+        print("  ✓ 平衡条件校验通过")
+    print()
+
+    clear_bench_data()
+
+
+def main():
+    """主函数"""
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    reviews_per_user = getattr(settings, 'PEER_REVIEW_TASKS_PER_USER', 8)
+
+    print("\n" + "=" * 60)
+    print("互评分配性能基准")
+    print("=" * 60 + "\n")
+
+    for chart_count in sizes:
+        run_benchmark(chart_count, reviews_per_user)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,8 @@ from django.contrib import admin
 from .models import (
     Song, Banner, Announcement, CompetitionPhase, 
     BiddingRound, Bid, BidResult,
-    Chart, PeerReviewAllocation, PeerReview,
+    Chart, PeerReviewAllocation, PeerReview, RoundRanking, MediaBlob,
+    MajdataUpload,
 )
 
 
@@ -124,7 +125,7 @@ class BiddingRoundAdmin(admin.ModelAdmin):
     list_filter = ('bidding_type', 'status', 'created_at', 'competition_phase', 'bidding_type')
     ordering = ('-created_at',)
     search_fields = ('name',)
-    actions = ['allocate_bids_action', 'auto_create_chart_round_action']
+    actions = ['preview_allocation_action', 'allocate_bids_action', 'auto_create_chart_round_action']
     
     def available_targets_count(self, obj):
         """显示该轮次的可用目标数量"""
@@ -137,6 +138,38 @@ class BiddingRoundAdmin(admin.ModelAdmin):
         return count
     available_targets_count.short_description = '可用目标数'
     
+    @admin.action(description='预览选中竞标轮次的分配结果（不写入数据库）')
+    def preview_allocation_action(self, request, queryset):
+        """
+        自定义管理员操作：预览选中竞标轮次的分配结果，不修改任何数据
+        """
+        from .bidding_service import BiddingService
+        from django.contrib import messages
+        
+        for bidding_round in queryset:
+            try:
+                result = BiddingService.preview_allocation(bidding_round.id)
+            except Exception as e:
+                self.message_user(
+                    request,
+                    f'{bidding_round.name} 预览失败: {str(e)}',
+                    level=messages.WARNING
+                )
+                continue
+            
+            token_deduction = result['token_deduction']
+            summary = (
+                f'{bidding_round.name} 预览：竞标者 {result["total_bidders"]} 人，'
+                f'竞价中标 {result["winners"]} 人，保底分配 {len(result["random_allocations"])} 人，'
+                f'目标 {result["allocated_targets"]}/{result["total_targets"]} 已分配，'
+                f'预计扣除代币 {token_deduction["total_deducted"]}'
+            )
+            if 'song_author_rewards' in result:
+                summary += f'，作者奖励 {result["song_author_rewards"]["total_reward"]}'
+            if token_deduction['failed_count']:
+                summary += f'，代币不足 {token_deduction["failed_count"]} 人'
+            self.message_user(request, summary, level=messages.INFO)
+    
     @admin.action(description='分配选中的竞标轮次')
     def allocate_bids_action(self, request, queryset):
         """
@@ -381,6 +414,63 @@ class PeerReviewAdmin(admin.ModelAdmin):
     )
 
 
+
+@admin.register(RoundRanking)
+class RoundRankingAdmin(admin.ModelAdmin):
+    list_display = ('bidding_round', 'rank', 'dense_rank', 'username', 'song_title', 'average_score', 'total_score', 'review_count', 'updated_at')
+    list_filter = ('bidding_round',)
+    search_fields = ('username', 'song_title')
+    list_select_related = ('bidding_round',)
+    raw_id_fields = ('chart',)
+    ordering = ('bidding_round', 'rank', 'chart_id')
+    
+    # 排名由排名服务维护（python manage.py rebuild_rankings 可全量重建），不允许在后台修改
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'ref_count', 'created_at')
+    search_fields = ('name', 'sha256')
+    ordering = ('-created_at',)
+    
+    # 引用计数由存储后端维护（python manage.py dedupe_media 可按实际引用重新计算），不允许在后台修改
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MajdataUpload)
+class MajdataUploadAdmin(admin.ModelAdmin):
+    list_display = ('chart', 'status', 'attempts', 'next_attempt_at', 'external_url', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('chart__song__title', 'chart__user__username', 'last_error')
+    list_select_related = ('chart__song', 'chart__user')
+    raw_id_fields = ('chart',)
+    readonly_fields = ('chart', 'status', 'attempts', 'next_attempt_at', 'locked_at', 'last_error', 'external_url', 'created_at', 'updated_at')
+    actions = ['retry_action']
+    
+    # 记录由提交谱面时写入、由 run_majdata_worker 更新，后台只能重新排队
+    def has_add_permission(self, request):
+        return False
+    
+    def retry_action(self, request, queryset):
+        """将失败或等待重试的记录重新排队（已上传成功的记录不受影响）"""
+        from django.contrib import messages
+        from .majdata_outbox import MajdataOutboxService
+        count = MajdataOutboxService.retry(queryset)
+        self.message_user(request, f'已将 {count} 条记录重新排队', level=messages.SUCCESS)
+    retry_action.short_description = '重新上传到 Majdata.net'
+
 # 第二轮竞标相关Admin（已废弃）
 # @admin.register(SecondBiddingRound)
 # class SecondBiddingRoundAdmin(admin.ModelAdmin):
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class SongsConfig(AppConfig):
+    name = 'songs'
+
+    def ready(self):
+        # 注册信号处理器
+        from . import signals  # noqa: F401
@@ -4,15 +4,62 @@
 支持歌曲竞标和谱面竞标的统一处理
 """
 
+import heapq
 import random
+from collections import Counter, defaultdict, deque
 from django.db import transaction
-from django.db.models import Sum
+from django.db.models import Sum, Count, F, Q, OuterRef, Exists, Subquery, Case, When, Value, FloatField
+from django.db.models.functions import Cast
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.conf import settings
-from .models import Bid, BidResult, BiddingRound, Song, Chart, MAX_SONGS_PER_USER, RANDOM_ALLOCATION_COST
-from users.models import UserProfile
+from .models import Bid, BidResult, BiddingRound, Song, Chart, MAX_SONGS_PER_USER, RANDOM_ALLOCATION_COST, SONG_AUTHOR_REWARD
+from users.models import UserProfile, TokenTransaction
+
+
+# 分配类型 -> 代币流水类型
+ALLOCATION_TRANSACTION_TYPES = {
+    'win': 'bid_settlement',
+    'random': 'random_allocation',
+}
+
+# 分配结果每条 INSERT 最多写入的行数（数据库的参数上限更小时以其为准，SQLite 约 100 行）
+ALLOCATION_WRITE_BATCH_SIZE = 500
+
+
+class TargetPool:
+    """
+    可随机抽取的目标ID池
+    
+    用列表保存元素、字典记录下标，删除时与末尾元素交换后弹出，
+    抽取和删除均为 O(1)，用于保底随机分配阶段。
+    """
+    
+    def __init__(self, items=()):
+        self._items = list(items)
+        self._index = {item: i for i, item in enumerate(self._items)}
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def __iter__(self):
+        return iter(self._items)
+    
+    def __contains__(self, item):
+        return item in self._index
+    
+    def choice(self, rng=random):
+        """随机返回一个元素（不删除）"""
+        return rng.choice(self._items)
+    
+    def remove(self, item):
+        """删除指定元素"""
+        i = self._index.pop(item)
+        last = self._items.pop()
+        if i < len(self._items):
+            self._items[i] = last
+            self._index[last] = i
 
 
 class BiddingService:
@@ -35,6 +82,12 @@ class BiddingService:
            - 如果priority_self=True且为谱面竞标，优先分配用户自己的半成品谱面
         6. 标记该轮次为已完成
         
+        实现上分为三步：先用少量查询读取快照（_load_allocation_snapshot），
+        再在内存中算出完整结果（_compute_allocation），最后用批量语句写回数据库
+        （_apply_allocation）。读取语句数量固定，写入语句数量为
+        ceil(分配结果数 / 批大小) + 1（见 _apply_allocation），不再每条竞标一条语句，
+        从而缩短事务持有 SQLite 写锁的时间。
+        
         Args:
             bidding_round_id: 竞标轮次ID
             priority_self: 是否优先分配自己的半成品谱面（仅谱面竞标有效，默认False）
@@ -60,195 +113,461 @@ class BiddingService:
         # 清空之前的分配结果（如果有重新分配）
         BidResult.objects.filter(bidding_round=bidding_round).delete()
         
-        # 获取所有有效竞标（根据类型选择正确的关联）
+        # 读取快照并在内存中计算分配结果
+        snapshot = BiddingService._load_allocation_snapshot(bidding_round, priority_self)
+        plan = BiddingService._compute_allocation(snapshot, priority_self)
+        
+        # 批量写回分配结果
+        BiddingService._apply_allocation(bidding_round, plan)
+        
+        # 标记竞标轮次为已完成
+        bidding_round.status = 'completed'
+        bidding_round.completed_at = timezone.now()
+        bidding_round.save(update_fields=['status', 'completed_at'])
+        
+        # 处理代币扣除和歌曲作者奖励（仅歌曲竞标有作者奖励）
+        ignore_deduction_fail = priority_self and bidding_type == 'chart'
+        settlement = BiddingService._settle_round_tokens(
+            bidding_round,
+            ignore_token_overshoot=ignore_deduction_fail
+        )
+        token_deduction = settlement['token_deduction']
+        song_author_rewards = settlement['song_author_rewards'] if bidding_type == 'song' else {}
+        
+        # 返回统计信息
+        target_type_name = '歌曲' if bidding_type == 'song' else '谱面'
+        result = {
+            'status': 'success',
+            'message': f'{target_type_name}竞标分配完成',
+            'bidding_type': bidding_type,
+            'total_targets': len(snapshot['target_ids']),
+            'allocated_targets': len(plan['allocated_targets']),
+            'unallocated_targets': len(plan['unallocated_targets']),
+            'winners': len(plan['winners']),
+            'total_bidders': len(plan['bidding_users']),
+            'token_deduction': token_deduction,
+        }
+        
+        # 添加歌曲作者奖励信息（如果有）
+        if song_author_rewards:
+            result['song_author_rewards'] = song_author_rewards
+        
+        return result
+    
+    @staticmethod
+    def preview_allocation(bidding_round_id, priority_self=False):
+        """
+        预览竞标分配结果（只读，不写入数据库）
+        
+        与 allocate_bids 使用相同的快照与分配计算，并按相同规则推算代币扣除
+        和歌曲作者奖励，但不删除/创建 BidResult、不修改竞标与代币。
+        不包裹在 transaction.atomic 中，截止前可以反复预览而不阻塞竞标写入。
+        
+        注意：同价竞标和保底分配包含随机性，预览结果与正式分配不一定完全相同。
+        
+        Args:
+            bidding_round_id: 竞标轮次ID
+            priority_self: 是否优先分配自己的半成品谱面（仅谱面竞标有效，默认False）
+            
+        Returns:
+            dict: 包含分配统计、中标/保底分配明细、代币变化和作者奖励
+            
+        Raises:
+            ValidationError: 如果竞标轮次不存在或状态不适合分配
+        """
+        
+        # 获取竞标轮次
+        try:
+            bidding_round = BiddingRound.objects.get(id=bidding_round_id)
+        except BiddingRound.DoesNotExist:
+            raise ValidationError('竞标轮次不存在')
+        
+        if bidding_round.status != 'active':
+            raise ValidationError(f'只能对"进行中"的竞标轮次进行分配')
+        
+        bidding_type = bidding_round.bidding_type
+        snapshot = BiddingService._load_allocation_snapshot(bidding_round, priority_self)
+        plan = BiddingService._compute_allocation(snapshot, priority_self)
+        
+        # 分配结果：(user_id, target_id, bid_amount, allocation_type)
+        results = [
+            (user_id, target_id, amount, 'win')
+            for _, user_id, target_id, amount in plan['winners']
+        ] + [
+            (user_id, target_id, RANDOM_ALLOCATION_COST, 'random')
+            for user_id, target_id in plan['random_assignments']
+        ]
+        
+        # 歌曲作者映射（仅歌曲竞标需要发放作者奖励）
+        song_author_map = {}
         if bidding_type == 'song':
-            all_bids = list(Bid.objects.filter(
-                bidding_round=bidding_round,
-                is_dropped=False,
-                bid_type='song'
-            ).select_related('user', 'song'))
-        else:  # chart
-            all_bids = list(Bid.objects.filter(
-                bidding_round=bidding_round,
-                is_dropped=False,
-                bid_type='chart'
-            ).select_related('user', 'chart', 'chart__user'))
+            song_author_map = dict(Song.objects.filter(
+                id__in=[target_id for _, target_id, _, _ in results]
+            ).values_list('id', 'user_id'))
+        
+        user_ids = set(user_id for user_id, _, _, _ in results) | set(song_author_map.values())
+        balances = dict(UserProfile.objects.filter(
+            user_id__in=user_ids
+        ).values_list('user_id', 'token'))
+        usernames = dict(User.objects.filter(
+            id__in=user_ids
+        ).values_list('id', 'username'))
         
-        # 按出价从高到低排序，同价格随机打乱
-        from collections import defaultdict
-        bids_by_amount = defaultdict(list)
-        for bid in all_bids:
-            bids_by_amount[bid.amount].append(bid)
+        ignore_deduction_fail = priority_self and bidding_type == 'chart'
+        settlement = BiddingService._plan_settlement(
+            [
+                (user_id, bid_amount, ALLOCATION_TRANSACTION_TYPES[allocation_type])
+                for user_id, _, bid_amount, allocation_type in results
+            ],
+            song_author_map.values(),
+            balances,
+            usernames,
+            ignore_token_overshoot=ignore_deduction_fail
+        )
         
-        # 对每个价格组内随机打乱
-        sorted_bids = []
-        for amount in sorted(bids_by_amount.keys(), reverse=True):
-            group = bids_by_amount[amount]
-            random.shuffle(group)  # 同价格随机排序
-            sorted_bids.extend(group)
+        allocations = [
+            {
+                'user_id': user_id,
+                'username': usernames.get(user_id),
+                'target_id': target_id,
+                'bid_amount': bid_amount,
+                'allocation_type': allocation_type,
+            }
+            for user_id, target_id, bid_amount, allocation_type in results
+        ]
+        token_deltas = [
+            {
+                'user_id': user_id,
+                'username': usernames.get(user_id),
+                'balance': settlement['balances'][user_id],
+                'delta': delta,
+                'balance_after': settlement['balances'][user_id] + delta,
+            }
+            for user_id, delta in sorted(settlement['deltas'].items())
+        ]
         
-        all_bids = sorted_bids
+        target_type_name = '歌曲' if bidding_type == 'song' else '谱面'
+        result = {
+            'status': 'preview',
+            'message': f'{target_type_name}竞标分配预览（未写入数据库）',
+            'bidding_type': bidding_type,
+            'total_targets': len(snapshot['target_ids']),
+            'allocated_targets': len(plan['allocated_targets']),
+            'unallocated_targets': len(plan['unallocated_targets']),
+            'winners': len(plan['winners']),
+            'total_bidders': len(plan['bidding_users']),
+            'win_allocations': [a for a in allocations if a['allocation_type'] == 'win'],
+            'random_allocations': [a for a in allocations if a['allocation_type'] == 'random'],
+            'token_deltas': token_deltas,
+            'token_deduction': settlement['token_deduction'],
+        }
+        if bidding_type == 'song':
+            result['song_author_rewards'] = settlement['song_author_rewards']
         
-        # 追踪已分配的目标和用户
-        allocated_targets = set()  # 已分配的目标ID集合（歌曲或谱面）
-        allocated_users = {}       # 用户ID -> 目标ID（每个用户最多一个）
+        return result
+    
+    @staticmethod
+    def _plan_settlement(charges, author_ids, balances, usernames, ignore_token_overshoot=False):
+        """
+        推算一轮分配后的代币结算（纯计算，不访问数据库）
         
-        # 第一阶段：按出价从高到低进行分配
-        for bid in all_bids:
-            # 如果用户已经中标，skip该用户的所有后续竞标
-            if bid.user.id in allocated_users:
-                # 用户已经中标，drop这个竞标
-                bid.is_dropped = True
-                bid.save()
-                continue
+        规则与 process_allocation_tokens / process_song_author_rewards 一致：
+        先按分配结果扣除代币（余额不足时记为失败，或在 ignore_token_overshoot 时扣光），
+        再给每首被分配歌曲的作者奖励 SONG_AUTHOR_REWARD 代币。
+        
+        Args:
+            charges: [(user_id, bid_amount, transaction_type), ...] 每条分配结果需扣除的代币及流水类型
+            author_ids: 被分配歌曲的作者ID序列（一首歌一项，可重复）
+            balances: 用户ID -> 当前代币余额（缺少资料的用户按默认代币计）
+            usernames: 用户ID -> 用户名，用于失败记录
+            ignore_token_overshoot: 是否忽略代币不足（扣光代币，不报错）
             
-            target_id = bid.song.id if bidding_type == 'song' else bid.chart.id
+        Returns:
+            dict: 包含以下键
+                - balances: 参与结算的用户ID -> 结算前余额
+                - deltas: 用户ID -> 代币净变化（不含0）
+                - transactions: [(user_id, transaction_type, amount, balance_after), ...] 待写入的流水
+                - token_deduction: 与 process_allocation_tokens 返回值格式一致
+                - song_author_rewards: 与 process_song_author_rewards 返回值格式一致
+        """
+        current = {}
+        deltas = defaultdict(int)
+        
+        def balance_of(user_id):
+            if user_id not in current:
+                current[user_id] = balances.get(user_id, getattr(settings, 'DEFAULT_USER_TOKENS', 1000))
+            return current[user_id] + deltas[user_id]
+        
+        total_deducted = 0
+        users_deducted = 0
+        failed_users = []
+        transactions = []
+        
+        for user_id, bid_amount, transaction_type in charges:
+            available = balance_of(user_id)
             
-            if target_id not in allocated_targets:
-                # 该目标尚未被分配，分配给该竞标者
-                if bidding_type == 'song':
-                    BidResult.objects.create(
-                        bidding_round=bidding_round,
-                        user=bid.user,
-                        bid_type='song',
-                        song=bid.song,
-                        bid_amount=bid.amount,
-                        allocation_type='win'
-                    )
-                else:  # chart
-                    BidResult.objects.create(
-                        bidding_round=bidding_round,
-                        user=bid.user,
-                        bid_type='chart',
-                        chart=bid.chart,
-                        bid_amount=bid.amount,
-                        allocation_type='win'
-                    )
-                
-                allocated_targets.add(target_id)
-                allocated_users[bid.user.id] = target_id  # 记录用户已中标
-                
-                # 立即drop该用户的所有其他竞标
-                Bid.objects.filter(
-                    bidding_round=bidding_round,
-                    user=bid.user,
-                    is_dropped=False
-                ).exclude(id=bid.id).update(is_dropped=True)
-            else:
-                # 该目标已被更高出价者获得，标记此竞标为drop
-                bid.is_dropped = True
-                bid.save()
+            # 验证代币足够
+            if available < bid_amount:
+                if not ignore_token_overshoot:
+                    failed_users.append({
+                        'user': usernames.get(user_id),
+                        'user_id': user_id,
+                        'required': bid_amount,
+                        'available': available
+                    })
+                elif available > 0:
+                    deltas[user_id] -= available  # 扣光代币，不报错
+                    transactions.append((user_id, transaction_type, -available, 0))
+                continue
+            
+            deltas[user_id] -= bid_amount
+            transactions.append((user_id, transaction_type, -bid_amount, available - bid_amount))
+            total_deducted += bid_amount
+            users_deducted += 1
         
-        # 获取所有可分配的目标
+        # 统计每个歌曲作者的奖励（一个作者可能有多首歌被分配）
+        author_rewards = defaultdict(int)
+        for author_id in author_ids:
+            author_rewards[author_id] += SONG_AUTHOR_REWARD
+        
+        for author_id, reward_amount in author_rewards.items():
+            balance_after = balance_of(author_id) + reward_amount
+            deltas[author_id] += reward_amount
+            transactions.append((author_id, 'author_reward', reward_amount, balance_after))
+        
+        return {
+            'balances': current,
+            'deltas': {user_id: delta for user_id, delta in deltas.items() if delta},
+            'transactions': transactions,
+            'token_deduction': {
+                'total_deducted': total_deducted,
+                'users_deducted': users_deducted,
+                'failed_users': failed_users,
+                'failed_count': len(failed_users),
+            },
+            'song_author_rewards': {
+                'message': f'歌曲作者奖励发放完成',
+                'rewarded_authors': len(author_rewards),
+                'total_reward': sum(author_rewards.values()),
+                'failed_rewards': [],
+            },
+        }
+    
+    @staticmethod
+    def get_target_queryset(bidding_type):
+        """
+        获取某类竞标的全部可竞标目标
+        
+        Args:
+            bidding_type: 'song' 或 'chart'
+            
+        Returns:
+            QuerySet: 歌曲竞标为全部歌曲；谱面竞标为已提交、且还没有第二部分的第一部分谱面
+        """
         if bidding_type == 'song':
-            all_targets = Song.objects.all()
-            all_target_ids = set(song.id for song in all_targets)
-        else:  # chart
-            # 谱面竞标：只能竞标第一部分且没有完成第二部分的谱面
-            all_targets = Chart.objects.filter(
-                is_part_one=True,
-                status__in=['submitted', 'reviewed', 'part_submitted']
-            )
-            # 排除已有第二部分的谱面
-            from django.db.models import OuterRef, Exists
-            part_two_exists = Chart.objects.filter(
-                part_one_chart=OuterRef('pk'),
-                is_part_one=False
-            )
-            all_targets = all_targets.exclude(Exists(part_two_exists))
-            all_target_ids = set(chart.id for chart in all_targets)
+            return Song.objects.all()
         
-        # 获取未被分配的目标
-        unallocated_targets = list(all_target_ids - allocated_targets)
+        # 谱面竞标：只能竞标第一部分且没有完成第二部分的谱面
+        all_targets = Chart.objects.filter(
+            is_part_one=True,
+            status__in=['submitted', 'reviewed', 'part_submitted']
+        )
+        # 排除已有第二部分的谱面
+        part_two_exists = Chart.objects.filter(
+            part_one_chart=OuterRef('pk'),
+            is_part_one=False
+        )
+        return all_targets.exclude(Exists(part_two_exists))
+    
+    @staticmethod
+    def _load_allocation_snapshot(bidding_round, priority_self=False):
+        """
+        读取分配所需的全部数据（只读，不加载模型实例）
+        
+        Args:
+            bidding_round: 竞标轮次
+            priority_self: 是否需要谱面作者映射（仅谱面竞标有效）
+            
+        Returns:
+            dict: 包含以下键
+                - bidding_type: 'song' 或 'chart'
+                - bids: [(bid_id, user_id, target_id, amount), ...]
+                - target_ids: 所有可分配目标ID集合
+                - chart_owner_map: 谱面ID -> 作者用户ID（仅priority_self谱面竞标）
+        """
+        bidding_type = bidding_round.bidding_type
+        target_field = 'song_id' if bidding_type == 'song' else 'chart_id'
+        
+        # 获取所有有效竞标（根据类型选择正确的关联）
+        bids = list(Bid.objects.filter(
+            bidding_round=bidding_round,
+            is_dropped=False,
+            bid_type=bidding_type
+        ).values_list('id', 'user_id', target_field, 'amount'))
+        
+        # 获取所有可分配的目标
+        all_targets = BiddingService.get_target_queryset(bidding_type)
         
         # 对于谱面竞标，预先建立chart_id到user_id的映射（优化查询）
         chart_owner_map = {}
         if bidding_type == 'chart' and priority_self:
-            charts_info = Chart.objects.filter(id__in=unallocated_targets).values('id', 'user_id')
-            chart_owner_map = {chart['id']: chart['user_id'] for chart in charts_info}
+            chart_owner_map = dict(all_targets.values_list('id', 'user_id'))
+            target_ids = set(chart_owner_map)
+        else:
+            target_ids = set(all_targets.values_list('id', flat=True))
         
-        # 第二阶段：对于未获得任何目标的用户，随机分配（需扣除保底代币）
-        # 获取参与竞标的所有用户
-        bidding_users = set(bid.user.id for bid in all_bids)
+        return {
+            'bidding_type': bidding_type,
+            'bids': bids,
+            'target_ids': target_ids,
+            'chart_owner_map': chart_owner_map,
+        }
+    
+    @staticmethod
+    def _compute_allocation(snapshot, priority_self=False, rng=None):
+        """
+        在内存中计算完整的分配结果（纯计算，不访问数据库）
         
-        for user_id in bidding_users:
-            # 检查该用户是否已经获得了目标
-            if user_id not in allocated_users:
-                user = User.objects.get(id=user_id)
-                target_id = None
-                
-                # 如果启用priority_self且是谱面竞标，优先分配自己的半成品谱面
-                if priority_self and bidding_type == 'chart' and unallocated_targets:
-                    # 查找该用户自己的未分配的半成品谱面
-                    user_own_charts = [
-                        chart_id for chart_id in unallocated_targets 
-                        if chart_owner_map.get(chart_id) == user_id
-                    ]
-                    if user_own_charts:
-                        target_id = random.choice(user_own_charts)
-                
-                # 如果没有找到自己的谱面（或不启用priority_self），随机分配
-                if target_id is None and unallocated_targets:
-                    target_id = random.choice(unallocated_targets)
-                
-                # 创建分配结果
-                if target_id is not None:
-                    if bidding_type == 'song':
-                        BidResult.objects.create(
-                            bidding_round=bidding_round,
-                            user=user,
-                            bid_type='song',
-                            song_id=target_id,
-                            bid_amount=RANDOM_ALLOCATION_COST,  # 保底分配需要支付代币
-                            allocation_type='random'
-                        )
-                    else:  # chart
-                        BidResult.objects.create(
-                            bidding_round=bidding_round,
-                            user=user,
-                            bid_type='chart',
-                            chart_id=target_id,
-                            bid_amount=RANDOM_ALLOCATION_COST,
-                            allocation_type='random'
-                        )
-                    
-                    allocated_targets.add(target_id)
-                    unallocated_targets.remove(target_id)
+        Args:
+            snapshot: _load_allocation_snapshot 返回的快照
+            priority_self: 是否优先分配自己的半成品谱面（仅谱面竞标有效）
+            rng: 随机数生成器（默认使用 random 模块，便于测试时传入固定种子）
+            
+        Returns:
+            dict: 包含以下键
+                - winners: [(bid_id, user_id, target_id, amount), ...] 竞价中标
+                - random_assignments: [(user_id, target_id), ...] 保底随机分配
+                - allocated_targets: 已分配目标ID集合
+                - unallocated_targets: 仍未分配的目标ID列表
+                - bidding_users: 参与竞标的用户ID集合
+        """
+        rng = rng or random
+        bidding_type = snapshot['bidding_type']
+        bids = snapshot['bids']
+        chart_owner_map = snapshot['chart_owner_map']
         
-        # 标记竞标轮次为已完成
-        bidding_round.status = 'completed'
-        bidding_round.completed_at = timezone.now()
-        bidding_round.save()
+        # 按出价从高到低排序，同价格随机打乱
+        bids_by_amount = defaultdict(list)
+        for bid in bids:
+            bids_by_amount[bid[3]].append(bid)
         
-        # 处理代币扣除
-        ignore_deduction_fail = priority_self and bidding_type == 'chart'
-        token_deduction = BiddingService.process_allocation_tokens(bidding_round.id,
-                                                                ignore_token_overshoot=ignore_deduction_fail )
+        # 追踪已分配的目标和用户
+        allocated_targets = set()  # 已分配的目标ID集合（歌曲或谱面）
+        allocated_users = {}       # 用户ID -> 目标ID（每个用户最多一个）
+        winners = []
         
-        # 处理歌曲作者奖励（仅歌曲竞标）
-        song_author_rewards = {}
-        if bidding_type == 'song':
-            song_author_rewards = BiddingService.process_song_author_rewards(bidding_round.id)
+        # 第一阶段：按出价从高到低进行分配
+        for amount in sorted(bids_by_amount.keys(), reverse=True):
+            group = bids_by_amount[amount]
+            rng.shuffle(group)  # 同价格随机排序
+            for bid_id, user_id, target_id, amount in group:
+                # 用户已经中标或目标已被更高出价者获得，该竞标落选
+                if user_id in allocated_users or target_id in allocated_targets:
+                    continue
+                allocated_targets.add(target_id)
+                allocated_users[user_id] = target_id  # 记录用户已中标
+                winners.append((bid_id, user_id, target_id, amount))
         
-        # 返回统计信息
-        target_type_name = '歌曲' if bidding_type == 'song' else '谱面'
-        result = {
-            'status': 'success',
-            'message': f'{target_type_name}竞标分配完成',
-            'bidding_type': bidding_type,
-            'total_targets': len(all_target_ids),
-            'allocated_targets': len(allocated_targets),
-            'unallocated_targets': len(unallocated_targets),
-            'winners': len(allocated_users),
-            'total_bidders': len(bidding_users),
-            'token_deduction': token_deduction,
+        # 获取未被分配的目标（支持 O(1) 随机抽取与删除）
+        unallocated_targets = TargetPool(snapshot['target_ids'] - allocated_targets)
+        
+        # 对于谱面竞标，按作者建立未分配谱面索引：owner_id -> {chart_id, ...}
+        owner_charts = defaultdict(set)
+        if priority_self and bidding_type == 'chart':
+            for chart_id in unallocated_targets:
+                owner_id = chart_owner_map.get(chart_id)
+                if owner_id is not None:
+                    owner_charts[owner_id].add(chart_id)
+        
+        # 第二阶段：对于未获得任何目标的用户，随机分配（需扣除保底代币）
+        # 获取参与竞标的所有用户
+        bidding_users = set(bid[1] for bid in bids)
+        random_assignments = []
+        
+        for user_id in sorted(bidding_users - allocated_users.keys()):
+            if not unallocated_targets:
+                break
+            target_id = None
+            
+            # 如果启用priority_self且是谱面竞标，优先分配自己的半成品谱面
+            user_own_charts = owner_charts.get(user_id)
+            if user_own_charts:
+                target_id = rng.choice(sorted(user_own_charts))
+            
+            # 如果没有找到自己的谱面（或不启用priority_self），随机分配
+            if target_id is None:
+                target_id = unallocated_targets.choice(rng)
+            
+            random_assignments.append((user_id, target_id))
+            allocated_targets.add(target_id)
+            unallocated_targets.remove(target_id)
+            owner_id = chart_owner_map.get(target_id)
+            if owner_id in owner_charts:
+                owner_charts[owner_id].discard(target_id)
+        
+        return {
+            'winners': winners,
+            'random_assignments': random_assignments,
+            'allocated_targets': allocated_targets,
+            'unallocated_targets': list(unallocated_targets),
+            'bidding_users': bidding_users,
         }
+    
+    @staticmethod
+    def _apply_allocation(bidding_round, plan):
+        """
+        将内存中的分配结果批量写回数据库
         
-        # 添加歌曲作者奖励信息（如果有）
-        if song_author_rewards:
-            result['song_author_rewards'] = song_author_rewards
+        写入语句数量为 ceil(分配结果数 / 批大小) + 1：bulk_create 分批写入 BidResult
+        （批大小取 ALLOCATION_WRITE_BATCH_SIZE 与数据库参数上限中较小者），
+        再用一次 UPDATE 将所有未中标的有效竞标标记为drop。
         
-        return result
+        Args:
+            bidding_round: 竞标轮次
+            plan: _compute_allocation 返回的分配结果
+        """
+        bidding_type = bidding_round.bidding_type
+        target_field = 'song_id' if bidding_type == 'song' else 'chart_id'
+        
+        results = [
+            BidResult(
+                bidding_round=bidding_round,
+                user_id=user_id,
+                bid_type=bidding_type,
+                bid_amount=amount,
+                allocation_type='win',
+                **{target_field: target_id}
+            )
+            for _, user_id, target_id, amount in plan['winners']
+        ]
+        results.extend(
+            BidResult(
+                bidding_round=bidding_round,
+                user_id=user_id,
+                bid_type=bidding_type,
+                bid_amount=RANDOM_ALLOCATION_COST,  # 保底分配需要支付代币
+                allocation_type='random',
+                **{target_field: target_id}
+            )
+            for user_id, target_id in plan['random_assignments']
+        )
+        BidResult.objects.bulk_create(results, batch_size=ALLOCATION_WRITE_BATCH_SIZE)
+        
+        # 除中标竞标外，该轮次所有有效竞标一律drop
+        # 用户与目标一一对应，(user, target) 即可唯一确定中标竞标
+        winning_result = BidResult.objects.filter(
+            bidding_round=bidding_round,
+            allocation_type='win',
+            user_id=OuterRef('user_id'),
+            **{target_field: OuterRef(target_field)}
+        )
+        Bid.objects.filter(
+            bidding_round=bidding_round,
+            is_dropped=False
+        ).exclude(Exists(winning_result)).update(
+            is_dropped=True,
+            updated_at=timezone.now()
+        )
     
     @staticmethod
     def create_bid(user, bidding_round, amount, song=None, chart=None):
@@ -350,6 +669,156 @@ class BiddingService:
         
         return bid
     
+    @staticmethod
+    @transaction.atomic
+    def settle_allocation_tokens(bidding_round_id, ignore_token_overshoot=False):
+        """
+        结算一轮分配的全部代币变化（竞标扣除 + 歌曲作者奖励）
+        
+        逻辑：
+        1. 一次查询读取该轮次所有分配结果及歌曲作者
+        2. 为缺少资料的用户批量创建 UserProfile
+        3. 一次查询（select_for_update）读取并锁定相关用户余额，在内存中推算结算结果
+        4. 用固定数量的基于 F() 的 UPDATE 语句写回：
+           - 代币不足且忽略超额时，扣光代币
+           - 余额足够的用户扣除竞标金额（条件更新 token >= 金额）
+           - 歌曲作者按被分配歌曲数量获得奖励
+        
+        Args:
+            bidding_round_id: 竞标轮次ID
+            ignore_token_overshoot: 是否忽略代币不足的用户（默认False，记录为失败）
+            
+        Returns:
+            dict: 包含以下键
+                - token_deduction: 与 process_allocation_tokens 返回值格式一致
+                - song_author_rewards: 与 process_song_author_rewards 返回值格式一致
+            
+        Raises:
+            ValidationError: 如果竞标轮次不存在
+        """
+        
+        # 获取竞标轮次
+        try:
+            bidding_round = BiddingRound.objects.get(id=bidding_round_id)
+        except BiddingRound.DoesNotExist:
+            raise ValidationError('竞标轮次不存在')
+        
+        return BiddingService._settle_round_tokens(
+            bidding_round,
+            ignore_token_overshoot=ignore_token_overshoot
+        )
+    
+    @staticmethod
+    def _settle_round_tokens(bidding_round, charge=True, reward=True, ignore_token_overshoot=False):
+        """
+        基于集合操作的代币结算（需在事务中调用）
+        
+        Args:
+            bidding_round: 竞标轮次
+            charge: 是否扣除竞标金额
+            reward: 是否发放歌曲作者奖励（仅歌曲竞标有效）
+            ignore_token_overshoot: 是否忽略代币不足的用户
+            
+        Returns:
+            dict: 包含 token_deduction 和 song_author_rewards 两项统计
+        """
+        round_results = BidResult.objects.filter(bidding_round=bidding_round)
+        results = list(round_results.values_list(
+            'user_id', 'bid_amount', 'allocation_type', 'song__user_id'
+        ))
+        reward = reward and bidding_round.bidding_type == 'song'
+        
+        charges = [
+            (user_id, bid_amount, ALLOCATION_TRANSACTION_TYPES[allocation_type])
+            for user_id, bid_amount, allocation_type, _ in results
+        ] if charge else []
+        author_ids = [
+            author_id for _, _, _, author_id in results if author_id is not None
+        ] if reward else []
+        user_ids = set(user_id for user_id, _, _ in charges) | set(author_ids)
+        
+        # 为缺少资料的用户批量创建（使用默认代币）
+        charged_users = round_results.values('user_id')
+        authors = round_results.filter(song__isnull=False).values('song__user_id')
+        involved = UserProfile.objects.filter(
+            Q(user_id__in=charged_users) | Q(user_id__in=authors)
+        )
+        existing = set(involved.values_list('user_id', flat=True))
+        missing = user_ids - existing
+        if missing:
+            # bulk_create 不触发信号，期初流水在此一并写入
+            default_token = UserProfile._meta.get_field('token').default
+            UserProfile.objects.bulk_create(
+                [UserProfile(user_id=user_id) for user_id in missing],
+                ignore_conflicts=True
+            )
+            TokenTransaction.objects.bulk_create([
+                TokenTransaction(
+                    user_id=user_id,
+                    transaction_type='opening',
+                    amount=default_token,
+                    balance_after=default_token,
+                )
+                for user_id in missing
+            ])
+        
+        # 读取并锁定余额，在内存中推算结算结果
+        balances = dict(involved.select_for_update().values_list('user_id', 'token'))
+        settlement = BiddingService._plan_settlement(
+            charges,
+            author_ids,
+            balances,
+            {},
+            ignore_token_overshoot=ignore_token_overshoot
+        )
+        token_deduction = settlement['token_deduction']
+        
+        # 失败记录需要用户名，仅在有失败时查询
+        failed_users = token_deduction['failed_users']
+        if failed_users:
+            usernames = dict(User.objects.filter(
+                id__in=[entry['user_id'] for entry in failed_users]
+            ).values_list('id', 'username'))
+            for entry in failed_users:
+                entry['user'] = usernames.get(entry['user_id'])
+        
+        if charge:
+            required = Subquery(
+                round_results.filter(user_id=OuterRef('user_id')).values('bid_amount')[:1]
+            )
+            charged_profiles = UserProfile.objects.filter(user_id__in=charged_users)
+            if ignore_token_overshoot:
+                # 扣光代币，不报错
+                charged_profiles.filter(token__lt=required).update(token=0)
+            charged_profiles.filter(token__gte=required).update(token=F('token') - required)
+        
+        if reward:
+            song_count = Subquery(
+                round_results.filter(song__user_id=OuterRef('user_id'))
+                .order_by().values('song__user_id')
+                .annotate(count=Count('id')).values('count')[:1]
+            )
+            UserProfile.objects.filter(user_id__in=authors).update(
+                token=F('token') + song_count * SONG_AUTHOR_REWARD
+            )
+        
+        # 追加代币流水（余额已在锁定状态下推算，与上面的更新一致）
+        TokenTransaction.objects.bulk_create([
+            TokenTransaction(
+                user_id=user_id,
+                transaction_type=transaction_type,
+                amount=amount,
+                balance_after=balance_after,
+                bidding_round=bidding_round,
+            )
+            for user_id, transaction_type, amount, balance_after in settlement['transactions']
+        ])
+        
+        return {
+            'token_deduction': token_deduction,
+            'song_author_rewards': settlement['song_author_rewards'],
+        }
+    
     @staticmethod
     @transaction.atomic
     def process_allocation_tokens(bidding_round_id,ignore_token_overshoot:bool=False):
@@ -359,9 +828,12 @@ class BiddingService:
         逻辑：
         1. 获取该轮次的所有分配结果
         2. 对于每个中标的用户，从其代币中扣除竞标金额
-        3. 随机分配的用户（bid_amount=0）不扣除代币
+        3. 随机分配的用户扣除保底代币
         4. 返回处理统计
         
+        余额检查与扣除均为集合操作，语句数量与分配结果数量无关，
+        详见 _settle_round_tokens。
+        
         Args:
             bidding_round_id: 竞标轮次ID
             ignore_token_overshoot:bool=False 是否忽略代币不足的用户（默认False，抛出异常）。
@@ -380,52 +852,12 @@ class BiddingService:
         except BiddingRound.DoesNotExist:
             raise ValidationError('竞标轮次不存在')
         
-        # 获取该轮次的所有分配结果（包括竞价和随机分配）
-        results = BidResult.objects.filter(
-            bidding_round=bidding_round
-        ).select_related('user', 'song')
-        
-        total_deducted = 0
-        users_deducted = 0
-        failed_users = []
-        
-        for result in results:
-            try:
-                # 获取或创建用户资料
-                profile, created = UserProfile.objects.get_or_create(user=result.user)
-                
-                # 验证代币足够
-                if (profile.token < result.bid_amount):
-                    if not ignore_token_overshoot:
-                        failed_users.append({
-                            'user': result.user.username,
-                            'required': result.bid_amount,
-                            'available': profile.token
-                        })
-                    else:
-                        profile.token = 0 # 扣光代币，不报错
-                        profile.save()
-                    continue
-                
-                # 扣除代币
-                profile.token -= result.bid_amount
-                profile.save()
-                
-                total_deducted += result.bid_amount
-                users_deducted += 1
-                
-            except Exception as e:
-                failed_users.append({
-                    'user': result.user.username,
-                    'error': str(e)
-                })
-        
-        return {
-            'total_deducted': total_deducted,
-            'users_deducted': users_deducted,
-            'failed_users': failed_users,
-            'failed_count': len(failed_users),
-        }
+        settlement = BiddingService._settle_round_tokens(
+            bidding_round,
+            reward=False,
+            ignore_token_overshoot=ignore_token_overshoot
+        )
+        return settlement['token_deduction']
     
     @staticmethod
     @transaction.atomic
@@ -436,7 +868,7 @@ class BiddingService:
         逻辑：
         1. 获取该轮次所有歌曲竞标的分配结果
         2. 找到被分配的歌曲的原作者
-        3. 给每个歌曲作者奖励100代币
+        3. 给每个歌曲作者按被分配歌曲数量奖励 SONG_AUTHOR_REWARD 代币（一条 UPDATE 完成）
         
         Args:
             bidding_round_id: 竞标轮次ID
@@ -462,50 +894,8 @@ class BiddingService:
                 'total_reward': 0
             }
         
-        # 获取该轮次所有歌曲分配结果
-        results = BidResult.objects.filter(
-            bidding_round=bidding_round,
-            bid_type='song'
-        ).select_related('song', 'song__user')
-        
-        # 统计每个歌曲作者的奖励（一个作者可能有多首歌被分配）
-        author_rewards = {}  # user_id -> reward_count
-        
-        for result in results:
-            if result.song and result.song.user:
-                author_id = result.song.user.id
-                author_rewards[author_id] = author_rewards.get(author_id, 0) + 1
-        
-        # 给每个歌曲作者发放奖励代币
-        total_rewarded = 0
-        rewarded_authors = 0
-        failed_rewards = []
-        
-        for author_id, reward_count in author_rewards.items():
-            try:
-                author = User.objects.get(id=author_id)
-                profile, created = UserProfile.objects.get_or_create(user=author)
-                
-                # 每首被分配的歌曲奖励100代币
-                reward_amount = reward_count * 100
-                profile.token += reward_amount
-                profile.save()
-                
-                total_rewarded += reward_amount
-                rewarded_authors += 1
-                
-            except Exception as e:
-                failed_rewards.append({
-                    'author_id': author_id,
-                    'error': str(e)
-                })
-        
-        return {
-            'message': f'歌曲作者奖励发放完成',
-            'rewarded_authors': rewarded_authors,
-            'total_reward': total_rewarded,
-            'failed_rewards': failed_rewards,
-        }
+        settlement = BiddingService._settle_round_tokens(bidding_round, charge=False)
+        return settlement['song_author_rewards']
     
     @staticmethod
     def get_user_bids(user, bidding_round):
@@ -547,7 +937,7 @@ class PeerReviewService:
     
     @staticmethod
     @transaction.atomic
-    def allocate_peer_reviews(bidding_round_id, reviews_per_user=None):
+    def allocate_peer_reviews(bidding_round_id, reviews_per_user=None, mode='flow', seed=None):
         """
         为某个竞标轮次分配互评任务
         
@@ -557,9 +947,10 @@ class PeerReviewService:
         3. 用户不能评自己的任何谱面（支持一人多谱场景）
         
         算法（平衡二分图匹配）：
-        - 使用贪心算法进行逐步分配
-        - 维护每个评分者和谱面的剩余评分数
-        - 采用轮转策略保证均衡
+        - 谱面按剩余需求放入优先队列，逐张处理
+        - 评分者按剩余任务数放入最大堆，每张谱面取剩余任务最多的非作者评分者
+        - 维护每个评分者和谱面的剩余评分数，保证均衡
+        详见 _plan_peer_reviews。
         
         平衡条件：
         谱面数 × 每谱面评分数 = 评分者数 × 每人评分任务数
@@ -568,6 +959,9 @@ class PeerReviewService:
             bidding_round_id: 竞标轮次ID
             reviews_per_user: 每个评分者的评分任务数（默认从settings读取PEER_REVIEW_TASKS_PER_USER）
                             如果谱面数 ≠ 评分者数，会自动计算每谱面的评分数
+            mode: 分配模式，'flow'（默认，贪心 + 增广路，存在平衡分配时一定成功）
+                  或 'greedy'（仅贪心）
+            seed: 随机种子（可选，相同种子和数据得到相同的分配结果）
             
         Returns:
             dict: 包含分配结果统计
@@ -590,24 +984,34 @@ class PeerReviewService:
         # 获取该轮所有已提交的谱面
         charts = Chart.objects.filter(
             bidding_round=bidding_round,
-            status__in=['submitted', 'under_review', 'reviewed']
-        ).select_related('user', 'song', 'completion_bid_result__user')
+            status__in=['submitted', 'final_submitted', 'under_review', 'reviewed']
+        )
+        
+        # 建立谱面与其所有参与者的映射（支持两部分合作谱面）
+        # 一张谱面可能有：
+        # 1. 只有第一部分作者（chart.user）
+        # 2. 第一部分作者 + 第二部分作者（chart.user + chart.completion_bid_result.user）
+        chart_contributors_map = {}
+        for chart_id, owner_id, completion_user_id in charts.values_list(
+            'id', 'user_id', 'completion_bid_result__user_id'
+        ):
+            contributors = {owner_id}  # 第一部分作者
+            
+            # 如果有第二部分（续写者），也加入贡献者集合
+            if completion_user_id is not None:
+                contributors.add(completion_user_id)
+            
+            chart_contributors_map[chart_id] = contributors
         
-        if not charts.exists():
+        if not chart_contributors_map:
             raise ValidationError('该轮次还没有提交的谱面')
         
         # 获取参与评分的用户（所有参与谱面创作的用户）
         # 包括：第一部分作者 + 第二部分续写者
-        reviewer_ids = set()
-        for chart in charts:
-            reviewer_ids.add(chart.user_id)  # 第一部分作者
-            if chart.completion_bid_result:
-                reviewer_ids.add(chart.completion_bid_result.user_id)  # 第二部分作者
-        
-        reviewers = User.objects.filter(id__in=reviewer_ids)
+        reviewer_ids = set().union(*chart_contributors_map.values())
         
-        num_charts = charts.count()
-        num_reviewers = reviewers.count()
+        num_charts = len(chart_contributors_map)
+        num_reviewers = len(reviewer_ids)
         
         # 计算平衡分配参数
         # 平衡条件：num_charts × reviews_per_chart = num_reviewers × reviews_per_user
@@ -629,119 +1033,527 @@ class PeerReviewService:
         print(f"[互评分配] 每人评{reviews_per_user}张，每谱面被评{reviews_per_chart}次")
         print(f"[互评分配] 总分配数：{total_assignments_needed}")
         
+        # 先在内存中完成分配（失败时不会删除已有分配）
+        if mode not in ('flow', 'greedy'):
+            raise ValidationError(f'不支持的分配模式：{mode}')
+        pairs = PeerReviewService._plan_peer_reviews(
+            chart_contributors_map,
+            reviewer_ids,
+            reviews_per_chart,
+            reviews_per_user,
+            rng=random.Random(seed),
+            mode=mode
+        )
+        
         # 清空已有的分配（重新分配）
         PeerReviewAllocation.objects.filter(
             bidding_round=bidding_round
         ).delete()
         
-        # 转换为列表便于操作
-        charts_list = list(charts)
-        reviewers_list = list(reviewers)
+        allocations = [
+            PeerReviewAllocation(
+                bidding_round=bidding_round,
+                reviewer_id=reviewer_id,
+                chart_id=chart_id
+            )
+            for reviewer_id, chart_id in pairs
+        ]
         
-        # 初始化分配计数
-        chart_review_counts = {chart.id: 0 for chart in charts_list}
-        reviewer_task_counts = {reviewer.id: 0 for reviewer in reviewers_list}
+        # 批量创建分配记录
+        PeerReviewAllocation.objects.bulk_create(allocations)
         
-        # 建立谱面与其所有参与者的映射（支持两部分合作谱面）
-        # 一张谱面可能有：
-        # 1. 只有第一部分作者（chart.user）
-        # 2. 第一部分作者 + 第二部分作者（chart.user + chart.completion_bid_result.user）
-        chart_contributors_map = {}
-        for chart in charts_list:
-            contributors = {chart.user_id}  # 第一部分作者
+        # 更新所有谱面状态为 under_review
+        Chart.objects.filter(
+            bidding_round=bidding_round,
+            status__in=['submitted', 'final_submitted']
+        ).update(status='under_review')
+        
+        return {
+            'bidding_round_id': bidding_round_id,
+            'total_allocations': len(allocations),
+            'charts_count': num_charts,
+            'reviewers_count': num_reviewers,
+            'reviews_per_chart': reviews_per_chart,
+            'tasks_per_reviewer': reviews_per_user,
+            'mode': mode,
+            'status': 'success'
+        }
+    
+    @staticmethod
+    def _plan_peer_reviews(chart_contributors, reviewer_ids, reviews_per_chart, reviews_per_user,
+                           rng=None, mode='flow'):
+        """
+        在内存中计算互评分配（纯计算，不访问数据库）
+        
+        谱面按剩余需求（相同时贡献者多的优先）放入优先队列；评分者按剩余任务数
+        放入最大堆。每张谱面从堆顶依次取出评分者，跳过该谱面的贡献者，
+        取满 reviews_per_chart 个后将其剩余任务数减一放回堆中。
+        总复杂度 O(谱面数 × 每谱面评分数 × log 评分者数)。
+        
+        贪心在贡献者集合重叠（两部分合作谱面）时可能在存在可行解的情况下失败：
+        - mode='greedy'：直接报错
+        - mode='flow'：把贪心结果视为二分图上的一个流，用增广路补齐缺口
+          （见 _augment_peer_reviews），存在平衡分配时一定能找到，否则报错
+        
+        Args:
+            chart_contributors: 谱面ID -> 贡献者用户ID集合
+            reviewer_ids: 评分者用户ID集合
+            reviews_per_chart: 每张谱面需要的评分数
+            reviews_per_user: 每个评分者的任务数
+            rng: 随机数生成器（用于同优先级时打散顺序，默认使用 random 模块；
+                 传入 random.Random(seed) 可复现分配结果）
+            mode: 'flow'（默认）或 'greedy'
             
-            # 如果有第二部分（续写者），也加入贡献者集合
-            if chart.completion_bid_result:
-                contributors.add(chart.completion_bid_result.user_id)
+        Returns:
+            list: [(reviewer_id, chart_id), ...]
+            
+        Raises:
+            ValidationError: 如果找不到满足条件的平衡分配
+        """
+        rng = rng or random
+        PeerReviewService._check_peer_review_feasibility(
+            chart_contributors, reviewer_ids, reviews_per_chart, reviews_per_user
+        )
+        
+        # 评分者最大堆：(-剩余任务数, 随机序, reviewer_id)
+        reviewer_heap = [(-reviews_per_user, rng.random(), reviewer_id) for reviewer_id in reviewer_ids]
+        heapq.heapify(reviewer_heap)
+        
+        # 谱面优先队列：(-剩余需求, -贡献者数, 随机序, chart_id)
+        chart_heap = [
+            (-reviews_per_chart, -len(contributors), rng.random(), chart_id)
+            for chart_id, contributors in chart_contributors.items()
+        ]
+        heapq.heapify(chart_heap)
+        
+        pairs = []
+        deficits = {}  # 谱面ID -> 贪心阶段未能补齐的评分数（仅flow模式）
+        while chart_heap:
+            neg_demand, _, _, chart_id = heapq.heappop(chart_heap)
+            contributors = chart_contributors[chart_id]
+            
+            picked = []
+            skipped = []
+            while len(picked) < -neg_demand and reviewer_heap:
+                entry = heapq.heappop(reviewer_heap)
+                if entry[2] in contributors:
+                    skipped.append(entry)  # 不能评自己参与的谱面
+                else:
+                    picked.append(entry)
+            
+            if len(picked) < -neg_demand:
+                if mode != 'flow':
+                    raise ValidationError(
+                        f'分配失败：无法为谱面 {chart_id} (已有{len(picked)}个评分) 找到合适的评分者。'
+                        f'可能原因：评分者都已达到任务上限或都是该作者的谱面。'
+                    )
+                deficits[chart_id] = -neg_demand - len(picked)
             
-            chart_contributors_map[chart.id] = contributors
+            for neg_remaining, _, reviewer_id in picked:
+                pairs.append((reviewer_id, chart_id))
+                if neg_remaining + 1 < 0:
+                    heapq.heappush(reviewer_heap, (neg_remaining + 1, rng.random(), reviewer_id))
+            for entry in skipped:
+                heapq.heappush(reviewer_heap, entry)
+        
+        if deficits:
+            pairs = PeerReviewService._augment_peer_reviews(
+                chart_contributors, reviewer_ids, reviews_per_user, pairs, deficits
+            )
+        
+        return pairs
+    
+    @staticmethod
+    def _check_peer_review_feasibility(chart_contributors, reviewer_ids, reviews_per_chart, reviews_per_user):
+        """
+        快速检查平衡分配的必要条件，不满足时直接报错
         
-        # 创建分配记录
-        allocations = []
+        1. 每张谱面的非贡献者评分者数 >= 每谱面评分数
+        2. 每个评分者可评的谱面数（非自己参与的） >= 每人任务数
         
-        # 用集合跟踪已分配的(reviewer_id, chart_id)组合，避免重复
-        assigned_pairs = set()
+        Raises:
+            ValidationError: 如果必要条件不满足
+        """
+        reviewer_ids = set(reviewer_ids)
+        num_reviewers = len(reviewer_ids)
+        own_chart_counts = defaultdict(int)
+        for chart_id, contributors in chart_contributors.items():
+            own = len(contributors & reviewer_ids)
+            if num_reviewers - own < reviews_per_chart:
+                raise ValidationError(
+                    f'无法进行平衡分配：谱面 {chart_id} 只有 {num_reviewers - own} 个可选评分者，'
+                    f'少于每谱面需要的 {reviews_per_chart} 次评分。'
+                )
+            for user_id in contributors:
+                own_chart_counts[user_id] += 1
+        
+        num_charts = len(chart_contributors)
+        for reviewer_id, own_count in own_chart_counts.items():
+            if num_charts - own_count < reviews_per_user:
+                raise ValidationError(
+                    f'无法进行平衡分配：用户 {reviewer_id} 只有 {num_charts - own_count} 张可评谱面，'
+                    f'少于每人 {reviews_per_user} 个评分任务。'
+                )
+    
+    @staticmethod
+    def _augment_peer_reviews(chart_contributors, reviewer_ids, reviews_per_user, pairs, deficits):
+        """
+        用增广路补齐贪心分配的缺口（纯计算，不访问数据库）
         
-        # 使用循环轮转算法进行分配
-        reviewer_idx = 0
-        for _ in range(total_assignments_needed):
-            # 找到需要被评分的谱面（评分数最少的）
-            chart = min(charts_list, key=lambda c: chart_review_counts[c.id])
+        把分配看作二分图上的流：谱面需求 reviews_per_chart，评分者容量 reviews_per_user，
+        非贡献者之间均有边。每次从所有有缺口的谱面出发做 BFS：
+        - 谱面 → 评分者：该评分者不是贡献者且尚未评该谱面
+        - 评分者 → 谱面：该评分者当前已分配的谱面（可以把它让出去）
+        找到仍有剩余任务的评分者即得到一条增广路，沿路调整分配使缺口减一。
+        图几乎是完全二分图，因此不显式建边：用“未访问评分者集合”扫描，
+        每张谱面只会跳过其贡献者和已分配的评分者，一次 BFS 为 O(评分者数 + 谱面数 × 每谱面评分数)。
+        找不到增广路时当前流已是最大流，说明不存在平衡分配。
+        
+        Args:
+            chart_contributors: 谱面ID -> 贡献者用户ID集合
+            reviewer_ids: 评分者用户ID集合
+            reviews_per_user: 每个评分者的任务数
+            pairs: 贪心阶段得到的 [(reviewer_id, chart_id), ...]
+            deficits: 谱面ID -> 缺少的评分数
             
-            # 如果这个谱面已经收到足够的评分，跳过
-            if chart_review_counts[chart.id] >= reviews_per_chart:
-                continue
+        Returns:
+            list: 补齐后的 [(reviewer_id, chart_id), ...]
             
-            # 循环找到一个合适的评分者
-            found_reviewer = False
-            attempts = 0
-            while attempts < len(reviewers_list):
-                reviewer = reviewers_list[reviewer_idx % len(reviewers_list)]
-                reviewer_idx += 1
-                attempts += 1
-                
-                # 检查这个评分者是否满足条件
-                # 1. 没有超过任务数限制
-                # 2. 不是该谱面的任何贡献者（第一部分作者或第二部分续写者）
-                # 3. 还没有评过这个谱面
-                is_contributor = reviewer.id in chart_contributors_map.get(chart.id, set())
-                already_assigned = (reviewer.id, chart.id) in assigned_pairs
+        Raises:
+            ValidationError: 如果不存在满足条件的平衡分配
+        """
+        chart_reviewers = defaultdict(set)
+        reviewer_charts = defaultdict(set)
+        for reviewer_id, chart_id in pairs:
+            chart_reviewers[chart_id].add(reviewer_id)
+            reviewer_charts[reviewer_id].add(chart_id)
+        spare = {
+            reviewer_id: reviews_per_user - len(reviewer_charts[reviewer_id])
+            for reviewer_id in reviewer_ids
+        }
+        spare_reviewers = set(reviewer_id for reviewer_id, count in spare.items() if count > 0)
+        deficits = {chart_id: count for chart_id, count in deficits.items() if count > 0}
+        
+        while deficits:
+            # 多源 BFS：从所有有缺口的谱面同时出发
+            reached_from = {}                               # 评分者 -> 到达它的谱面
+            came_from = {chart_id: None for chart_id in deficits}  # 谱面 -> 让出该谱面的评分者
+            unvisited = set(reviewer_ids)
+            queue = deque(deficits)
+            found = None
+            
+            while queue and found is None:
+                chart_id = queue.popleft()
+                contributors = chart_contributors[chart_id]
+                assigned = chart_reviewers[chart_id]
                 
-                if (reviewer_task_counts[reviewer.id] < reviews_per_user and
-                    not is_contributor and
-                    not already_assigned):
-                    
-                    # 创建分配
-                    allocation = PeerReviewAllocation(
-                        bidding_round=bidding_round,
-                        reviewer=reviewer,
-                        chart=chart
-                    )
-                    allocations.append(allocation)
-                    assigned_pairs.add((reviewer.id, chart.id))
-                    
-                    chart_review_counts[chart.id] += 1
-                    reviewer_task_counts[reviewer.id] += 1
-                    found_reviewer = True
+                # 剩余任务的评分者通常很少，先直接检查，命中则无需展开整层
+                for reviewer_id in spare_reviewers:
+                    if (reviewer_id in unvisited and reviewer_id not in contributors
+                            and reviewer_id not in assigned):
+                        reached_from[reviewer_id] = chart_id
+                        found = reviewer_id
+                        break
+                if found is not None:
                     break
+                
+                reached = [
+                    reviewer_id for reviewer_id in unvisited
+                    if reviewer_id not in contributors and reviewer_id not in assigned
+                ]
+                unvisited.difference_update(reached)
+                
+                for reviewer_id in reached:
+                    reached_from[reviewer_id] = chart_id
+                    for next_chart in reviewer_charts[reviewer_id]:
+                        if next_chart not in came_from:
+                            came_from[next_chart] = reviewer_id
+                            queue.append(next_chart)
             
-            if not found_reviewer:
-                # 提供更详细的错误信息
-                chart_owner = chart.user.username
-                chart_reviews = chart_review_counts[chart.id]
+            if found is None:
+                chart_id = next(iter(deficits))
                 raise ValidationError(
-                    f'分配失败：无法为谱面 {chart.id} (作者:{chart_owner}, 已有{chart_reviews}个评分) 找到合适的评分者。'
-                    f'可能原因：评分者都已达到任务上限或都是该作者的谱面。'
+                    f'分配失败：不存在满足条件的平衡分配，谱面 {chart_id} '
+                    f'还缺少 {deficits[chart_id]} 个评分者。'
+                    f'请调整 reviews_per_user 参数或检查谱面的作者/续写者设置。'
                 )
+            
+            # 沿增广路调整：每个评分者改评前一张谱面，最后一个评分者用掉一个剩余任务
+            spare[found] -= 1
+            if not spare[found]:
+                spare_reviewers.discard(found)
+            reviewer_id = found
+            while True:
+                chart_id = reached_from[reviewer_id]
+                chart_reviewers[chart_id].add(reviewer_id)
+                reviewer_charts[reviewer_id].add(chart_id)
+                previous = came_from[chart_id]
+                if previous is None:
+                    deficits[chart_id] -= 1
+                    if not deficits[chart_id]:
+                        del deficits[chart_id]
+                    break
+                chart_reviewers[chart_id].discard(previous)
+                reviewer_charts[previous].discard(chart_id)
+                reviewer_id = previous
+        
+        return [
+            (reviewer_id, chart_id)
+            for chart_id, reviewers in chart_reviewers.items()
+            for reviewer_id in reviewers
+        ]
+    
+    @staticmethod
+    @transaction.atomic
+    def rebalance_peer_reviews(bidding_round_id, reviewer_id=None, chart_id=None):
+        """
+        增量调整互评分配（不删除整轮分配）
         
-        # 批量创建分配记录
-        PeerReviewAllocation.objects.bulk_create(allocations)
+        只移动受影响的待完成（pending）分配，已完成的分配和 PeerReview 保持不变：
+        - reviewer_id：该评分者退出，其待完成任务逐个转给当前任务最少的合格评分者
+        - chart_id：补充迟到的谱面，按本轮每谱面评分数为其分配评分者；
+          若其作者/续写者尚未参与评分，则从任务最多的评分者处转来待完成任务，
+          使其任务数与其他人持平
         
-        # 更新所有谱面状态为 under_review
-        Chart.objects.filter(
-            bidding_round=bidding_round,
-            status__in=['submitted']
-        ).update(status='under_review')
+        每条移动都用条件更新（status='pending'）完成，与正在提交的评分互不覆盖：
+        若某任务在移动前已被提交，则保留原评分者。
+        写入的行数与受影响的任务数成正比，与整轮规模无关。
+        
+        平衡性：每张谱面的评分数保持不变；评分者之间的任务数差距尽量不超过1。
+        
+        Args:
+            bidding_round_id: 竞标轮次ID
+            reviewer_id: 退出的评分者用户ID（可选）
+            chart_id: 迟到的谱面ID（可选）
+            
+        Returns:
+            dict: 包含 moved（移动的任务数）、created（新建的任务数）、
+                  skipped（移动前已完成而保留的任务数）等统计
+            
+        Raises:
+            ValidationError: 如果参数不合法或找不到合适的评分者
+        """
+        from .models import Chart, PeerReviewAllocation
+        
+        if reviewer_id is None and chart_id is None:
+            raise ValidationError('请指定需要调整的评分者或谱面')
+        
+        try:
+            bidding_round = BiddingRound.objects.get(id=bidding_round_id)
+        except BiddingRound.DoesNotExist:
+            raise ValidationError('竞标轮次不存在')
+        
+        round_allocations = PeerReviewAllocation.objects.filter(bidding_round=bidding_round)
+        
+        # 评分者当前任务数（一次 GROUP BY）
+        # 只有仍有待完成任务的评分者接收新任务，已完成全部任务或已退出的评分者不再分配
+        reviewer_loads = list(
+            round_allocations.order_by().values('reviewer_id').annotate(
+                count=Count('id'),
+                pending=Count('id', filter=Q(status='pending'))
+            ).values_list('reviewer_id', 'count', 'pending')
+        )
+        if not reviewer_loads:
+            raise ValidationError('该轮次还没有分配互评任务，请先执行完整分配')
+        all_reviewers = set(candidate for candidate, _, _ in reviewer_loads)
+        loads = {
+            candidate: count
+            for candidate, count, pending in reviewer_loads
+            if pending and candidate != reviewer_id
+        }
+        
+        moved = 0
+        created = 0
+        skipped = 0
+        
+        # 待分配的槽位：[(chart_id, 待移动的分配ID或None), ...]
+        slots = []
+        if reviewer_id is not None:
+            slots.extend(
+                (allocation_chart_id, allocation_id)
+                for allocation_id, allocation_chart_id in round_allocations.filter(
+                    reviewer_id=reviewer_id,
+                    status='pending'
+                ).values_list('id', 'chart_id')
+            )
+        
+        if chart_id is not None:
+            try:
+                chart = Chart.objects.get(id=chart_id, bidding_round=bidding_round)
+            except Chart.DoesNotExist:
+                raise ValidationError('谱面不存在或不属于该轮次')
+            
+            # 本轮每谱面评分数取各谱面评分数的众数
+            chart_counts = Counter(
+                round_allocations.order_by().values('chart_id')
+                .annotate(count=Count('id')).values_list('count', flat=True)
+            )
+            existing = round_allocations.filter(chart_id=chart_id).count()
+            reviews_per_chart = chart_counts.most_common(1)[0][0]
+            slots.extend((chart_id, None) for _ in range(reviews_per_chart - existing))
+            
+            if chart.status in ('submitted', 'final_submitted'):
+                Chart.objects.filter(id=chart_id).update(status='under_review')
+        
+        # 受影响谱面的贡献者和已有评分者（只查询受影响的谱面）
+        affected_chart_ids = set(slot_chart_id for slot_chart_id, _ in slots)
+        if chart_id is not None:
+            affected_chart_ids.add(chart_id)
+        chart_contributors = defaultdict(set)
+        for affected_id, owner_id, completion_user_id in Chart.objects.filter(
+            id__in=affected_chart_ids
+        ).values_list('id', 'user_id', 'completion_bid_result__user_id'):
+            chart_contributors[affected_id].add(owner_id)
+            if completion_user_id is not None:
+                chart_contributors[affected_id].add(completion_user_id)
+        chart_reviewers = defaultdict(set)
+        for affected_id, existing_reviewer in round_allocations.filter(
+            chart_id__in=affected_chart_ids
+        ).values_list('chart_id', 'reviewer_id'):
+            chart_reviewers[affected_id].add(existing_reviewer)
+        
+        # 评分者最小堆：(当前任务数, reviewer_id)
+        reviewer_heap = [(load, candidate) for candidate, load in loads.items()]
+        heapq.heapify(reviewer_heap)
+        
+        new_allocations = []
+        for slot_chart_id, allocation_id in slots:
+            blocked = chart_contributors[slot_chart_id] | chart_reviewers[slot_chart_id]
+            skipped_entries = []
+            target = None
+            while reviewer_heap:
+                entry = heapq.heappop(reviewer_heap)
+                if entry[0] != loads.get(entry[1]):
+                    continue  # 过期的堆项
+                if entry[1] in blocked:
+                    skipped_entries.append(entry)
+                    continue
+                target = entry[1]
+                break
+            for entry in skipped_entries:
+                heapq.heappush(reviewer_heap, entry)
+            
+            if target is None:
+                raise ValidationError(
+                    f'调整失败：无法为谱面 {slot_chart_id} 找到合适的评分者'
+                )
+            
+            if allocation_id is None:
+                new_allocations.append(PeerReviewAllocation(
+                    bidding_round=bidding_round,
+                    reviewer_id=target,
+                    chart_id=slot_chart_id
+                ))
+                created += 1
+            else:
+                # 条件更新：仅移动仍未完成的任务
+                if not PeerReviewAllocation.objects.filter(
+                    id=allocation_id,
+                    status='pending'
+                ).update(reviewer_id=target):
+                    skipped += 1
+                    heapq.heappush(reviewer_heap, (loads[target], target))
+                    continue
+                moved += 1
+            
+            chart_reviewers[slot_chart_id].add(target)
+            loads[target] += 1
+            heapq.heappush(reviewer_heap, (loads[target], target))
+        
+        PeerReviewAllocation.objects.bulk_create(new_allocations)
+        
+        # 新谱面的作者/续写者加入评分者，从任务最多的评分者处转来待完成任务
+        if chart_id is not None and loads:
+            newcomers = chart_contributors[chart_id] - all_reviewers - {reviewer_id}
+            target_load = round(sum(loads.values()) / (len(loads) + len(newcomers)))
+            for newcomer in newcomers:
+                moved_to_newcomer, skipped_now = PeerReviewService._steal_pending_reviews(
+                    bidding_round, loads, newcomer, target_load
+                )
+                moved += moved_to_newcomer
+                skipped += skipped_now
+                loads[newcomer] = moved_to_newcomer
         
         return {
             'bidding_round_id': bidding_round_id,
-            'total_allocations': len(allocations),
-            'charts_count': num_charts,
-            'reviewers_count': num_reviewers,
-            'reviews_per_chart': reviews_per_chart,
-            'tasks_per_reviewer': reviews_per_user,
+            'moved': moved,
+            'created': created,
+            'skipped': skipped,
             'status': 'success'
         }
     
     @staticmethod
-    def submit_peer_review(allocation_id, score, comment=None):
+    def _steal_pending_reviews(bidding_round, loads, newcomer, target_load):
+        """
+        从任务最多的评分者处把待完成任务转给新评分者（需在事务中调用）
+        
+        Args:
+            bidding_round: 竞标轮次
+            loads: 评分者ID -> 当前任务数（会被原地更新）
+            newcomer: 新评分者用户ID
+            target_load: 新评分者的目标任务数
+            
+        Returns:
+            tuple: (转来的任务数, 转移前已完成而跳过的任务数)
+        """
+        from .models import Chart, PeerReviewAllocation
+        
+        round_allocations = PeerReviewAllocation.objects.filter(bidding_round=bidding_round)
+        moved = 0
+        skipped = 0
+        # 评分者最大堆：(-当前任务数, reviewer_id)
+        donor_heap = [(-load, donor) for donor, load in loads.items()]
+        heapq.heapify(donor_heap)
+        
+        # 新评分者自己参与的谱面和已评的谱面不能转入
+        own_charts = set(Chart.objects.filter(
+            Q(user_id=newcomer) | Q(completion_bid_result__user_id=newcomer),
+            bidding_round=bidding_round
+        ).values_list('id', flat=True))
+        own_charts |= set(round_allocations.filter(reviewer_id=newcomer).values_list('chart_id', flat=True))
+        
+        while moved < target_load and donor_heap:
+            neg_load, donor = heapq.heappop(donor_heap)
+            # 转出后捐出者任务数不能低于新评分者
+            if -neg_load - 1 < moved + 1:
+                break
+            candidates = round_allocations.filter(
+                reviewer_id=donor,
+                status='pending'
+            ).exclude(chart_id__in=own_charts).values_list('id', 'chart_id')[:1]
+            candidate = next(iter(candidates), None)
+            if candidate is None:
+                continue  # 该评分者没有可转出的任务
+            allocation_id, candidate_chart_id = candidate
+            if PeerReviewAllocation.objects.filter(
+                id=allocation_id,
+                status='pending'
+            ).update(reviewer_id=newcomer):
+                own_charts.add(candidate_chart_id)
+                loads[donor] -= 1
+                moved += 1
+            else:
+                skipped += 1
+            heapq.heappush(donor_heap, (-loads[donor], donor))
+        
+        return moved, skipped
+    
+    @staticmethod
+    @transaction.atomic
+    def submit_peer_review(allocation_id, score, comment=None, reviewer=None):
         """
         提交互评打分
         
+        并发安全：
+        - 分配任务用条件更新（status='pending'）认领，同一任务并发提交只有一个成功
+        - 谱面的评分数、总分、平均分在同一条 UPDATE 中用 F() 累加，不会丢失更新
+        - 收到全部评分时在同一条 UPDATE 中把谱面状态切换为 reviewed
+        
         Args:
             allocation_id: 分配任务ID
             score: 评分（0-PEER_REVIEW_MAX_SCORE）
             comment: 评论（可选）
+            reviewer: 评分者（可选，提供时只认领属于该用户的任务）
             
         Returns:
             PeerReview: 创建的评分记录
@@ -751,18 +1563,22 @@ class PeerReviewService:
         """
         from .models import PeerReviewAllocation, PeerReview, PEER_REVIEW_MAX_SCORE
         
-        try:
-            allocation = PeerReviewAllocation.objects.get(id=allocation_id)
-        except PeerReviewAllocation.DoesNotExist:
-            raise ValidationError('分配任务不存在')
-        
-        if allocation.status == 'completed':
-            raise ValidationError('该任务已完成')
-        
         # 验证评分
         if score < 0 or score > PEER_REVIEW_MAX_SCORE:
             raise ValidationError(f'评分必须在0-{PEER_REVIEW_MAX_SCORE}之间')
         
+        allocations = PeerReviewAllocation.objects.filter(id=allocation_id)
+        if reviewer is not None:
+            allocations = allocations.filter(reviewer=reviewer)
+        
+        # 认领任务：仅当任务仍未完成时标记为已完成
+        if not allocations.filter(status='pending').update(status='completed'):
+            if allocations.exists():
+                raise ValidationError('该任务已完成')
+            raise ValidationError('分配任务不存在')
+        
+        allocation = allocations.select_related('reviewer', 'chart').get()
+        
         # 创建评分记录
         review = PeerReview.objects.create(
             allocation=allocation,
@@ -772,22 +1588,25 @@ class PeerReviewService:
             comment=comment
         )
         
-        # 标记分配为已完成
-        allocation.status = 'completed'
-        allocation.save()
-        
-        # 更新谱面的评分统计（仅计数，平均分后期统计）
-        chart = allocation.chart
-        chart.review_count += 1
-        chart.total_score += score
-        
-        # 检查该谱面是否已收到所有评分
-        expected_reviews = getattr(settings, 'PEER_REVIEW_TASKS_PER_USER', 8)
-        if chart.review_count >= expected_reviews:
-            chart.status = 'reviewed'
-            chart.review_completed_at = review.created_at
-        
-        chart.save()
+        # 更新谱面的评分统计
+        # 该谱面的分配任务数即应收到的评分数；UPDATE 中 review_count 取更新前的值
+        expected_reviews = PeerReviewAllocation.objects.filter(
+            chart_id=allocation.chart_id
+        ).count()
+        all_reviewed = Q(review_count__gte=expected_reviews - 1)
+        Chart.objects.filter(id=allocation.chart_id).update(
+            review_count=F('review_count') + 1,
+            total_score=F('total_score') + score,
+            average_score=Cast(F('total_score') + score, FloatField()) / (F('review_count') + 1),
+            status=Case(
+                When(all_reviewed, then=Value('reviewed')),
+                default=F('status')
+            ),
+            review_completed_at=Case(
+                When(all_reviewed & Q(review_completed_at__isnull=True), then=Value(review.created_at)),
+                default=F('review_completed_at')
+            ),
+        )
         
         return review
     
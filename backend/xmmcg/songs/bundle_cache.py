@@ -0,0 +1,311 @@
+"""
+谱面打包缓存
+谱面提交后文件不再变化，打包好的 ZIP 按内容哈希保存在缓存目录中，下载时直接返回文件：
+生产环境交给 nginx（X-Accel-Redirect，由 nginx 处理 Range），DEBUG 下由 Django 返回并支持单段 Range。
+
+目录结构（CHART_BUNDLE_CACHE_DIR 下）：
+- objects/<哈希前两位>/<哈希>.zip   打包文件，文件名为 ZIP 内容的 SHA256
+- charts/<谱面ID>.json              谱面 -> 打包文件的索引（附带成员文件签名，文件变化时重新打包）
+
+缓存总大小超过 CHART_BUNDLE_CACHE_MAX_MB 时，按最近访问时间（命中时更新 mtime）淘汰。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from .zip_stream import ZipStream, CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class BundleCache:
+    """谱面打包缓存类"""
+
+    @staticmethod
+    def _cache_dir():
+        return str(settings.CHART_BUNDLE_CACHE_DIR)
+
+    @staticmethod
+    def _index_path(chart_id):
+        return os.path.join(BundleCache._cache_dir(), 'charts', f'{chart_id}.json')
+
+    @staticmethod
+    def _object_relpath(digest):
+        return f'{digest[:2]}/{digest}.zip'
+
+    @staticmethod
+    def _object_path(digest):
+        return os.path.join(BundleCache._cache_dir(), 'objects', BundleCache._object_relpath(digest))
+
+    @staticmethod
+    def get_members(chart):
+        """
+        谱面打包包含的文件
+
+        Returns:
+            list: [(ZIP 内文件名, FieldFile), ...]，只包含存储中存在的文件
+        """
+        members = []
+        if chart.chart_file and chart.chart_file.storage.exists(chart.chart_file.name):
+            members.append(('maidata.txt', chart.chart_file))
+
+        if chart.audio_file and chart.audio_file.storage.exists(chart.audio_file.name):
+            audio_ext = os.path.splitext(chart.audio_file.name)[1].lower() or '.mp3'
+            members.append((f'track{audio_ext}', chart.audio_file))
+
+        if chart.cover_image and chart.cover_image.storage.exists(chart.cover_image.name):
+            cover_ext = os.path.splitext(chart.cover_image.name)[1].lower() or '.jpg'
+            members.append((f'bg{cover_ext}', chart.cover_image))
+
+        if chart.background_video and chart.background_video.storage.exists(chart.background_video.name):
+            # 文件名包含 bg/pv 时按名称命名，否则默认 bg.mp4
+            basename = os.path.basename(chart.background_video.name).lower()
+            target_name = 'bg.mp4'
+            if basename.startswith('pv') or 'pv.' in basename:
+                target_name = 'pv.mp4'
+            elif basename.endswith('.mp4'):
+                target_name = 'bg.mp4'
+            else:
+                # 保留原扩展名
+                target_name = 'bg' + os.path.splitext(basename)[1].lower()
+            members.append((target_name, chart.background_video))
+        return members
+
+    @staticmethod
+    def build_stream(chart, members=None):
+        """
+        生成谱面的流式 ZIP（媒体文件原样存储，只压缩 maidata.txt）
+
+        Returns:
+            ZipStream: 可迭代输出的 ZIP，size 为总字节数
+        """
+        stream = ZipStream(timezone.localtime(chart.submitted_at or chart.created_at))
+        for name, field_file in members if members is not None else BundleCache.get_members(chart):
+            if name == 'maidata.txt':
+                # 上传时限制为 1MB，直接在内存中压缩
+                with field_file.open('rb') as f:
+                    stream.add_bytes(name, f.read())
+            else:
+                stream.add_file(name, field_file)
+        return stream
+
+    @staticmethod
+    def _signature(chart, members):
+        """成员文件签名：存储路径（上传时带随机后缀，替换文件即改变）+ 大小 + 打包时间"""
+        parts = [[name, field_file.name, field_file.size] for name, field_file in members]
+        parts.append(str(chart.submitted_at or chart.created_at))
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    @staticmethod
+    def _write_atomic(path, write):
+        """写入临时文件后原子替换，避免并发请求读到写了一半的文件"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def get_bundle(chart):
+        """
+        获取谱面的打包文件，不存在或成员文件已变化时重新打包
+
+        Returns:
+            tuple: (打包文件路径, 内容哈希)；谱面没有任何文件时返回 (None, None)
+        """
+        members = BundleCache.get_members(chart)
+        if not members:
+            return None, None
+        signature = BundleCache._signature(chart, members)
+
+        index_path = BundleCache._index_path(chart.id)
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            path = BundleCache._object_path(index['digest'])
+            if index['signature'] == signature and os.path.exists(path):
+                # 更新访问时间，供 LRU 淘汰
+                os.utime(path)
+                return path, index['digest']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        digest = BundleCache._build(chart, members)
+        BundleCache._write_atomic(
+            index_path,
+            lambda f: f.write(json.dumps({'signature': signature, 'digest': digest}).encode())
+        )
+        BundleCache.evict()
+        return BundleCache._object_path(digest), digest
+
+    @staticmethod
+    def _build(chart, members):
+        """打包到缓存目录，返回 ZIP 内容的 SHA256"""
+        stream = BundleCache.build_stream(chart, members)
+        objects_dir = os.path.join(BundleCache._cache_dir(), 'objects')
+        os.makedirs(objects_dir, exist_ok=True)
+
+        # 先写入临时文件算出哈希，再移动到以哈希命名的位置（相同内容的包只保留一份）
+        fd, tmp_path = tempfile.mkstemp(dir=objects_dir, suffix='.tmp')
+        try:
+            hasher = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in stream:
+                    hasher.update(chunk)
+                    f.write(chunk)
+            digest = hasher.hexdigest()
+            path = BundleCache._object_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        logger.info(f"谱面 {chart.id} 打包完成: {digest} ({stream.size} 字节)")
+        return digest
+
+    @staticmethod
+    def invalidate(chart_id):
+        """
+        删除谱面的打包索引（由 Chart.delete 调用）
+
+        打包文件按内容命名，可能被其他谱面的索引引用（也可能正由 nginx 发送），
+        因此只删除索引，不再被访问的打包文件由 evict 按最近访问时间淘汰。
+        """
+        try:
+            os.remove(BundleCache._index_path(chart_id))
+        except OSError:
+            pass
+
+    @staticmethod
+    def evict(max_bytes=None):
+        """
+        缓存超过上限时按最近访问时间淘汰最旧的打包文件
+
+        索引指向的文件被淘汰后，下次下载会重新打包。
+
+        Returns:
+            int: 删除的文件数
+        """
+        if max_bytes is None:
+            max_bytes = getattr(settings, 'CHART_BUNDLE_CACHE_MAX_MB', 2048) * 1024 * 1024
+        objects_dir = os.path.join(BundleCache._cache_dir(), 'objects')
+
+        files = []
+        for root, _, names in os.walk(objects_dir):
+            for name in names:
+                if not name.endswith('.zip'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    @staticmethod
+    def serve(request, chart, filename):
+        """
+        返回谱面打包下载响应
+
+        - ETag 为 ZIP 内容的 SHA256（强校验），If-None-Match 命中时返回 304
+        - CHART_BUNDLE_USE_X_ACCEL 开启时返回 X-Accel-Redirect，由 nginx 发送文件并处理 Range
+        - 否则由 Django 发送文件，支持单段 Range
+
+        Args:
+            request: 请求对象
+            chart: 谱面
+            filename: 下载文件名
+
+        Returns:
+            HttpResponse
+        """
+        path, digest = BundleCache.get_bundle(chart)
+        if path is None:
+            # 没有任何文件时返回空 ZIP
+            stream = BundleCache.build_stream(chart, [])
+            response = StreamingHttpResponse(stream, content_type='application/zip')
+            response['Content-Length'] = str(stream.size)
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
+
+        etag = f'"{digest}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            return response
+
+        if getattr(settings, 'CHART_BUNDLE_USE_X_ACCEL', False):
+            response = HttpResponse(content_type='application/zip')
+            prefix = getattr(settings, 'CHART_BUNDLE_ACCEL_PREFIX', '/protected-bundles/')
+            response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + BundleCache._object_relpath(digest)
+        else:
+            response = BundleCache._file_response(request, path)
+
+        response['ETag'] = etag
+        response['Accept-Ranges'] = 'bytes'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @staticmethod
+    def _file_response(request, path):
+        """由 Django 发送文件（支持单段 Range，无法满足时返回 416）"""
+        size = os.path.getsize(path)
+        match = RANGE_RE.match(request.headers.get('Range', '').strip())
+        if not match or (match.group(1) == '' and match.group(2) == ''):
+            return FileResponse(open(path, 'rb'), content_type='application/zip')
+
+        start, end = match.groups()
+        if start == '':
+            # bytes=-N：最后 N 个字节
+            start, end = max(size - int(end), 0), size - 1
+        else:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+        if start >= size or start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        def read_range():
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+        response = StreamingHttpResponse(read_range(), status=206, content_type='application/zip')
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+        return response
@@ -0,0 +1,179 @@
+"""
+Majdata.net 转发队列
+提交谱面时只写入 MajdataUpload（与谱面同一事务），由 run_majdata_worker 在后台上传：
+- 认领：pending 且到期的记录通过条件 UPDATE 改为 running，多个工作进程/线程不会重复上传同一条
+- 成功：标记 succeeded 并保存返回的地址，之后不再上传
+- 失败：按指数退避重新排队，超过最大次数后标记 failed（可在后台重新排队）
+- 工作进程中途退出：running 超过 MAJDATA_OUTBOX_STALE_SECONDS 的记录重新排队
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .majdata_service import MajdataService
+from .models import MajdataUpload
+
+logger = logging.getLogger(__name__)
+
+
+class MajdataOutboxService:
+    """Majdata.net 转发队列服务类"""
+
+    @staticmethod
+    def enqueue(chart):
+        """
+        将谱面加入转发队列（调用方应与创建谱面处于同一事务）
+
+        Returns:
+            MajdataUpload: 转发记录（已存在时返回原记录）
+        """
+        upload, _ = MajdataUpload.objects.get_or_create(chart=chart)
+        return upload
+
+    @staticmethod
+    def get_backoff(attempts):
+        """
+        第 attempts 次失败后的等待时间（指数退避，有上限）
+
+        Returns:
+            timedelta: 等待时间
+        """
+        base = getattr(settings, 'MAJDATA_OUTBOX_BACKOFF_SECONDS', 30)
+        maximum = getattr(settings, 'MAJDATA_OUTBOX_BACKOFF_MAX_SECONDS', 3600)
+        return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), maximum))
+
+    @staticmethod
+    def requeue_stale(now=None):
+        """
+        将上传中超时未完成的记录重新排队（工作进程崩溃或被重启时）
+
+        Returns:
+            int: 重新排队的记录数
+        """
+        now = now or timezone.now()
+        stale_before = now - timedelta(seconds=getattr(settings, 'MAJDATA_OUTBOX_STALE_SECONDS', 600))
+        count = MajdataUpload.objects.filter(
+            status='running',
+            locked_at__lt=stale_before
+        ).update(status='pending', next_attempt_at=now, locked_at=None)
+        if count:
+            logger.warning(f"{count} 条 Majdata 转发超时未完成，已重新排队")
+        return count
+
+    @staticmethod
+    def claim_due(limit, now=None):
+        """
+        认领到期的待上传记录
+
+        Args:
+            limit: 最多认领的记录数
+            now: 当前时间（默认 timezone.now()，用于测试）
+
+        Returns:
+            list: 认领成功的记录 ID
+        """
+        now = now or timezone.now()
+        candidates = list(
+            MajdataUpload.objects.filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        claimed = []
+        for upload_id in candidates:
+            # 条件更新：只有一个工作进程能把同一条记录从 pending 改为 running
+            if MajdataUpload.objects.filter(id=upload_id, status='pending').update(
+                status='running', locked_at=now, attempts=F('attempts') + 1
+            ):
+                claimed.append(upload_id)
+        return claimed
+
+    @staticmethod
+    def build_upload_data(chart):
+        """
+        生成 MajdataService.upload_chart 的参数
+
+        Returns:
+            dict: 谱面数据
+        """
+        maidata_content = ''
+        if chart.chart_file:
+            with chart.chart_file.open('rb') as f:
+                maidata_content = f.read().decode('utf-8')
+
+        return {
+            'maidata_content': maidata_content,
+            'audio_file': chart.song.audio_file if chart.song else None,
+            'cover_file': chart.cover_image if chart.cover_image else (chart.song.cover_image if hasattr(chart.song, 'cover_image') else None),
+            'video_file': chart.background_video if chart.background_video else None,
+            'is_part_chart': (chart.status == 'part_submitted'),
+            'folder_name': f"{chart.song.title}_{chart.user.username}" if chart.song else f"Chart_{chart.id}"
+        }
+
+    @staticmethod
+    def process(upload_id, now=None):
+        """
+        上传一条已认领的记录
+
+        Args:
+            upload_id: 转发记录 ID（需先通过 claim_due 认领）
+            now: 当前时间（默认 timezone.now()，用于测试）
+
+        Returns:
+            str: 处理后的状态（succeeded / pending / failed）
+        """
+        upload = MajdataUpload.objects.select_related('chart__song', 'chart__user').get(id=upload_id)
+        chart = upload.chart
+        upload_data = None
+        try:
+            upload_data = MajdataOutboxService.build_upload_data(chart)
+            result = MajdataService.upload_chart(upload_data)
+            error = '' if result else 'Majdata.net 上传失败（详见日志）'
+        except Exception as e:
+            result = None
+            error = str(e) or e.__class__.__name__
+        finally:
+            if upload_data:
+                for key in ('audio_file', 'cover_file', 'video_file'):
+                    field_file = upload_data.get(key)
+                    if field_file:
+                        field_file.close()
+
+        now = now or timezone.now()
+        queryset = MajdataUpload.objects.filter(id=upload_id, status='running')
+        if result:
+            external_url = ''
+            if isinstance(result, dict):
+                external_url = str(result.get('url') or result.get('chart_url') or result.get('message', ''))
+            queryset.update(status='succeeded', locked_at=None, last_error='', external_url=external_url[:500])
+            logger.info(f"✅ 谱面 {chart.id} 已转发到 Majdata.net: {external_url}")
+            return 'succeeded'
+
+        max_attempts = getattr(settings, 'MAJDATA_OUTBOX_MAX_ATTEMPTS', 8)
+        if upload.attempts >= max_attempts:
+            queryset.update(status='failed', locked_at=None, last_error=error)
+            logger.error(f"❌ 谱面 {chart.id} 转发 Majdata.net 失败 {upload.attempts} 次，已放弃: {error}")
+            return 'failed'
+
+        backoff = MajdataOutboxService.get_backoff(upload.attempts)
+        queryset.update(status='pending', locked_at=None, last_error=error, next_attempt_at=now + backoff)
+        logger.warning(
+            f"⚠️ 谱面 {chart.id} 转发 Majdata.net 失败（第 {upload.attempts} 次），"
+            f"{int(backoff.total_seconds())} 秒后重试: {error}"
+        )
+        return 'pending'
+
+    @staticmethod
+    def retry(queryset):
+        """
+        将记录重新排队（后台操作，已上传成功的记录不受影响）
+
+        Returns:
+            int: 重新排队的记录数
+        """
+        return queryset.exclude(status__in=['succeeded', 'running']).update(
+            status='pending', attempts=0, next_attempt_at=timezone.now(), last_error=''
+        )
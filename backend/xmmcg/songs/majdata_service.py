@@ -5,104 +5,256 @@ Majdata.net API 集成服务
 
 import logging
 import os
-import tempfile
+import threading
+import time
 from typing import Optional, Dict
-from django.core.files.uploadedfile import InMemoryUploadedFile
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
 
-class MajdataService:
-    """Majdata.net API服务类"""
+class MajdataAuthError(requests.RequestException):
+    """无法登录 Majdata.net"""
+
+
+class MajdataSessionManager:
+    """
+    线程安全的 Majdata.net 会话
     
-    _session: Optional[requests.Session] = None
-    _is_authenticated = False
+    - 所有线程共享一个 requests.Session，HTTPAdapter 连接池大小为 MAJDATA_POOL_SIZE，
+      建立连接失败时重试 MAJDATA_CONNECT_RETRIES 次（请求已发出后不重试，避免重复上传）
+    - 登录由锁保护，并发请求只会登录一次
+    - 请求返回 401 或被重定向到登录页（Cookie 过期）时自动重新登录并重试一次；
+      多个线程同时发现过期时只重新登录一次
+    - 按调用类型记录次数、失败数和耗时（get_metrics）
+    """
     
-    @classmethod
-    def get_session(cls) -> Optional[requests.Session]:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._session: Optional[requests.Session] = None
+        self._authenticated = False
+        # 每次登录成功加 1，用于判断其他线程是否已经重新登录
+        self._generation = 0
+        self._metrics: Dict[str, dict] = {}
+    
+    @staticmethod
+    def _create_session() -> requests.Session:
+        """创建带连接池的 session"""
+        pool_size = getattr(settings, 'MAJDATA_POOL_SIZE', 10)
+        retries = getattr(settings, 'MAJDATA_CONNECT_RETRIES', 2)
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries, connect=retries, read=0, status=0,
+                backoff_factor=0.5, raise_on_status=False
+            )
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    
+    def get_session(self) -> Optional[requests.Session]:
         """
-        获取已认证的 Majdata.net session
-        如果session不存在或未认证，会自动尝试登录
+        获取已认证的 session，未登录时自动登录
         
         Returns:
             requests.Session 或 None（登录失败时）
         """
-        # 如果session已存在且已认证，直接返回
-        if cls._session and cls._is_authenticated:
-            return cls._session
-        
-        # 尝试登录
-        return cls._login()
+        if self._authenticated:
+            return self._session
+        with self._lock:
+            if not self._authenticated:
+                self._login_locked()
+            return self._session if self._authenticated else None
     
-    @classmethod
-    def _login(cls) -> Optional[requests.Session]:
+    def relogin(self, generation: int) -> bool:
         """
-        执行 Majdata.net 登录
+        Cookie 过期时重新登录
         
+        Args:
+            generation: 发现过期的请求发出时的登录代次；其他线程已在此之后重新登录时不再登录
+            
         Returns:
-            requests.Session 或 None（登录失败时）
+            bool: 当前是否已登录
         """
+        with self._lock:
+            if self._authenticated and self._generation != generation:
+                return True
+            self._authenticated = False
+            return self._login_locked()
+    
+    def _login_locked(self) -> bool:
+        """执行登录（调用方需持有 self._lock）"""
+        if self._session is None:
+            self._session = self._create_session()
+        self._session.cookies.clear()
+        
+        login_data = {
+            "username": settings.MAJDATA_USERNAME,
+            "password": settings.MAJDATA_PASSWD_HASHED
+        }
+        start = time.monotonic()
         try:
-            # 创建新session
-            cls._session = requests.Session()
-            
-            # 准备登录数据
-            login_data = {
-                "username": settings.MAJDATA_USERNAME,
-                "password": settings.MAJDATA_PASSWD_HASHED
-            }
-            
-            # 发送登录请求
-            response = cls._session.post(
+            response = self._session.post(
                 settings.MAJDATA_LOGIN_URL,
                 data=login_data,
-                timeout=10
+                timeout=getattr(settings, 'MAJDATA_LOGIN_TIMEOUT', 10)
             )
-            
-            # 检查响应状态
-            if result.get('message') != 'ok' and result.get('code') != 114514:
-                logger.error(f"Majdata.net 登录失败，状态码: {response.status_code}")
-                logger.error(f"响应内容: {response.text}")
-                cls._is_authenticated = False
-                return None
-            
-            # 验证响应内容
-            # Majdata.net API 成功时返回 {"code":114514,"message":"ok"}
-            try:
-                result = response.json()
-                # 检查 message 是否为 "ok" 或 code 是否为 114514
-                if result.get('message') != 'ok' and result.get('code') != 114514:
-                    logger.error(f"Majdata.net 登录失败: {result.get('message', '未知错误')}")
-                    cls._is_authenticated = False
-                    return None
-            except ValueError:
-                # 如果响应不是JSON，只要状态码是200就认为成功
-                logger.warning("Majdata.net 登录响应不是JSON格式，但状态码为200")
-            
-            # 登录成功
-            cls._is_authenticated = True
-            logger.info("✅ Majdata.net 登录成功")
-            
-            # 记录cookies（用于调试）
-            if cls._session.cookies:
-                logger.debug(f"获得的cookies: {dict(cls._session.cookies)}")
-            
-            return cls._session
-            
         except requests.Timeout:
+            self._record('login', start, False)
             logger.error("Majdata.net 登录超时")
-            cls._is_authenticated = False
-            return None
+            return False
         except requests.RequestException as e:
+            self._record('login', start, False)
             logger.error(f"Majdata.net 登录请求错误: {e}")
-            cls._is_authenticated = False
-            return None
-        except Exception as e:
-            logger.error(f"Majdata.net 登录未知错误: {e}")
-            cls._is_authenticated = False
-            return None
+            return False
+        
+        # 检查响应状态
+        if response.status_code != 200:
+            self._record('login', start, False)
+            logger.error(f"Majdata.net 登录失败，状态码: {response.status_code}")
+            logger.error(f"响应内容: {response.text}")
+            return False
+        
+        # 验证响应内容
+        # Majdata.net API 成功时返回 {"code":114514,"message":"ok"}
+        try:
+            result = response.json()
+            if result.get('message') != 'ok' and result.get('code') != 114514:
+                self._record('login', start, False)
+                logger.error(f"Majdata.net 登录失败: {result.get('message', '未知错误')}")
+                return False
+        except ValueError:
+            # 如果响应不是JSON，只要状态码是200就认为成功
+            logger.warning("Majdata.net 登录响应不是JSON格式，但状态码为200")
+        
+        self._record('login', start, True)
+        self._authenticated = True
+        self._generation += 1
+        logger.info("✅ Majdata.net 登录成功")
+        
+        # 记录cookies（用于调试）
+        if self._session.cookies:
+            logger.debug(f"获得的cookies: {dict(self._session.cookies)}")
+        return True
+    
+    @staticmethod
+    def is_auth_failure(response: requests.Response) -> bool:
+        """响应是否表示登录已失效（401，或被重定向到登录页）"""
+        if response.status_code == 401:
+            return True
+        if response.is_redirect:
+            return 'login' in response.headers.get('Location', '').lower()
+        return bool(response.history) and 'login' in response.url.lower()
+    
+    def request(self, name: str, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        发送需要登录的请求，登录失效时重新登录并重试一次
+        
+        Args:
+            name: 调用类型（用于耗时统计，如 'upload'）
+            method: HTTP 方法
+            url: 请求地址
+            **kwargs: 传给 requests 的参数（重试时会重新发送，files 需为 bytes）
+            
+        Returns:
+            requests.Response
+            
+        Raises:
+            MajdataAuthError: 无法登录
+            requests.RequestException: 请求失败
+        """
+        session = self.get_session()
+        if session is None:
+            raise MajdataAuthError('无法登录 Majdata.net')
+        generation = self._generation
+        
+        response = self._send(name, session, method, url, **kwargs)
+        if not self.is_auth_failure(response):
+            return response
+        
+        logger.warning(f"Majdata.net 登录已失效（{name}: {response.status_code} {response.url}），重新登录后重试")
+        if not self.relogin(generation):
+            raise MajdataAuthError('Majdata.net 重新登录失败')
+        return self._send(name, self._session, method, url, **kwargs)
+    
+    def _send(self, name, session, method, url, **kwargs):
+        start = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self._record(name, start, False)
+            raise
+        self._record(name, start, response.status_code < 400 and not self.is_auth_failure(response))
+        return response
+    
+    def _record(self, name, start, ok):
+        """记录一次调用的耗时"""
+        elapsed_ms = (time.monotonic() - start) * 1000
+        with self._metrics_lock:
+            stats = self._metrics.setdefault(name, {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['errors'] += 0 if ok else 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        logger.debug(f"Majdata.net {name}: {'成功' if ok else '失败'}，耗时 {elapsed_ms:.0f}ms")
+    
+    def get_metrics(self) -> Dict[str, dict]:
+        """
+        各类调用的统计
+        
+        Returns:
+            dict: {调用类型: {'count', 'errors', 'avg_ms', 'max_ms'}}
+        """
+        with self._metrics_lock:
+            return {
+                name: {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'avg_ms': round(stats['total_ms'] / stats['count'], 1),
+                    'max_ms': round(stats['max_ms'], 1),
+                }
+                for name, stats in self._metrics.items()
+            }
+    
+    def reset(self):
+        """重置 session，下次调用时会重新登录"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._authenticated = False
+        with self._metrics_lock:
+            self._metrics = {}
+
+
+session_manager = MajdataSessionManager()
+
+
+class MajdataService:
+    """Majdata.net API服务类"""
+    
+    @classmethod
+    def get_session(cls) -> Optional[requests.Session]:
+        """
+        获取已认证的 Majdata.net session
+        如果session不存在或未认证，会自动尝试登录
+        
+        Returns:
+            requests.Session 或 None（登录失败时）
+        """
+        return session_manager.get_session()
+    
+    @classmethod
+    def get_metrics(cls) -> Dict[str, dict]:
+        """各类调用的次数、失败数和耗时（见 MajdataSessionManager.get_metrics）"""
+        return session_manager.get_metrics()
     
     @classmethod
     def upload_chart(cls, chart_data: dict) -> Optional[dict]:
@@ -121,11 +273,6 @@ class MajdataService:
         Returns:
             上传结果字典，包含谱面URL等信息；失败时返回None
         """
-        session = cls.get_session()
-        if not session:
-            logger.error("无法获取Majdata.net session，上传失败")
-            return None
-        
         folder_name = chart_data.get('folder_name', 'Chart')
         
         try:
@@ -186,10 +333,12 @@ class MajdataService:
             # 发送上传请求
             logger.info(f"⬆️ 正在上传到 Majdata.net: {folder_name}")
             
-            response = session.post(
+            response = session_manager.request(
+                'upload',
+                'POST',
                 settings.MAJDATA_UPLOAD_URL,
                 files=form_files,
-                timeout=120  # 上传大文件可能需要较长时间
+                timeout=getattr(settings, 'MAJDATA_UPLOAD_TIMEOUT', 120)  # 上传大文件可能需要较长时间
             )
             
             # 关闭所有文件句柄
@@ -214,6 +363,9 @@ class MajdataService:
         except requests.Timeout:
             logger.error(f"[{folder_name}] Majdata.net 上传超时")
             return None
+        except MajdataAuthError as e:
+            logger.error(f"[{folder_name}] {e}，上传失败")
+            return None
         except requests.RequestException as e:
             logger.error(f"[{folder_name}] Majdata.net 上传请求错误: {e}")
             return None
@@ -346,6 +498,5 @@ class MajdataService:
     @classmethod
     def reset_session(cls):
         """重置session，下次调用时会重新登录"""
-        cls._session = None
-        cls._is_authenticated = False
+        session_manager.reset()
         logger.info("Majdata.net session 已重置")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from songs.models import Bid, make_bidder_alias
+
+
+class Command(BaseCommand):
+    help = '为没有匿名代号的竞标补齐 bidder_alias（添加该字段后、或 bulk_create 写入竞标后执行）'
+
+    def handle(self, *args, **options):
+        pairs = list(
+            Bid.objects.filter(bidder_alias='')
+            .order_by()
+            .values_list('bidding_round_id', 'user_id')
+            .distinct()
+        )
+        updated = 0
+        for bidding_round_id, user_id in pairs:
+            updated += Bid.objects.filter(
+                bidding_round_id=bidding_round_id,
+                user_id=user_id,
+                bidder_alias=''
+            ).update(bidder_alias=make_bidder_alias(bidding_round_id, user_id))
+        self.stdout.write(self.style.SUCCESS(f'已为 {updated} 条竞标生成匿名代号'))
@@ -0,0 +1,235 @@
+import hashlib
+import os
+import shutil
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from songs.models import MediaBlob
+from songs.storage import BLOB_PREFIX, blob_name_for, count_references, get_media_fields, media_storage
+
+# 刚创建的文件可能还没有写入引用它的记录，不按孤立文件删除
+ORPHAN_GRACE = timedelta(hours=1)
+
+
+class Command(BaseCommand):
+    help = (
+        '将 MEDIA_ROOT 中的歌曲/谱面媒体文件迁移为按内容存储（相同内容只保留一份），'
+        '并按数据库中的实际引用重新计算引用次数、删除无引用的文件'
+        '（包括上传事务回滚后留下的没有记录的文件）。可重复执行，服务无需停机'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='每批更新的记录数（默认 200）'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='只统计，不移动文件、不修改数据库'
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+        # 旧路径 -> 新路径（多条记录引用同一旧文件时只处理一次）
+        self.moved = {}
+        # 新路径 -> (旧文件路径, SHA256, 大小)，建立按内容存储的文件时使用
+        self.sources = {}
+        self.seen_blobs = set()
+        self.saved_bytes = 0
+        # 记录更新后才删除的旧文件 {旧路径: 文件路径}（仍有记录引用时保留）
+        self.pending_removals = {}
+
+        for model, field_names in get_media_fields():
+            for field_name in field_names:
+                self.migrate_field(model, field_name)
+
+        if self.dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f'[dry-run] 待迁移 {len(self.moved)} 个文件，可节省 {self.saved_bytes / 1024 / 1024:.1f} MB'
+            ))
+            return
+
+        fixed, removed = self.recount()
+        removed += self.sweep_orphan_files()
+        self.stdout.write(self.style.SUCCESS(
+            f'已迁移 {len(self.moved)} 个文件，节省 {self.saved_bytes / 1024 / 1024:.1f} MB；'
+            f'修正 {fixed} 个引用计数，删除 {removed} 个无引用文件'
+        ))
+
+    def migrate_field(self, model, field_name):
+        """把一个字段中不在 blobs/ 下的文件迁移为按内容存储"""
+        queryset = (
+            model.objects.exclude(**{f'{field_name}__startswith': BLOB_PREFIX})
+            .exclude(Q(**{field_name: ''}) | Q(**{f'{field_name}__isnull': True}))
+            .only('pk', field_name)
+            .order_by('pk')
+        )
+        batch = []
+        for obj in queryset.iterator(chunk_size=self.batch_size):
+            old_name = getattr(obj, field_name).name
+            new_name = self.moved.get(old_name) or self.migrate_file(old_name)
+            if new_name is None:
+                continue
+            if not self.dry_run:
+                self.pending_removals[old_name] = media_storage.path(old_name)
+            setattr(obj, field_name, new_name)
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                self.flush(model, field_name, batch)
+                batch = []
+        self.flush(model, field_name, batch)
+
+    def flush(self, model, field_name, batch):
+        """
+        在同一事务中建立按内容存储的文件、更新一批记录并增加引用计数，之后删除旧文件
+
+        文件建立与引用计数在同一事务中完成，迁移过程中删除记录或并发上传相同内容
+        都不会把仍被引用的文件当作无引用删除。
+        """
+        if batch and not self.dry_run:
+            references = Counter(getattr(obj, field_name).name for obj in batch)
+            with transaction.atomic():
+                for name in sorted(references):
+                    self.ensure_blob(name)
+                model.objects.bulk_update(batch, [field_name])
+                for name, count in references.items():
+                    MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + count)
+            self.stdout.write(f'{model.__name__}.{field_name}: 已更新 {len(batch)} 条记录')
+        for old_name, path in self.pending_removals.items():
+            # 其他字段（例如谱面沿用的歌曲音频）可能仍引用旧文件，迁移到该记录时再删除
+            if os.path.exists(path) and not count_references(old_name):
+                os.remove(path)
+        self.pending_removals = {}
+
+    def migrate_file(self, old_name):
+        """
+        计算旧文件对应的按内容存储路径（文件在 flush 中建立），旧文件在记录更新后删除
+
+        Returns:
+            str | None: 新路径；旧文件不存在时返回 None
+        """
+        old_path = media_storage.path(old_name)
+        if not os.path.exists(old_path):
+            self.stderr.write(f'文件不存在，跳过: {old_name}')
+            return None
+
+        hasher = hashlib.sha256()
+        with open(old_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        new_name = blob_name_for(digest, old_name)
+        size = os.path.getsize(old_path)
+        self.moved[old_name] = new_name
+
+        new_path = media_storage.path(new_name)
+        if new_name in self.seen_blobs or os.path.exists(new_path):
+            self.saved_bytes += size
+        self.seen_blobs.add(new_name)
+        if self.dry_run:
+            return new_name
+
+        self.sources.setdefault(new_name, (old_path, digest, size))
+        return new_name
+
+    def ensure_blob(self, name):
+        """建立按内容存储的文件和记录并加锁（需在事务中调用）"""
+        old_path, digest, size = self.sources[name]
+        MediaBlob.objects.get_or_create(
+            name=name,
+            defaults={'sha256': digest, 'size': size, 'ref_count': 0}
+        )
+        # 锁定记录，避免与引用降为 0 的删除并发
+        MediaBlob.objects.select_for_update().get(name=name)
+        new_path = media_storage.path(name)
+        if not os.path.exists(new_path):
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            try:
+                os.link(old_path, new_path)
+            except OSError:
+                shutil.copy2(old_path, new_path)
+
+    def recount(self):
+        """
+        按数据库中的实际引用重新计算引用次数，删除无引用的文件
+
+        Returns:
+            tuple: (修正的记录数, 删除的文件数)
+        """
+        references = Counter()
+        for model, field_names in get_media_fields():
+            for field_name in field_names:
+                references.update(
+                    model.objects.filter(**{f'{field_name}__startswith': BLOB_PREFIX})
+                    .values_list(field_name, flat=True)
+                    .iterator()
+                )
+
+        fixed = 0
+        removed = 0
+        grace_start = timezone.now() - ORPHAN_GRACE
+        for blob in MediaBlob.objects.order_by('id').iterator():
+            if blob.ref_count == references[blob.name] and blob.ref_count > 0:
+                continue
+            with transaction.atomic():
+                # 加锁后重新统计，避免覆盖并发上传增加的引用
+                blob = MediaBlob.objects.select_for_update().get(pk=blob.pk)
+                count = count_references(blob.name)
+                if count == 0 and blob.created_at < grace_start:
+                    blob.delete()
+                    media_storage.delete(blob.name)
+                    removed += 1
+                elif count and blob.ref_count != count:
+                    blob.ref_count = count
+                    blob.save(update_fields=['ref_count'])
+                    fixed += 1
+        return fixed, removed
+
+    def sweep_orphan_files(self):
+        """
+        删除 blobs/ 下没有 MediaBlob 记录的文件
+
+        保存文件所在的事务回滚时，记录被回滚而文件留在磁盘上，recount 只遍历记录，找不到这些文件。
+        只删除超过 ORPHAN_GRACE 且没有记录引用的文件（新文件的事务可能尚未提交）。
+
+        Returns:
+            int: 删除的文件数
+        """
+        blobs_dir = media_storage.path(BLOB_PREFIX)
+        grace_start = (timezone.now() - ORPHAN_GRACE).timestamp()
+        candidates = {}
+        for root, _, names in os.walk(blobs_dir):
+            for filename in names:
+                path = os.path.join(root, filename)
+                try:
+                    if os.path.getmtime(path) >= grace_start:
+                        continue
+                except OSError:
+                    continue
+                name = BLOB_PREFIX + os.path.relpath(path, blobs_dir).replace(os.sep, '/')
+                candidates[name] = path
+
+        removed = 0
+        names = sorted(candidates)
+        for start in range(0, len(names), self.batch_size):
+            chunk = names[start:start + self.batch_size]
+            known = set(MediaBlob.objects.filter(name__in=chunk).values_list('name', flat=True))
+            for name in chunk:
+                if name in known or count_references(name):
+                    continue
+                try:
+                    os.remove(candidates[name])
+                except OSError:
+                    continue
+                self.stderr.write(f'删除没有记录的文件: {name}')
+                removed += 1
+        return removed
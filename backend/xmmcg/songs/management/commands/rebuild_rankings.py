@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from songs.models import BiddingRound
+from songs.ranking_service import RankingService
+
+
+class Command(BaseCommand):
+    help = '全量重建轮次排名表（RoundRanking），用于数据修复或后台直接修改谱面评分之后'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'round_ids',
+            nargs='*',
+            type=int,
+            help='竞标轮次ID（不指定则重建所有轮次）'
+        )
+
+    def handle(self, *args, **options):
+        round_ids = options['round_ids'] or list(
+            BiddingRound.objects.order_by('id').values_list('id', flat=True)
+        )
+        missing = set(round_ids) - set(
+            BiddingRound.objects.filter(id__in=round_ids).values_list('id', flat=True)
+        )
+        if missing:
+            raise CommandError(f'竞标轮次不存在: {sorted(missing)}')
+
+        for round_id in round_ids:
+            count = RankingService.rebuild_round(round_id)
+            self.stdout.write(f'轮次 {round_id}: {count} 张谱面')
+        self.stdout.write(self.style.SUCCESS(f'已重建 {len(round_ids)} 个轮次的排名'))
@@ -0,0 +1,96 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from songs.majdata_outbox import MajdataOutboxService
+from songs.majdata_service import MajdataService
+
+# 常驻运行时输出 Majdata.net 调用统计的间隔秒数
+METRICS_INTERVAL = 300
+
+
+def process_upload(upload_id):
+    """在线程中上传一条记录（结束后关闭该线程的数据库连接）"""
+    try:
+        return MajdataOutboxService.process(upload_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = '处理 Majdata.net 转发队列：用有限的线程池上传已提交的谱面，失败后按指数退避重试'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='处理完当前到期的记录后退出（供 cron 定时调用）'
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=5,
+            help='队列为空时的检查间隔秒数（默认5）'
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=4,
+            help='同时上传的线程数（默认4）'
+        )
+
+    def handle(self, *args, **options):
+        threads = max(options['threads'], 1)
+        interval = options['interval']
+        if not options['once']:
+            self.stdout.write(
+                f'Majdata 转发已启动，{threads} 个线程，队列为空时每 {interval} 秒检查一次（Ctrl+C 退出）'
+            )
+
+        # 进行中的上传 {Future: 转发记录 ID}，有空闲线程时才认领新记录
+        in_flight = {}
+        metrics_at = time.monotonic() + METRICS_INTERVAL
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='majdata') as pool:
+            try:
+                while True:
+                    close_old_connections()
+                    MajdataOutboxService.requeue_stale()
+                    for upload_id in MajdataOutboxService.claim_due(threads - len(in_flight)):
+                        in_flight[pool.submit(process_upload, upload_id)] = upload_id
+
+                    if not in_flight:
+                        if options['once']:
+                            break
+                        time.sleep(interval)
+                        continue
+
+                    done, _ = wait(in_flight, timeout=interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.report(in_flight.pop(future), future)
+
+                    if time.monotonic() >= metrics_at:
+                        self.report_metrics()
+                        metrics_at = time.monotonic() + METRICS_INTERVAL
+            except KeyboardInterrupt:
+                self.stdout.write('Majdata 转发已停止（等待进行中的上传完成）')
+        self.report_metrics()
+
+    def report(self, upload_id, future):
+        try:
+            status = future.result()
+        except Exception as e:
+            # 记录保持 running，超时后由 requeue_stale 重新排队
+            self.stdout.write(self.style.ERROR(f'[error] 转发记录 {upload_id}: {e}'))
+            return
+        style = self.style.SUCCESS if status == 'succeeded' else self.style.WARNING
+        self.stdout.write(style(f'[{status}] 转发记录 {upload_id}'))
+
+    def report_metrics(self):
+        """输出 Majdata.net 各类调用的次数、失败数和耗时"""
+        for name, stats in MajdataService.get_metrics().items():
+            self.stdout.write(
+                f'[metrics] {name}: {stats["count"]} 次，失败 {stats["errors"]} 次，'
+                f'平均 {stats["avg_ms"]}ms，最大 {stats["max_ms"]}ms'
+            )
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from songs.phase_scheduler import PhaseScheduler
+
+
+class Command(BaseCommand):
+    help = '在比赛阶段的时间边界上创建、开启竞标轮次（可选：阶段结束时自动分配）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='只执行一次后退出（供 cron 定时调用）'
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=30,
+            help='常驻运行时的检查间隔秒数（默认30）'
+        )
+        parser.add_argument(
+            '--allocate',
+            action='store_true',
+            help='竞标阶段结束时自动执行分配并完成轮次（部署的 phase-scheduler 服务已开启；不加时轮次保持进行中，由管理员在后台手动分配）'
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.run_tick(options['allocate'])
+            return
+
+        self.stdout.write(f"阶段调度已启动，每 {options['interval']} 秒检查一次（Ctrl+C 退出）")
+        try:
+            while True:
+                close_old_connections()
+                self.run_tick(options['allocate'])
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('阶段调度已停止')
+
+    def run_tick(self, allocate):
+        for action, round_obj, message in PhaseScheduler.tick(allocate=allocate):
+            if action == 'failed':
+                self.stdout.write(self.style.WARNING(message))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'[{action}] {round_obj.name} (ID {round_obj.id}): {message}'))
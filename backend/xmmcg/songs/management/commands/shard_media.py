@@ -0,0 +1,152 @@
+import os
+import re
+import shutil
+import time
+import uuid
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db.models import FileField, Q
+
+from songs.models import get_sharded_path
+from songs.storage import media_storage
+
+# 已按目录分片的路径：{prefix}/ab/cd/...
+SHARDED_RE = re.compile(r'^[^/]+/[0-9a-f]{2}/[0-9a-f]{2}/')
+
+
+def get_sharded_name(old_name):
+    """
+    旧文件对应的分片路径
+    由旧路径确定（uuid5），中断后重新执行得到相同路径；maidata.txt 保留文件名
+
+    例: charts/user1_song5_a1b2c3d4/maidata.txt -> charts/ab/cd/abcd.../maidata.txt
+    """
+    prefix = old_name.split('/', 1)[0] if '/' in old_name else 'files'
+    unique_id = uuid.uuid5(uuid.NAMESPACE_URL, old_name).hex
+    basename = os.path.basename(old_name)
+    if basename == 'maidata.txt':
+        return get_sharded_path(prefix, unique_id, f'{unique_id}/{basename}')
+    ext = os.path.splitext(basename)[1].lower()
+    return get_sharded_path(prefix, unique_id, f'{unique_id}{ext}')
+
+
+class Command(BaseCommand):
+    help = (
+        '将未分片目录中的上传文件（谱面文件等）分批迁移到 {prefix}/ab/cd/ 分片目录并更新数据库路径。'
+        '先建立新文件、更新记录后才删除旧文件，服务无需停机；中断后重新执行即可继续。'
+        '按内容存储的媒体文件（blobs/）已分片，旧媒体文件请使用 dedupe_media 迁移'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='每批更新的记录数（默认 200）'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='每批之间暂停的秒数，降低对线上服务的 IO 影响（默认 0）'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='只统计，不移动文件、不修改数据库'
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+        self.sleep = options['sleep']
+        self.moved = 0
+        self.missing = 0
+        # 旧路径 -> 新路径（多条记录引用同一文件时只迁移一次）
+        self.renamed = {}
+
+        for model in apps.get_app_config('songs').get_models():
+            for field in model._meta.get_fields():
+                if isinstance(field, FileField) and field.storage is not media_storage:
+                    self.migrate_field(model, field)
+
+        prefix = '[dry-run] 待迁移' if self.dry_run else '已迁移'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} {self.moved} 个文件（{self.missing} 个文件不存在，已跳过）'
+        ))
+
+    def migrate_field(self, model, field):
+        """按主键顺序分批迁移一个字段中未分片的文件"""
+        queryset = (
+            model.objects.exclude(Q(**{field.name: ''}) | Q(**{f'{field.name}__isnull': True}))
+            .only('pk', field.name)
+            .order_by('pk')
+        )
+        storage = field.storage
+        batch = []
+        old_paths = []
+        for obj in queryset.iterator(chunk_size=self.batch_size):
+            old_name = getattr(obj, field.name).name
+            if SHARDED_RE.match(old_name):
+                continue
+            if old_name in self.renamed:
+                setattr(obj, field.name, self.renamed[old_name])
+                batch.append(obj)
+                continue
+            old_path = storage.path(old_name)
+            new_name = get_sharded_name(old_name)
+            if not os.path.exists(old_path):
+                if not os.path.exists(storage.path(new_name)):
+                    self.stderr.write(f'文件不存在，跳过: {old_name}')
+                    self.missing += 1
+                    continue
+                # 上次执行中断：新文件已建立、旧文件已删除，只需更新记录
+                self.moved += 1
+                if not self.dry_run:
+                    self.renamed[old_name] = new_name
+                    setattr(obj, field.name, new_name)
+                    batch.append(obj)
+                continue
+
+            self.moved += 1
+            if self.dry_run:
+                continue
+            self.link(old_path, storage.path(new_name))
+            self.renamed[old_name] = new_name
+            setattr(obj, field.name, new_name)
+            batch.append(obj)
+            old_paths.append(old_path)
+            if len(batch) >= self.batch_size:
+                self.flush(model, field, batch, old_paths)
+                batch, old_paths = [], []
+        self.flush(model, field, batch, old_paths)
+
+    @staticmethod
+    def link(old_path, new_path):
+        """在新位置建立文件（同一文件系统下使用硬链接，不复制数据）"""
+        if os.path.exists(new_path):
+            # 上次执行中断时已建立
+            return
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        try:
+            os.link(old_path, new_path)
+        except OSError:
+            shutil.copy2(old_path, new_path)
+
+    def flush(self, model, field, batch, old_paths):
+        """更新一批记录的路径，之后删除旧文件"""
+        if not batch:
+            return
+        model.objects.bulk_update(batch, [field.name])
+        for path in old_paths:
+            if os.path.exists(path):
+                os.remove(path)
+            # 旧版谱面文件每个一个目录（charts/user1_song5_xxx/），删除空目录
+            directory = os.path.dirname(path)
+            nested = os.sep in os.path.relpath(directory, field.storage.location)
+            if os.path.basename(path) == 'maidata.txt' and nested and not os.listdir(directory):
+                os.rmdir(directory)
+        self.stdout.write(f'{model.__name__}.{field.name}: 已迁移 {len(batch)} 个文件')
+        if self.sleep:
+            time.sleep(self.sleep)
@@ -0,0 +1,102 @@
+"""
+竞标行情服务
+一次查询汇总某轮次所有目标的竞标深度（出价人数、最高/最低/中位出价），结果按轮次缓存，
+由 Bid / BiddingRound 的信号在写入后失效
+"""
+
+from itertools import groupby
+from statistics import median
+
+from django.core.cache import cache
+
+from .models import Bid
+from .bidding_service import BiddingService
+
+# 行情快照缓存时间（秒）：兜底批量写入（不触发信号）造成的偏差
+BID_MARKET_TTL = 30
+
+
+class BidMarketService:
+    """竞标行情服务类"""
+
+    @staticmethod
+    def _cache_key(bidding_round_id):
+        return f'bid_market:{bidding_round_id}'
+
+    @staticmethod
+    def invalidate(bidding_round_id):
+        """使某轮次的行情快照失效（由信号调用）"""
+        cache.delete(BidMarketService._cache_key(bidding_round_id))
+
+    @staticmethod
+    def get_snapshot(bidding_round):
+        """
+        获取某轮次的行情快照（所有用户共享，不含个人信息）
+
+        中位数没有可移植的 SQL 聚合函数，因此一次按 (目标, 金额) 排序读取有效竞标，
+        在同一次遍历中得出人数、最高/最低价和中位数；没有竞标的目标人数为 0。
+
+        Args:
+            bidding_round: 竞标轮次
+
+        Returns:
+            dict: {目标ID: {'bid_count', 'max_amount', 'min_amount', 'median_amount'}}
+        """
+        key = BidMarketService._cache_key(bidding_round.id)
+        snapshot = cache.get(key)
+        if snapshot is not None:
+            return snapshot
+
+        target_field = 'song_id' if bidding_round.bidding_type == 'song' else 'chart_id'
+        snapshot = {
+            target_id: {'bid_count': 0, 'max_amount': None, 'min_amount': None, 'median_amount': None}
+            for target_id in BiddingService.get_target_queryset(bidding_round.bidding_type).values_list('id', flat=True)
+        }
+        rows = Bid.objects.filter(
+            bidding_round=bidding_round,
+            bid_type=bidding_round.bidding_type,
+            is_dropped=False
+        ).order_by(target_field, 'amount').values_list(target_field, 'amount')
+        for target_id, group in groupby(rows, key=lambda row: row[0]):
+            amounts = [amount for _, amount in group]
+            snapshot[target_id] = {
+                'bid_count': len(amounts),
+                'max_amount': amounts[-1],
+                'min_amount': amounts[0],
+                'median_amount': median(amounts),
+            }
+
+        cache.set(key, snapshot, BID_MARKET_TTL)
+        return snapshot
+
+    @staticmethod
+    def get_market(bidding_round, user, can_view=True):
+        """
+        生成行情列表：每个目标的竞标深度 + 当前用户自己的出价
+
+        Args:
+            bidding_round: 竞标轮次
+            user: 当前用户
+            can_view: 是否可查看他人竞标（轮次 allow_public_view 关闭时仅管理员可查看）；
+                不可查看时只返回目标列表和自己的出价
+
+        Returns:
+            list: [{'target_id', 'bid_count', 'max_amount', 'min_amount', 'median_amount', 'my_bid'}, ...]
+        """
+        target_field = 'song_id' if bidding_round.bidding_type == 'song' else 'chart_id'
+        my_bids = {
+            bid[target_field]: {'id': bid['id'], 'amount': bid['amount']}
+            for bid in Bid.objects.filter(
+                bidding_round=bidding_round,
+                user=user,
+                bid_type=bidding_round.bidding_type,
+                is_dropped=False
+            ).values('id', target_field, 'amount')
+        }
+
+        results = []
+        for target_id, depth in BidMarketService.get_snapshot(bidding_round).items():
+            if not can_view:
+                depth = {'bid_count': None, 'max_amount': None, 'min_amount': None, 'median_amount': None}
+            results.append({'target_id': target_id, **depth, 'my_bid': my_bids.get(target_id)})
+        return results
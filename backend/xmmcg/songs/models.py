@@ -2,6 +2,9 @@ import uuid
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .storage import get_media_storage
 
 # ==================== 可调整的常量 ====================
 # 每个用户可上传的歌曲数量限制
@@ -13,6 +16,9 @@ MAX_BIDS_PER_USER = 5
 # 保底分配需要扣除的代币数量
 RANDOM_ALLOCATION_COST = 200
 
+# 每首被分配的歌曲奖励给原作者的代币数量
+SONG_AUTHOR_REWARD = 100
+
 # 互评系统常量（已迁移到settings.py，此处保留用于向后兼容）
 # 推荐：在settings.py中设置 PEER_REVIEW_TASKS_PER_USER 和 PEER_REVIEW_MAX_SCORE
 PEER_REVIEW_TASKS_PER_USER = 8  # 每个用户需要完成的评分任务数（可在settings.py覆盖）
@@ -189,75 +195,125 @@ class CompetitionPhase(models.Model):
             return max(0, min(100, int((elapsed / total_duration) * 100)))
 
 
+# ==================== 媒体文件存储 ====================
+
+class MediaBlob(models.Model):
+    """
+    按内容存储的媒体文件（见 songs/storage.py）
+    
+    相同内容的音频、封面、视频只保存一份，ref_count 记录引用它的文件字段数，
+    降为 0 时删除文件。
+    """
+    
+    name = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text='存储路径（blobs/<哈希前两位>/<哈希第三四位>/<哈希>.<扩展名>）'
+    )
+    sha256 = models.CharField(
+        max_length=64,
+        db_index=True,
+        help_text='文件内容 SHA256'
+    )
+    size = models.BigIntegerField(
+        default=0,
+        help_text='文件大小（字节）'
+    )
+    ref_count = models.IntegerField(
+        default=0,
+        help_text='引用次数'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        help_text='创建时间'
+    )
+    
+    class Meta:
+        verbose_name = '媒体文件'
+        verbose_name_plural = '媒体文件'
+    
+    def __str__(self):
+        return f"{self.name} (引用 {self.ref_count})"
+
+
+def get_sharded_path(prefix, unique_id, leaf):
+    """
+    生成按目录分片的文件路径（避免单个目录下文件过多）
+    格式: {prefix}/{uuid前两位}/{uuid第三四位}/{leaf}
+    例: songs/a1/b2/a1b2c3d4e5f6....mp3
+    """
+    return f'{prefix}/{unique_id[:2]}/{unique_id[2:4]}/{leaf}'
+
+
 def get_audio_filename(instance, filename):
     """
-    生成音频文件名
-    格式: audio_user{user_id}_{uuid}.{ext}
-    例: audio_user1_a1b2c3d4.mp3
+    生成音频文件名（媒体文件按内容存储，实际只使用扩展名，见 songs/storage.py）
+    格式: songs/{uuid[:2]}/{uuid[2:4]}/{uuid}.{ext}
+    例: songs/a1/b2/a1b2c3d4....mp3
     """
     import uuid as uuid_lib
     ext = filename.split('.')[-1].lower()
-    unique_id = uuid_lib.uuid4().hex[:8]
-    return f'songs/audio_user{instance.user.id}_{unique_id}.{ext}'
+    unique_id = uuid_lib.uuid4().hex
+    return get_sharded_path('songs', unique_id, f'{unique_id}.{ext}')
 
 
 def get_cover_filename(instance, filename):
     """
-    生成封面文件名
-    格式: cover_user{user_id}_{uuid}.{ext}
-    例: cover_user1_a1b2c3d4.jpg
+    生成封面文件名（媒体文件按内容存储，实际只使用扩展名）
+    格式: songs/{uuid[:2]}/{uuid[2:4]}/{uuid}.{ext}
+    例: songs/a1/b2/a1b2c3d4....jpg
     """
     import uuid as uuid_lib
     ext = filename.split('.')[-1].lower()
-    unique_id = uuid_lib.uuid4().hex[:8]
-    return f'songs/cover_user{instance.user.id}_{unique_id}.{ext}'
+    unique_id = uuid_lib.uuid4().hex
+    return get_sharded_path('songs', unique_id, f'{unique_id}.{ext}')
 
 
 def get_video_filename(instance, filename):
     """
-    生成背景视频文件名
-    格式: video_user{user_id}_{uuid}.{ext}
-    例: video_user1_a1b2c3d4.mp4
+    生成背景视频文件名（媒体文件按内容存储，实际只使用扩展名）
+    格式: songs/{uuid[:2]}/{uuid[2:4]}/{uuid}.{ext}
+    例: songs/a1/b2/a1b2c3d4....mp4
     """
     import uuid as uuid_lib
     ext = filename.split('.')[-1].lower()
-    unique_id = uuid_lib.uuid4().hex[:8]
-    return f'songs/video_user{instance.user.id}_{unique_id}.{ext}'
+    unique_id = uuid_lib.uuid4().hex
+    return get_sharded_path('songs', unique_id, f'{unique_id}.{ext}')
 
 
 def get_chart_filename(instance, filename):
     """
     生成谱面文件名（固定为maidata.txt）
-    格式: charts/user{user_id}_song{song_id}_{uuid}/maidata.txt
-    例: charts/user1_song5_a1b2c3d4/maidata.txt
+    格式: charts/{uuid[:2]}/{uuid[2:4]}/{uuid}/maidata.txt
+    例: charts/a1/b2/a1b2c3d4.../maidata.txt
     """
     import uuid as uuid_lib
-    unique_id = uuid_lib.uuid4().hex[:8]
-    return f'charts/user{instance.user.id}_song{instance.song.id}_{unique_id}/maidata.txt'
+    unique_id = uuid_lib.uuid4().hex
+    return get_sharded_path('charts', unique_id, f'{unique_id}/maidata.txt')
 
 
 def get_chart_audio_filename(instance, filename):
-    """生成谱面音频文件名"""
+    """生成谱面音频文件名（媒体文件按内容存储，实际只使用扩展名）"""
     import uuid as uuid_lib
     ext = filename.split('.')[-1].lower()
-    unique_id = uuid_lib.uuid4().hex[:8]
-    return f'charts/audio_user{instance.user.id}_song{instance.song.id}_{unique_id}.{ext}'
+    unique_id = uuid_lib.uuid4().hex
+    return get_sharded_path('charts', unique_id, f'{unique_id}.{ext}')
 
 
 def get_chart_cover_filename(instance, filename):
-    """生成谱面封面文件名"""
+    """生成谱面封面文件名（媒体文件按内容存储，实际只使用扩展名）"""
     import uuid as uuid_lib
     ext = filename.split('.')[-1].lower()
-    unique_id = uuid_lib.uuid4().hex[:8]
-    return f'charts/cover_user{instance.user.id}_song{instance.song.id}_{unique_id}.{ext}'
+    unique_id = uuid_lib.uuid4().hex
+    return get_sharded_path('charts', unique_id, f'{unique_id}.{ext}')
 
 
 def get_chart_video_filename(instance, filename):
-    """生成谱面背景视频文件名"""
+    """生成谱面背景视频文件名（媒体文件按内容存储，实际只使用扩展名）"""
     import uuid as uuid_lib
     ext = filename.split('.')[-1].lower()
-    unique_id = uuid_lib.uuid4().hex[:8]
-    return f'charts/video_user{instance.user.id}_song{instance.song.id}_{unique_id}.{ext}'
+    unique_id = uuid_lib.uuid4().hex
+    return get_sharded_path('charts', unique_id, f'{unique_id}.{ext}')
 
 
 class Song(models.Model):
@@ -287,16 +343,19 @@ class Song(models.Model):
     )
     audio_file = models.FileField(
         upload_to=get_audio_filename,
+        storage=get_media_storage,
         help_text='音频文件'
     )
     cover_image = models.ImageField(
         upload_to=get_cover_filename,
+        storage=get_media_storage,
         null=True,
         blank=True,
         help_text='封面图片（可选）'
     )
     background_video = models.FileField(
         upload_to=get_video_filename,
+        storage=get_media_storage,
         null=True,
         blank=True,
         help_text='背景视频（bg.mp4或pv.mp4，最大20MB，可选）'
@@ -336,14 +395,16 @@ class Song(models.Model):
         return f"#{self.id} - {self.title} (by {self.user.username})"
     
     def delete(self, *args, **kwargs):
-        """删除歌曲时同时删除关联文件"""
+        """删除歌曲时同时删除关联文件（媒体文件只减少引用，无引用时才删除）"""
+        # 先删除记录，文件引用检查时不再计入本条记录
+        result = super().delete(*args, **kwargs)
         if self.audio_file:
             self.audio_file.delete(save=False)
         if self.cover_image:
             self.cover_image.delete(save=False)
         if self.background_video:
             self.background_video.delete(save=False)
-        super().delete(*args, **kwargs)
+        return result
 
 
 class BiddingRound(models.Model):
@@ -420,6 +481,25 @@ class BiddingRound(models.Model):
         return f"{self.name} ({type_display} - {self.get_status_display()})"
 
 
+def make_bidder_alias(bidding_round_id, user_id):
+    """
+    生成竞标者在某轮次内的匿名代号
+    
+    使用 HMAC（密钥为 settings.BIDDER_ALIAS_SECRET）对 (轮次ID, 用户ID) 签名，
+    同一用户在同一轮次内代号固定，不同轮次之间无法关联，也无法由用户名反推。
+    
+    Returns:
+        str: 6 位大写十六进制代号
+    """
+    import hmac
+    import hashlib
+    from django.conf import settings
+    
+    secret = getattr(settings, 'BIDDER_ALIAS_SECRET', settings.SECRET_KEY)
+    message = f'{bidding_round_id}:{user_id}'.encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()[:6].upper()
+
+
 class Bid(models.Model):
     """用户竞标（用户对歌曲或谱面的出价）"""
     
@@ -474,6 +554,12 @@ class Bid(models.Model):
         default=False,
         help_text='是否已被drop（被更高出价者获得）'
     )
+    bidder_alias = models.CharField(
+        max_length=16,
+        blank=True,
+        default='',
+        help_text='竞标者在本轮次的匿名代号（保存时生成，见 make_bidder_alias）'
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         help_text='竞标时间'
@@ -492,6 +578,12 @@ class Bid(models.Model):
         target = self.song.title if self.song else (f"{self.chart.user.username}的谱面" if self.chart else "未知")
         return f"{self.user.username} 竞标 {target} - {self.amount}代币"
     
+    def save(self, *args, **kwargs):
+        """保存时生成匿名代号（bulk_create 不经过此处，可用 backfill_bidder_aliases 补齐）"""
+        if not self.bidder_alias and self.bidding_round_id and self.user_id:
+            self.bidder_alias = make_bidder_alias(self.bidding_round_id, self.user_id)
+        super().save(*args, **kwargs)
+    
     def clean(self):
         """验证竞标"""
         # 验证bid_type与song/chart的一致性
@@ -678,18 +770,21 @@ class Chart(models.Model):
     # 上传资源（第一阶段半成品需要打包文件）
     audio_file = models.FileField(
         upload_to=get_chart_audio_filename,
+        storage=get_media_storage,
         null=True,
         blank=True,
         help_text='谱面对应音频文件'
     )
     cover_image = models.ImageField(
         upload_to=get_chart_cover_filename,
+        storage=get_media_storage,
         null=True,
         blank=True,
         help_text='谱面封面图片'
     )
     background_video = models.FileField(
         upload_to=get_chart_video_filename,
+        storage=get_media_storage,
         null=True,
         blank=True,
         help_text='谱面背景视频（可选）'
@@ -761,13 +856,23 @@ class Chart(models.Model):
         ordering = ['-created_at']
         # 一个用户对同一歌曲在同一轮中只能提交一个谱面
         unique_together = ('bidding_round', 'user', 'song')
+        # 谱面列表的游标分页按 (-created_at, id) 定位
+        indexes = [
+            models.Index(fields=['-created_at', 'id'], name='chart_created_id_idx'),
+            models.Index(fields=['status', '-created_at', 'id'], name='chart_status_created_id_idx'),
+        ]
     
     def __str__(self):
         part_info = '（二部分）' if not self.is_part_one else ''
         return f"{self.user.username} - {self.song.title} {part_info}({self.get_status_display()})"
     
     def delete(self, *args, **kwargs):
-        """删除谱面时同时删除关联的谱面文件"""
+        """删除谱面时同时删除关联的谱面文件和打包索引（媒体文件只减少引用，无引用时才删除）"""
+        from .bundle_cache import BundleCache
+        
+        BundleCache.invalidate(self.id)
+        # 先删除记录，文件引用检查时不再计入本条记录
+        result = super().delete(*args, **kwargs)
         if self.chart_file:
             self.chart_file.delete(save=False)
         if self.audio_file:
@@ -776,7 +881,80 @@ class Chart(models.Model):
             self.cover_image.delete(save=False)
         if self.background_video:
             self.background_video.delete(save=False)
-        super().delete(*args, **kwargs)
+        return result
+
+
+class MajdataUpload(models.Model):
+    """
+    Majdata.net 转发队列（发件箱）
+    
+    提交谱面时与谱面在同一事务中写入，由 python manage.py run_majdata_worker 异步上传，
+    失败后按指数退避重试（见 songs/majdata_outbox.py）。每张谱面只有一条记录，上传成功后不再重复上传。
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', '待上传'),
+        ('running', '上传中'),
+        ('succeeded', '已上传'),
+        ('failed', '已放弃'),
+    ]
+    
+    chart = models.OneToOneField(
+        Chart,
+        on_delete=models.CASCADE,
+        related_name='majdata_upload',
+        help_text='转发的谱面'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        help_text='上传状态'
+    )
+    attempts = models.IntegerField(
+        default=0,
+        help_text='已尝试次数'
+    )
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        help_text='下次尝试时间'
+    )
+    locked_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='开始上传时间（上传中超时未完成的记录会重新排队）'
+    )
+    last_error = models.TextField(
+        blank=True,
+        default='',
+        help_text='最近一次失败原因'
+    )
+    external_url = models.CharField(
+        max_length=500,
+        blank=True,
+        default='',
+        help_text='Majdata.net 返回的谱面地址'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        help_text='创建时间'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text='最后更新时间'
+    )
+    
+    class Meta:
+        verbose_name = 'Majdata 转发'
+        verbose_name_plural = 'Majdata 转发'
+        ordering = ['next_attempt_at', 'id']
+        # 工作进程按 (status, next_attempt_at) 取到期的记录
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='majdata_status_next_idx'),
+        ]
+    
+    def __str__(self):
+        return f"谱面 #{self.chart_id} - {self.get_status_display()}（第 {self.attempts} 次）"
 
 
 class PeerReviewAllocation(models.Model):
@@ -893,6 +1071,77 @@ class PeerReview(models.Model):
             )
 
 
+
+class RoundRanking(models.Model):
+    """
+    轮次排名（物化表）
+    
+    由 songs.ranking_service.RankingService 在互评写入后增量刷新，
+    排名页只读此表，不查询谱面表。
+    """
+    
+    bidding_round = models.ForeignKey(
+        BiddingRound,
+        on_delete=models.CASCADE,
+        related_name='rankings',
+        help_text='所属竞标轮次'
+    )
+    
+    chart = models.OneToOneField(
+        Chart,
+        on_delete=models.CASCADE,
+        related_name='ranking',
+        help_text='排名的谱面'
+    )
+    
+    # 排名（按平均分、总分降序）
+    rank = models.IntegerField(
+        default=0,
+        help_text='竞赛排名（并列占用名次，如 1, 2, 2, 4）'
+    )
+    dense_rank = models.IntegerField(
+        default=0,
+        help_text='密集排名（并列不占用名次，如 1, 2, 2, 3）'
+    )
+    
+    # 展示字段（冗余，避免排名页关联查询）
+    username = models.CharField(
+        max_length=150,
+        help_text='谱面作者用户名'
+    )
+    song_title = models.CharField(
+        max_length=100,
+        help_text='歌曲标题'
+    )
+    average_score = models.FloatField(
+        default=0.0,
+        help_text='平均分'
+    )
+    total_score = models.IntegerField(
+        default=0,
+        help_text='总评分'
+    )
+    review_count = models.IntegerField(
+        default=0,
+        help_text='收到的评分数'
+    )
+    
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text='刷新时间'
+    )
+    
+    class Meta:
+        verbose_name = '轮次排名'
+        verbose_name_plural = '轮次排名'
+        ordering = ['bidding_round', 'rank', 'chart_id']
+        indexes = [
+            models.Index(fields=['bidding_round', 'rank', 'chart']),
+        ]
+    
+    def __str__(self):
+        return f"#{self.rank} {self.username} - {self.song_title}"
+
 # ==================== 第二轮竞标系统（已废弃，使用统一的Bid系统） ====================
 # 注意：以下代码已被注释，现在使用统一的Bid/BidResult系统来处理歌曲和谱面竞标
 # 请使用 BiddingRound.bidding_type='chart' 来进行谱面竞标
@@ -0,0 +1,163 @@
+"""
+列表分页
+支持两种模式：
+- 游标（keyset）分页：传 cursor 参数（首页传空值），按排序键定位下一页，深翻页不随偏移量变慢
+- 页码分页：传 page / page_size，兼容原有接口（偏移量分页，深翻页仍为 O(offset)）
+总数只在需要时计算，且优先使用缓存
+"""
+
+import base64
+import binascii
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# 未由信号维护的列表总数的缓存时间（秒）
+PAGINATION_COUNT_TTL = 60
+
+# 每页数量上限（前端歌曲页会一次拉取 1000 首）
+MAX_PAGE_SIZE = 1000
+
+
+class KeysetPagination:
+    """游标 / 页码分页工具类"""
+
+    @staticmethod
+    def encode_cursor(values):
+        """
+        将排序键的值编码为不透明游标
+
+        Args:
+            values: 排序键的值列表（日期时间按 ISO 格式保存，保留微秒）
+
+        Returns:
+            str: URL 安全的游标字符串
+        """
+        raw = json.dumps(values, separators=(',', ':'), default=lambda value: value.isoformat())
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor, model, ordering):
+        """
+        解析游标为排序键的值
+
+        Args:
+            cursor: encode_cursor 生成的游标
+            model: 列表的模型类
+            ordering: 排序字段列表，如 ['-created_at', 'id']
+
+        Returns:
+            list: 转换为字段类型后的值
+
+        Raises:
+            ValidationError: 游标格式错误
+        """
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if not isinstance(values, list) or len(values) != len(ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(ordering, values)
+            ]
+        except (ValueError, TypeError, binascii.Error, ValidationError):
+            raise ValidationError('无效的游标')
+
+    @staticmethod
+    def _after(ordering, values):
+        """
+        生成"排在游标之后"的过滤条件
+
+        例如排序 ['-created_at', 'id'] 对应：
+        created_at < c OR (created_at = c AND id > i)
+        """
+        condition = Q()
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {f.lstrip('-'): value for f, value in zip(ordering[:i], values[:i])}
+            condition |= Q(**equal, **{f'{name}__{lookup}': values[i]})
+        return condition
+
+    @staticmethod
+    def get_page_size(request, default):
+        """读取 page_size 参数（限制在 1 ~ MAX_PAGE_SIZE）"""
+        try:
+            page_size = int(request.query_params.get('page_size', default))
+        except (TypeError, ValueError):
+            page_size = default
+        return min(max(page_size, 1), MAX_PAGE_SIZE)
+
+    @staticmethod
+    def cached_count(queryset, cache_key):
+        """
+        获取列表总数（缓存 PAGINATION_COUNT_TTL 秒）
+
+        Args:
+            queryset: 需要计数的查询集
+            cache_key: 缓存键
+        """
+        return cache.get_or_set(cache_key, queryset.count, PAGINATION_COUNT_TTL)
+
+    @staticmethod
+    def paginate(request, queryset, ordering, get_count, default_page_size=10):
+        """
+        对查询集分页
+
+        请求带 cursor 参数时使用游标分页，此时只有 include_count=1 才返回总数；
+        否则使用 page / page_size 页码分页（兼容原有响应格式）。
+
+        Args:
+            request: 请求对象
+            queryset: 未排序的查询集
+            ordering: 排序字段列表，最后一个字段必须唯一（如 ['-created_at', 'id']）
+            get_count: 返回列表总数的函数（调用方负责缓存）
+            default_page_size: 默认每页数量
+
+        Returns:
+            tuple: (当前页对象列表, 分页信息字典)
+
+        Raises:
+            ValidationError: 游标或页码无效
+        """
+        page_size = KeysetPagination.get_page_size(request, default_page_size)
+        queryset = queryset.order_by(*ordering)
+        fields = [field.lstrip('-') for field in ordering]
+
+        if 'cursor' in request.query_params:
+            cursor = request.query_params.get('cursor')
+            if cursor:
+                values = KeysetPagination.decode_cursor(cursor, queryset.model, ordering)
+                queryset = queryset.filter(KeysetPagination._after(ordering, values))
+
+            items = list(queryset[:page_size + 1])
+            next_cursor = None
+            if len(items) > page_size:
+                items = items[:page_size]
+                next_cursor = KeysetPagination.encode_cursor(
+                    [getattr(items[-1], field) for field in fields]
+                )
+
+            meta = {'page_size': page_size, 'next_cursor': next_cursor}
+            if request.query_params.get('include_count') in ('1', 'true'):
+                meta['count'] = get_count()
+            return items, meta
+
+        try:
+            page = int(request.query_params.get('page', 1))
+        except (TypeError, ValueError):
+            raise ValidationError('无效的页码')
+        page = max(page, 1)
+        start = (page - 1) * page_size
+
+        total_count = get_count()
+        items = list(queryset[start:start + page_size])
+        return items, {
+            'count': total_count,
+            'page': page,
+            'page_size': page_size,
+            'total_pages': (total_count + page_size - 1) // page_size,
+        }
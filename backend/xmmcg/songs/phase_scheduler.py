@@ -0,0 +1,107 @@
+"""
+比赛阶段调度
+在 CompetitionPhase 的时间边界上创建、开启竞标轮次，并可在阶段结束时自动执行分配。
+由 run_phase_scheduler 管理命令调用（常驻进程或 cron 定时执行），请求处理中只读取轮次。
+"""
+
+import logging
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import BiddingRound, CompetitionPhase
+from .phase_service import PhaseService
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseScheduler:
+    """比赛阶段调度类"""
+
+    @staticmethod
+    def get_bidding_type(phase):
+        """
+        阶段对应的竞标类型
+
+        Returns:
+            str | None: 'chart'（phase_key 含 second_bidding）、'song'（含 bidding），其他阶段返回 None
+        """
+        if PhaseService.is_bidding_phase(phase, 'chart'):
+            return 'chart'
+        if PhaseService.is_bidding_phase(phase, 'song'):
+            return 'song'
+        return None
+
+    @staticmethod
+    def tick(now=None, allocate=False):
+        """
+        执行一次调度（可重复执行，结果幂等）
+
+        对每个启用的竞标阶段：
+        - 阶段尚未开始：创建待开始（pending）的竞标轮次
+        - 阶段进行中：创建或开启（active）竞标轮次
+        - 阶段已结束：allocate=True 时对仍在进行中的轮次执行分配（分配完成后轮次标记为 completed）；
+          否则保持进行中，等待管理员在后台执行分配。
+          分配参数与管理员分配接口（allocate_bids_view）一致：谱面竞标优先分配自己的半成品谱面，
+          代币不足时扣光而不报错
+
+        Args:
+            now: 当前时间（默认 timezone.now()，用于测试）
+            allocate: 阶段结束时是否自动执行分配
+
+        Returns:
+            list: 本次执行的操作 [(操作, 竞标轮次, 说明), ...]
+        """
+        now = now or timezone.now()
+        actions = []
+        for phase in CompetitionPhase.objects.filter(is_active=True).order_by('order', 'start_time'):
+            bidding_type = PhaseScheduler.get_bidding_type(phase)
+            if bidding_type is None:
+                continue
+            try:
+                actions.extend(PhaseScheduler._sync_phase(phase, bidding_type, now, allocate))
+            except ValidationError as e:
+                message = e.message if hasattr(e, 'message') else str(e)
+                logger.warning(f"阶段 {phase.phase_key} 调度失败: {message}")
+                actions.append(('failed', None, f'{phase.name}: {message}'))
+        return actions
+
+    @staticmethod
+    @transaction.atomic
+    def _sync_phase(phase, bidding_type, now, allocate):
+        """同步单个竞标阶段的轮次状态"""
+        # 锁定阶段，避免并发执行时重复创建轮次
+        CompetitionPhase.objects.select_for_update().filter(pk=phase.pk).exists()
+
+        actions = []
+        round_obj = phase.bidding_rounds.filter(bidding_type=bidding_type).order_by('id').first()
+
+        if round_obj is None:
+            if now > phase.end_time:
+                return actions  # 已结束且从未开启的阶段不再补建轮次
+            started = now >= phase.start_time
+            round_obj = BiddingRound.objects.create(
+                competition_phase=phase,
+                bidding_type=bidding_type,
+                name=phase.name,
+                status='active' if started else 'pending',
+                started_at=phase.start_time if started else None,
+            )
+            actions.append(('created', round_obj, f'创建{round_obj.get_status_display()}的竞标轮次'))
+
+        if round_obj.status == 'pending' and now >= phase.start_time:
+            round_obj.status = 'active'
+            round_obj.started_at = phase.start_time
+            round_obj.save(update_fields=['status', 'started_at'])
+            actions.append(('activated', round_obj, '阶段开始，开启竞标'))
+
+        if allocate and round_obj.status == 'active' and now > phase.end_time:
+            from .bidding_service import BiddingService
+
+            # 与 allocate_bids_view 相同（priority_self 只对谱面竞标生效）
+            result = BiddingService.allocate_bids(round_obj.id, priority_self=(bidding_type == 'chart'))
+            round_obj.refresh_from_db()
+            actions.append(('allocated', round_obj, f"阶段结束，已分配 {result['allocated_targets']}/{result['total_targets']} 个目标"))
+
+        return actions
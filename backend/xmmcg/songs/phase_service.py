@@ -0,0 +1,157 @@
+"""
+比赛阶段时间线服务
+所有阶段缓存在共享缓存中，直到下一个阶段边界或后台修改阶段时失效；
+“当前阶段”“当前某类竞标阶段”“下一个阶段”等查询在内存中完成，
+所有视图都通过这里解析阶段，不再各自查询数据库
+"""
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import CompetitionPhase
+
+PHASE_TIMELINE_CACHE_KEY = 'competition_phases:timeline'
+
+# 竞标类型 -> 对应竞标阶段 phase_key 中包含的关键字（不区分大小写）
+BIDDING_PHASE_KEYWORDS = {
+    'song': 'bidding',
+    'chart': 'second_bidding',
+}
+
+# 没有后续阶段边界时的最长缓存时间（秒）
+PHASE_TIMELINE_MAX_TTL = 3600
+
+
+class PhaseService:
+    """比赛阶段时间线服务类"""
+
+    @staticmethod
+    def _get_all_phases():
+        """获取所有阶段（含未启用的），按 order、start_time 排序，与模型默认排序一致"""
+        phases = cache.get(PHASE_TIMELINE_CACHE_KEY)
+        if phases is None:
+            phases = list(CompetitionPhase.objects.order_by('order', 'start_time'))
+            cache.set(PHASE_TIMELINE_CACHE_KEY, phases, PhaseService._seconds_until_next_boundary(phases))
+        return phases
+
+    @staticmethod
+    def get_timeline():
+        """
+        获取所有启用的阶段（按 order、start_time 排序）
+
+        Returns:
+            list: CompetitionPhase 对象列表
+        """
+        return [phase for phase in PhaseService._get_all_phases() if phase.is_active]
+
+    @staticmethod
+    def _seconds_until_next_boundary(phases, now=None):
+        """距离下一个阶段开始/结束时间的秒数，作为时间线的缓存时间"""
+        now = now or timezone.now()
+        boundaries = [
+            boundary
+            for phase in phases
+            for boundary in (phase.start_time, phase.end_time)
+            if boundary > now
+        ]
+        if not boundaries:
+            return PHASE_TIMELINE_MAX_TTL
+        seconds = int((min(boundaries) - now).total_seconds()) + 1
+        return max(1, min(seconds, PHASE_TIMELINE_MAX_TTL))
+
+    @staticmethod
+    def invalidate():
+        """使时间线缓存失效（阶段被修改或删除时调用）"""
+        cache.delete(PHASE_TIMELINE_CACHE_KEY)
+
+    @staticmethod
+    def get_current_phase(now=None):
+        """
+        获取当前进行中的阶段（start_time <= now <= end_time）
+
+        Returns:
+            CompetitionPhase | None
+        """
+        now = now or timezone.now()
+        return next(
+            (phase for phase in PhaseService.get_timeline() if phase.start_time <= now <= phase.end_time),
+            None
+        )
+
+    @staticmethod
+    def get_latest_phase():
+        """
+        获取开始时间最晚的阶段（没有进行中的阶段时用于展示）
+
+        Returns:
+            CompetitionPhase | None
+        """
+        return max(PhaseService.get_timeline(), key=lambda phase: phase.start_time, default=None)
+
+    @staticmethod
+    def get_next_phase(now=None):
+        """
+        获取下一个即将开始的启用阶段
+
+        Returns:
+            CompetitionPhase | None
+        """
+        now = now or timezone.now()
+        upcoming = [phase for phase in PhaseService.get_timeline() if phase.start_time > now]
+        return min(upcoming, key=lambda phase: phase.start_time, default=None)
+
+    @staticmethod
+    def get_last_phase():
+        """
+        获取结束时间最晚的启用阶段
+
+        Returns:
+            CompetitionPhase | None
+        """
+        return max(PhaseService.get_timeline(), key=lambda phase: phase.end_time, default=None)
+
+    @staticmethod
+    def is_bidding_phase(phase, bidding_type):
+        """阶段是否为指定类型的竞标阶段（phase_key 包含对应关键字）"""
+        return BIDDING_PHASE_KEYWORDS[bidding_type] in phase.phase_key.lower()
+
+    @staticmethod
+    def get_current_bidding_phase(bidding_type, now=None):
+        """
+        获取当前进行中的指定类型竞标阶段
+
+        Args:
+            bidding_type: 竞标类型（'song' 或 'chart'）
+
+        Returns:
+            CompetitionPhase | None
+        """
+        now = now or timezone.now()
+        return next(
+            (
+                phase for phase in PhaseService.get_timeline()
+                if phase.start_time <= now <= phase.end_time
+                and PhaseService.is_bidding_phase(phase, bidding_type)
+            ),
+            None
+        )
+
+    @staticmethod
+    def get_phase(phase_id, bidding_type=None):
+        """
+        按ID获取阶段（含未启用的）
+
+        Args:
+            phase_id: 阶段ID（整数或数字字符串）
+            bidding_type: 竞标类型（可选，提供时要求阶段为该类型的竞标阶段）
+
+        Returns:
+            CompetitionPhase | None
+        """
+        phase = next(
+            (phase for phase in PhaseService._get_all_phases() if str(phase.id) == str(phase_id)),
+            None
+        )
+        if phase is not None and bidding_type is not None and not PhaseService.is_bidding_phase(phase, bidding_type):
+            return None
+        return phase
@@ -0,0 +1,135 @@
+"""
+排名服务
+维护 RoundRanking 物化表：互评写入后增量刷新单张谱面的排名行，
+再用窗口函数重算所在轮次的名次，只写回名次变化的行
+"""
+
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import Rank, DenseRank
+from django.utils import timezone
+
+from .models import BiddingRound, Chart, RoundRanking
+
+# 参与排名的谱面状态
+RANKED_CHART_STATUSES = ['reviewed']
+
+# 排名顺序：平均分降序，平均分相同时按总分降序；两者都相同则并列
+RANKING_ORDER = [F('average_score').desc(), F('total_score').desc()]
+
+# 从谱面复制到排名行的字段
+RANKING_FIELDS = ['username', 'song_title', 'average_score', 'total_score', 'review_count']
+
+
+class RankingService:
+    """排名服务类"""
+
+    @staticmethod
+    def _chart_rows(charts):
+        """读取谱面的排名字段，返回 {chart_id: (bidding_round_id, status, {字段: 值})}"""
+        return {
+            row['id']: (row['bidding_round_id'], row['status'], {
+                'username': row['user__username'],
+                'song_title': row['song__title'],
+                'average_score': row['average_score'],
+                'total_score': row['total_score'],
+                'review_count': row['review_count'],
+            })
+            for row in charts.values(
+                'id', 'bidding_round_id', 'status', 'user__username', 'song__title',
+                'average_score', 'total_score', 'review_count'
+            )
+        }
+
+    @staticmethod
+    @transaction.atomic
+    def refresh_chart(chart_id):
+        """
+        刷新单张谱面的排名行，有变化时重算所在轮次的名次
+
+        谱面进入 reviewed 状态时插入排名行，离开时删除；
+        评分统计没有变化时不写入任何数据。
+
+        Args:
+            chart_id: 谱面ID
+
+        Returns:
+            bool: 排名表是否有变化
+        """
+        rows = RankingService._chart_rows(Chart.objects.filter(id=chart_id))
+        if chart_id not in rows:
+            return False  # 谱面已删除，排名行随级联删除
+        bidding_round_id, chart_status, values = rows[chart_id]
+
+        # 锁定轮次，同一轮次的名次重算串行执行
+        BiddingRound.objects.select_for_update().filter(id=bidding_round_id).exists()
+
+        existing = RoundRanking.objects.filter(chart_id=chart_id).values(*RANKING_FIELDS).first()
+        if chart_status not in RANKED_CHART_STATUSES:
+            if existing is None:
+                return False
+            RoundRanking.objects.filter(chart_id=chart_id).delete()
+        elif existing == values:
+            return False
+        elif existing is None:
+            RoundRanking.objects.create(bidding_round_id=bidding_round_id, chart_id=chart_id, **values)
+        else:
+            RoundRanking.objects.filter(chart_id=chart_id).update(updated_at=timezone.now(), **values)
+
+        RankingService.rerank_round(bidding_round_id)
+        return True
+
+    @staticmethod
+    def rerank_round(bidding_round_id):
+        """
+        用窗口函数重算轮次名次，只写回名次变化的行（需在事务中调用）
+
+        rank 为竞赛排名（1, 2, 2, 4），dense_rank 为密集排名（1, 2, 2, 3）。
+
+        Args:
+            bidding_round_id: 竞标轮次ID
+
+        Returns:
+            int: 名次变化的行数
+        """
+        now = timezone.now()
+        changed = [
+            RoundRanking(id=ranking_id, rank=new_rank, dense_rank=new_dense_rank, updated_at=now)
+            for ranking_id, rank, dense_rank, new_rank, new_dense_rank in RoundRanking.objects.filter(
+                bidding_round_id=bidding_round_id
+            ).annotate(
+                new_rank=Window(Rank(), order_by=RANKING_ORDER),
+                new_dense_rank=Window(DenseRank(), order_by=RANKING_ORDER),
+            ).values_list('id', 'rank', 'dense_rank', 'new_rank', 'new_dense_rank')
+            if (rank, dense_rank) != (new_rank, new_dense_rank)
+        ]
+        RoundRanking.objects.bulk_update(changed, ['rank', 'dense_rank', 'updated_at'], batch_size=500)
+        return len(changed)
+
+    @staticmethod
+    @transaction.atomic
+    def rebuild_round(bidding_round_id):
+        """
+        全量重建轮次的排名表（用于数据修复或后台直接修改谱面之后）
+
+        Args:
+            bidding_round_id: 竞标轮次ID
+
+        Returns:
+            int: 排名行数
+        """
+        BiddingRound.objects.select_for_update().filter(id=bidding_round_id).exists()
+        rows = RankingService._chart_rows(Chart.objects.filter(
+            bidding_round_id=bidding_round_id,
+            status__in=RANKED_CHART_STATUSES
+        ))
+        RoundRanking.objects.filter(bidding_round_id=bidding_round_id).delete()
+        RoundRanking.objects.bulk_create(
+            [
+                RoundRanking(bidding_round_id=bidding_round_id, chart_id=chart_id, **values)
+                for chart_id, (_, _, values) in rows.items()
+            ],
+            batch_size=500
+        )
+        RankingService.rerank_round(bidding_round_id)
+        return len(rows)
@@ -1,9 +1,9 @@
-import re
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Song, Banner, Announcement, CompetitionPhase
 from .utils import (
     calculate_file_hash,
+    parse_maidata_designer,
     validate_audio_file,
     validate_cover_image,
     validate_background_video,
@@ -220,12 +220,39 @@ class BidSerializer(serializers.ModelSerializer):
             }
         return None
     
+    @staticmethod
+    def build_status_context(bids):
+        """
+        一次查询构建竞标状态所需的中选结果映射，作为序列化器的 context 传入
+
+        Args:
+            bids: 待序列化的竞标列表（需 select_related('bidding_round')）
+
+        Returns:
+            dict: {'bid_results': {(轮次ID, 用户ID): (歌曲ID, 谱面ID)}}
+        """
+        from .models import BidResult
+        
+        completed_round_ids = {bid.bidding_round_id for bid in bids if bid.bidding_round.status == 'completed'}
+        bid_results = {}
+        if completed_round_ids:
+            results = BidResult.objects.filter(
+                bidding_round_id__in=completed_round_ids,
+                user_id__in={bid.user_id for bid in bids}
+            ).values_list('bidding_round_id', 'user_id', 'song_id', 'chart_id')
+            # 与逐条查询的 .first() 一致：按默认排序（-allocated_at）取每个用户的第一条结果
+            for round_id, user_id, song_id, chart_id in results:
+                bid_results.setdefault((round_id, user_id), (song_id, chart_id))
+        return {'bid_results': bid_results}
+    
     def get_status(self, obj):
         """
         获取竞标状态
         - bidding: 进行中
         - won: 已中选
         - lost: 已落选
+        
+        context 中有 build_status_context 生成的 bid_results 时直接查表，否则逐条查询
         """
         from .models import BidResult
         
@@ -234,16 +261,21 @@ class BidSerializer(serializers.ModelSerializer):
             return 'bidding'
         
         # 检查是否中选
-        result = BidResult.objects.filter(
-            bidding_round=obj.bidding_round,
-            user=obj.user
-        ).first()
+        key = (obj.bidding_round_id, obj.user_id)
+        if 'bid_results' in self.context:
+            result = self.context['bid_results'].get(key)
+        else:
+            result = BidResult.objects.filter(
+                bidding_round_id=obj.bidding_round_id,
+                user_id=obj.user_id
+            ).values_list('song_id', 'chart_id').first()
         
         if result:
+            song_id, chart_id = result
             # 检查是否是这个竞标对应的目标（歌曲或谱面）
-            if obj.bid_type == 'song' and result.song_id == obj.song_id:
+            if obj.bid_type == 'song' and song_id == obj.song_id:
                 return 'won'
-            elif obj.bid_type == 'chart' and result.chart_id == obj.chart_id:
+            elif obj.bid_type == 'chart' and chart_id == obj.chart_id:
                 return 'won'
         
         return 'lost'
@@ -317,6 +349,21 @@ class ChartSerializer(serializers.ModelSerializer):
             'created_at', 'submitted_at', 'review_completed_at'
         )
     
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        预取序列化用到的关联对象，列表的查询数与谱面数量无关
+
+        Args:
+            queryset: Chart 查询集
+
+        Returns:
+            QuerySet: 加上 select_related 的查询集
+        """
+        return queryset.select_related(
+            'user', 'song__user', 'part_one_chart', 'completion_bid_result'
+        )
+    
     def _build_url(self, request, field):
         if field:
             return request.build_absolute_uri(field.url) if request else field.url
@@ -414,12 +461,10 @@ class ChartCreateSerializer(serializers.ModelSerializer):
     def validate(self, attrs):
         chart_file = attrs.get('chart_file')
         if chart_file:
-            content = chart_file.read().decode('utf-8', errors='ignore')
-            match = re.search(r'^\s*&des=(.+)$', content, re.MULTILINE)
-            chart_file.seek(0)
-            if not match or not match.group(1).strip():
+            designer = parse_maidata_designer(chart_file)
+            if not designer:
                 raise serializers.ValidationError({'chart_file': '请填写谱师名义'})
-            attrs['designer'] = match.group(1).strip()
+            attrs['designer'] = designer
         else:
             raise serializers.ValidationError({'chart_file': '谱面文件不能为空'})
         return attrs
@@ -501,6 +546,27 @@ class ChartDetailSerializer(serializers.ModelSerializer):
         )
         read_only_fields = fields
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        预取序列化用到的关联对象和评分（评分按时间倒序存入 prefetched_reviews）
+
+        Args:
+            queryset: Chart 查询集
+
+        Returns:
+            QuerySet: 加上 select_related / prefetch_related 的查询集
+        """
+        from django.db.models import Prefetch
+        
+        return queryset.select_related('user', 'song__user').prefetch_related(
+            Prefetch(
+                'reviews',
+                queryset=PeerReview.objects.only('chart_id', 'score', 'comment', 'created_at').order_by('-created_at'),
+                to_attr='prefetched_reviews'
+            )
+        )
+
     def _build_url(self, request, field):
         if field:
             return request.build_absolute_uri(field.url) if request else field.url
@@ -520,10 +586,16 @@ class ChartDetailSerializer(serializers.ModelSerializer):
         return self._build_url(request, obj.cover_image)
     
     def get_reviews(self, obj):
-        """获取该谱面的所有评分（匿名）"""
-        reviews = PeerReview.objects.filter(
-            chart=obj
-        ).values('score', 'comment', 'created_at').order_by('-created_at')
+        """获取该谱面的所有评分（匿名，优先使用 setup_eager_loading 预取的结果）"""
+        if hasattr(obj, 'prefetched_reviews'):
+            reviews = [
+                {'score': review.score, 'comment': review.comment, 'created_at': review.created_at}
+                for review in obj.prefetched_reviews
+            ]
+        else:
+            reviews = PeerReview.objects.filter(
+                chart=obj
+            ).values('score', 'comment', 'created_at').order_by('-created_at')
         return PeerReviewSerializer(reviews, many=True).data
 
 
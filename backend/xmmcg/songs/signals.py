@@ -0,0 +1,102 @@
+"""
+歌曲/谱面相关信号处理
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Bid, BiddingRound, Song, Chart, CompetitionPhase, PeerReview
+
+
+@receiver(post_save, sender=PeerReview)
+def refresh_chart_ranking(sender, instance, created, **kwargs):
+    """互评写入后刷新该谱面的排名（事务提交后执行，读到已更新的评分统计）"""
+    if kwargs.get('raw'):
+        return
+    from .ranking_service import RankingService
+
+    chart_id = instance.chart_id
+    transaction.on_commit(lambda: RankingService.refresh_chart(chart_id))
+
+
+# ==================== 首页状态计数器 ====================
+# 计数器在事务提交后更新，回滚的写入不会计入
+
+@receiver(post_save, sender=Song)
+@receiver(post_save, sender=Chart)
+def count_created_submission(sender, instance, created, **kwargs):
+    """新增歌曲/谱面时累加首页计数器"""
+    if not created or kwargs.get('raw'):
+        return
+    from .status_service import CompetitionStatusService
+
+    name = 'songs' if sender is Song else 'charts'
+    transaction.on_commit(lambda: CompetitionStatusService.adjust_counter(name, 1))
+
+
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Chart)
+def count_deleted_submission(sender, instance, **kwargs):
+    """删除歌曲/谱面时扣减首页计数器"""
+    from .status_service import CompetitionStatusService
+
+    name = 'songs' if sender is Song else 'charts'
+    transaction.on_commit(lambda: CompetitionStatusService.adjust_counter(name, -1))
+
+
+@receiver(post_save, sender=Bid)
+def count_new_participant(sender, instance, created, **kwargs):
+    """用户第一次竞标时累加参与人数"""
+    if not created or kwargs.get('raw'):
+        return
+    if Bid.objects.filter(user_id=instance.user_id).exclude(pk=instance.pk).exists():
+        return
+    from .status_service import CompetitionStatusService
+
+    transaction.on_commit(lambda: CompetitionStatusService.adjust_counter('participants', 1))
+
+
+@receiver(post_delete, sender=Bid)
+def reset_participant_count(sender, instance, **kwargs):
+    """
+    删除竞标后使参与人数失效，下次读取时重算
+
+    级联删除时同一用户的多条竞标在信号发出前已全部删除，无法逐条判断是否为最后一条，
+    因此不做增量扣减。
+    """
+    from .status_service import CompetitionStatusService
+
+    transaction.on_commit(lambda: CompetitionStatusService.invalidate_counter('participants'))
+
+
+# ==================== 竞标行情快照 ====================
+
+@receiver(post_save, sender=Bid)
+@receiver(post_delete, sender=Bid)
+def invalidate_bid_market(sender, instance, **kwargs):
+    """竞标被创建、修改或删除后使该轮次的行情快照失效"""
+    from .market_service import BidMarketService
+
+    round_id = instance.bidding_round_id
+    transaction.on_commit(lambda: BidMarketService.invalidate(round_id))
+
+
+@receiver(post_save, sender=BiddingRound)
+def invalidate_round_market(sender, instance, **kwargs):
+    """轮次状态变化（如分配完成，批量更新竞标不触发信号）后使行情快照失效"""
+    from .market_service import BidMarketService
+
+    round_id = instance.id
+    transaction.on_commit(lambda: BidMarketService.invalidate(round_id))
+
+
+# ==================== 阶段时间线缓存 ====================
+
+@receiver(post_save, sender=CompetitionPhase)
+@receiver(post_delete, sender=CompetitionPhase)
+def invalidate_phase_timeline(sender, instance, **kwargs):
+    """阶段被修改或删除后使时间线缓存失效"""
+    from .phase_service import PhaseService
+
+    transaction.on_commit(PhaseService.invalidate)
@@ -0,0 +1,128 @@
+"""
+比赛状态快照服务
+首页状态接口使用的计数器保存在共享缓存中，由 Bid/Song/Chart 的信号增量维护，
+阶段从缓存的时间线中解析；稳定状态下不查询数据库
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Bid, Song, Chart
+from .phase_service import PhaseService
+
+# 计数器名称 -> (缓存键, 缓存缺失时的重算查询)
+STATUS_COUNTERS = {
+    'participants': ('competition_status:participants', lambda: Bid.objects.values('user_id').distinct().count()),
+    'songs': ('competition_status:songs', lambda: Song.objects.count()),
+    'charts': ('competition_status:charts', lambda: Chart.objects.count()),
+}
+
+# 计数器缓存时间（秒）：到期后从数据库重算，修正批量写入（不触发信号）或多进程并发累加造成的偏差
+STATUS_COUNTER_TTL = 300
+
+
+class CompetitionStatusService:
+    """比赛状态快照服务类"""
+
+    @staticmethod
+    def get_counters():
+        """
+        获取首页计数器，缓存缺失的计数器从数据库重算
+
+        Returns:
+            dict: {'participants': 竞标人数, 'songs': 歌曲数, 'charts': 谱面数}
+        """
+        cached = cache.get_many([key for key, _ in STATUS_COUNTERS.values()])
+        counters = {}
+        for name, (key, query) in STATUS_COUNTERS.items():
+            if key not in cached:
+                cached[key] = query()
+                cache.set(key, cached[key], STATUS_COUNTER_TTL)
+            counters[name] = cached[key]
+        return counters
+
+    @staticmethod
+    def adjust_counter(name, delta):
+        """
+        增减计数器（由信号调用）
+
+        计数器未缓存时不做处理，下次读取时会从数据库重算。
+
+        Args:
+            name: 计数器名称（见 STATUS_COUNTERS）
+            delta: 变化量
+        """
+        try:
+            cache.incr(STATUS_COUNTERS[name][0], delta)
+        except ValueError:
+            pass
+
+    @staticmethod
+    def invalidate_counter(name):
+        """使计数器失效，下次读取时从数据库重算"""
+        cache.delete(STATUS_COUNTERS[name][0])
+
+    @staticmethod
+    def get_status(now=None):
+        """
+        生成首页比赛状态
+
+        Returns:
+            dict: 与 get_competition_status 接口的响应内容一致
+        """
+        now = now or timezone.now()
+        peer_review_max_score = getattr(settings, 'PEER_REVIEW_MAX_SCORE', 50)
+
+        # 当前活跃的阶段（不限于竞标阶段），没有时取最近的阶段
+        current_phase = PhaseService.get_current_phase(now) or PhaseService.get_latest_phase()
+
+        if not current_phase:
+            return {
+                'currentRound': '未开始',
+                'status': 'pending',
+                'statusText': '待开始',
+                'participants': 0,
+                'submissions': 0,
+                'peer_review_max_score': peer_review_max_score,
+                'current_round_id': None,  # 没有活跃轮次
+            }
+
+        # 根据时间判断状态
+        if now < current_phase.start_time:
+            status_val = 'pending'
+            status_text = '待开始'
+        elif now > current_phase.end_time:
+            status_val = 'completed'
+            status_text = '已完成'
+        else:
+            status_val = 'active'
+            status_text = '进行中'
+
+        counters = CompetitionStatusService.get_counters()
+
+        # 根据阶段的 submissions_type 字段选择提交作品数
+        if current_phase.submissions_type == 'songs':
+            submissions_count = counters['songs']
+            submissions_label = '歌曲数'
+        elif current_phase.submissions_type == 'charts':
+            submissions_count = counters['charts']
+            submissions_label = '谱面数'
+        else:
+            # 其他阶段：默认统计歌曲数
+            submissions_count = counters['songs']
+            submissions_label = '作品数'
+
+        return {
+            'currentRound': current_phase.name,
+            'status': status_val,
+            'statusText': status_text,
+            'participants': counters['participants'],
+            'submissions': submissions_count,
+            'submissionsLabel': submissions_label,  # 提交作品数的标签
+            'phaseKey': current_phase.phase_key,
+            'startTime': current_phase.start_time,
+            'endTime': current_phase.end_time,
+            'peer_review_max_score': peer_review_max_score,  # 互评最大分数
+            'current_round_id': current_phase.id,  # 当前轮次ID
+        }
@@ -0,0 +1,152 @@
+"""
+按内容存储的媒体文件存储后端
+歌曲与谱面的音频、封面、视频按内容 SHA256 保存为 blobs/ab/cd/<哈希>.<扩展名>，
+相同内容（例如谱面沿用歌曲原音频）只保存一份，引用计数记录在 MediaBlob 表中：
+- 保存时：文件已存在则只增加引用（不再写入），否则写入文件并创建记录
+- 删除时：引用减 1，降为 0 且没有记录引用该文件时才删除文件
+
+不在 blobs/ 下的旧文件按普通文件处理（python manage.py dedupe_media 迁移到按内容存储）。
+保存时所在事务回滚会留下没有记录的文件，由 dedupe_media 在超过保留时间后清除。
+"""
+
+import hashlib
+import logging
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+BLOB_PREFIX = 'blobs/'
+
+
+def blob_name_for(digest, filename):
+    """
+    按内容哈希生成存储路径
+
+    Args:
+        digest: 文件内容 SHA256
+        filename: 原文件名（只取扩展名）
+
+    Returns:
+        str: blobs/<哈希前两位>/<哈希第三四位>/<哈希>.<扩展名>
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """按内容存储、带引用计数的文件存储（位于 MEDIA_ROOT 下）"""
+
+    @staticmethod
+    def _hash(content):
+        """文件内容 SHA256（经 HashingFileUploadHandler 上传的文件已在接收时算出）"""
+        digest = getattr(content, 'sha256', None)
+        if digest:
+            return digest
+        hasher = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        return hasher.hexdigest()
+
+    def _save(self, name, content):
+        from .models import MediaBlob
+
+        digest = self._hash(content)
+        blob_name = blob_name_for(digest, name)
+
+        with transaction.atomic():
+            MediaBlob.objects.get_or_create(
+                name=blob_name,
+                defaults={'sha256': digest, 'size': content.size, 'ref_count': 0}
+            )
+            # 锁定记录，避免与引用降为 0 的删除并发
+            blob = MediaBlob.objects.select_for_update().get(name=blob_name)
+            if not self.exists(blob_name):
+                saved_name = super()._save(blob_name, content)
+                if saved_name != blob_name:
+                    # 并发写入了同一内容，保留先写入的文件
+                    super().delete(saved_name)
+            blob.ref_count = F('ref_count') + 1
+            blob.save(update_fields=['ref_count'])
+        return blob_name
+
+    def delete(self, name):
+        from .models import MediaBlob
+
+        if not name.startswith(BLOB_PREFIX):
+            super().delete(name)
+            return
+
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                # 没有记录的文件（保存时事务回滚），仍有记录引用时保留
+                if not count_references(name):
+                    super().delete(name)
+                return
+            if blob.ref_count > 1:
+                blob.ref_count = F('ref_count') - 1
+                blob.save(update_fields=['ref_count'])
+                return
+            # 引用计数与实际不符（例如迁移尚未重新计数）时不删除文件，按实际引用修正
+            references = count_references(name)
+            if references:
+                logger.warning(f"媒体文件 {name} 引用计数为 {blob.ref_count}，实际仍有 {references} 条记录引用，不删除")
+                blob.ref_count = references
+                blob.save(update_fields=['ref_count'])
+                return
+            blob.delete()
+            super().delete(name)
+
+
+media_storage = ContentAddressedStorage()
+
+
+def get_media_storage():
+    """歌曲与谱面媒体文件字段使用的存储（供 FileField(storage=...) 引用）"""
+    return media_storage
+
+
+def get_media_fields():
+    """
+    使用按内容存储的文件字段
+
+    Returns:
+        list: [(模型类, [字段名, ...]), ...]
+    """
+    from django.apps import apps
+    from django.db.models import FileField
+
+    result = []
+    for model in apps.get_app_config('songs').get_models():
+        names = [
+            field.name for field in model._meta.get_fields()
+            if isinstance(field, FileField) and field.storage is media_storage
+        ]
+        if names:
+            result.append((model, names))
+    return result
+
+
+def count_references(name):
+    """
+    数据库中引用该文件的记录数
+
+    Args:
+        name: 存储路径（blobs/...）
+
+    Returns:
+        int: 引用次数（同一记录的多个字段分别计数）
+    """
+    return sum(
+        model.objects.filter(**{field_name: name}).count()
+        for model, field_names in get_media_fields()
+        for field_name in field_names
+    )
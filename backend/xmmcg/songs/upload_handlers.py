@@ -0,0 +1,77 @@
+"""
+上传文件处理器
+所有上传文件按块写入临时文件（不整体放进内存），写入的同时计算：
+- sha256: 文件内容的 SHA256（歌曲的 audio_hash 直接使用，不再重新读取）
+- size: 文件大小
+- sniffed_type: 根据文件头识别的格式（见 utils.sniff_file_type）
+- maidata_designer: maidata.txt 中 &des= 的值（谱面提交校验直接使用）
+
+每个上传只占用一个读块（默认 64KB）加少量缓冲的内存。
+"""
+
+import hashlib
+import re
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+from .utils import SNIFF_BYTES, sniff_file_type
+
+DESIGNER_RE = re.compile(r'^\s*&des=(.+)$')
+
+# 逐行查找 &des= 时单行的最大缓冲长度，超出的行直接跳过
+MAX_LINE_BYTES = 64 * 1024
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """写入临时文件的同时计算哈希、识别格式的上传处理器"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+        self.head = b''
+        self.scan_designer = self.file_name == 'maidata.txt'
+        self.designer = None
+        self.designer_found = False
+        self.line_buffer = b''
+        self.skip_line = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        if len(self.head) < SNIFF_BYTES:
+            self.head += raw_data[:SNIFF_BYTES - len(self.head)]
+        if self.scan_designer and not self.designer_found:
+            self._scan_lines(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def _scan_lines(self, raw_data):
+        """逐行查找第一个 &des= 行（跨块的行保留在 line_buffer 中）"""
+        lines = (self.line_buffer + raw_data).split(b'\n')
+        self.line_buffer = lines.pop()
+        for line in lines:
+            if self.skip_line:
+                self.skip_line = False
+                continue
+            if self._check_line(line):
+                return
+        if len(self.line_buffer) > MAX_LINE_BYTES:
+            self.line_buffer = b''
+            self.skip_line = True
+
+    def _check_line(self, line):
+        match = DESIGNER_RE.match(line.decode('utf-8', errors='ignore'))
+        if match:
+            self.designer = match.group(1).strip()
+            self.designer_found = True
+        return self.designer_found
+
+    def file_complete(self, file_size):
+        if self.scan_designer and not self.designer_found and self.line_buffer and not self.skip_line:
+            self._check_line(self.line_buffer)
+        self.line_buffer = b''
+
+        uploaded_file = super().file_complete(file_size)
+        uploaded_file.sha256 = self.hasher.hexdigest()
+        uploaded_file.sniffed_type = sniff_file_type(self.head)
+        if self.scan_designer:
+            uploaded_file.maidata_designer = self.designer
+        return uploaded_file
@@ -30,6 +30,7 @@ urlpatterns = [
     path('bids/', views.user_bids_root, name='user-bids-root'),
     path('bids/<int:bid_id>/', views.delete_bid_view, name='delete-bid'),
     path('bids/target/', views.target_bids_list, name='target_bids_list'),
+    path('bids/market/', views.bid_market, name='bid-market'),
     path('bids/allocate/', views.allocate_bids_view, name='allocate-bids'),
     
     # 竞标结果
@@ -44,6 +45,7 @@ urlpatterns = [
     
     # ==================== 互评相关路由 ====================
     path('peer-reviews/allocate/<int:round_id>/', views.allocate_peer_reviews, name='allocate-peer-reviews'),
+    path('peer-reviews/rebalance/<int:round_id>/', views.rebalance_peer_reviews, name='rebalance-peer-reviews'),
     path('peer-reviews/tasks/', views.get_peer_review_tasks, name='get-peer-review-tasks'),
     path('peer-reviews/allocations/<int:allocation_id>/submit/', views.submit_peer_review, name='submit-peer-review'),
     path('peer-reviews/extra/', views.submit_extra_peer_review, name='submit-extra-peer-review'),
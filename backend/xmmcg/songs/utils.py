@@ -1,13 +1,108 @@
 import hashlib
+import re
 from django.core.files.base import File
 from django.conf import settings
 
 
+# 识别文件格式需要的文件头字节数
+SNIFF_BYTES = 16
+
+# 各类上传允许的文件头格式（sniff_file_type 的返回值）
+AUDIO_TYPES = {'mp3', 'wav', 'flac', 'ogg', 'm4a', 'mp4', 'aac', 'wma'}
+IMAGE_TYPES = {'jpeg', 'png', 'gif', 'webp'}
+VIDEO_TYPES = {'mp4', 'm4a'}
+
+
+def sniff_file_type(head: bytes):
+    """
+    根据文件头（前 SNIFF_BYTES 字节）识别文件格式
+    
+    Returns:
+        str | None: 'mp3' / 'wav' / 'flac' / 'ogg' / 'm4a' / 'mp4' / 'aac' / 'wma' /
+        'jpeg' / 'png' / 'gif' / 'webp'，无法识别时返回 None
+    """
+    if head.startswith(b'ID3'):
+        return 'mp3'
+    if head.startswith(b'RIFF') and head[8:12] == b'WAVE':
+        return 'wav'
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'webp'
+    if head.startswith(b'fLaC'):
+        return 'flac'
+    if head.startswith(b'OggS'):
+        return 'ogg'
+    if head[4:8] == b'ftyp':
+        return 'm4a' if head[8:12] == b'M4A ' else 'mp4'
+    if head.startswith(b'\x30\x26\xb2\x75'):
+        return 'wma'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'GIF8'):
+        return 'gif'
+    if len(head) >= 2 and head[0] == 0xFF:
+        # MPEG 帧同步：ADTS（AAC）的 layer 位为 0，其余为 MP3
+        if head[1] & 0xF6 == 0xF0:
+            return 'aac'
+        if head[1] & 0xE0 == 0xE0:
+            return 'mp3'
+    return None
+
+
+def get_sniffed_type(file: File):
+    """
+    获取上传文件的格式
+    经 HashingFileUploadHandler 上传的文件已在接收时识别；其他文件只读取文件头
+    """
+    if hasattr(file, 'sniffed_type'):
+        return file.sniffed_type
+    file.seek(0)
+    head = file.read(SNIFF_BYTES)
+    file.seek(0)
+    return sniff_file_type(head)
+
+
+def check_sniffed_type(file: File, allowed_types, label: str) -> tuple[bool, str]:
+    """
+    校验文件内容与类别是否一致
+    文件头能识别出格式且不属于 allowed_types 时视为不合法；无法识别的格式不拦截（只按扩展名校验）
+    
+    Returns:
+        (is_valid, error_message)
+    """
+    sniffed = get_sniffed_type(file)
+    if sniffed and sniffed not in allowed_types:
+        return False, f'{label}内容与格式不符（检测到 {sniffed} 文件）'
+    return True, ''
+
+
+def parse_maidata_designer(file: File):
+    """
+    读取 maidata.txt 中 &des= 的值
+    经 HashingFileUploadHandler 上传的文件已在接收时解析，不再重新读取
+    
+    Returns:
+        str | None: 谱师名义（去除首尾空白），没有 &des= 行时返回 None
+    """
+    if hasattr(file, 'maidata_designer'):
+        return file.maidata_designer
+    file.seek(0)
+    content = file.read().decode('utf-8', errors='ignore')
+    file.seek(0)
+    match = re.search(r'^\s*&des=(.+)$', content, re.MULTILINE)
+    return match.group(1).strip() if match else None
+
+
 def calculate_file_hash(file: File) -> str:
     """
     计算文件的 SHA256 哈希值
     用于识别相同的音频文件
+    经 HashingFileUploadHandler 上传的文件直接使用接收时计算的哈希
     """
+    if getattr(file, 'sha256', None):
+        return file.sha256
+    
     file.seek(0)  # 重置文件指针到开头
     hash_sha256 = hashlib.sha256()
     
@@ -42,7 +137,7 @@ def validate_audio_file(file: File) -> tuple[bool, str]:
     if ext not in allowed_extensions:
         return False, f'不支持的音频格式: {ext}，允许的格式: {", ".join(allowed_extensions)}'
     
-    return True, ''
+    return check_sniffed_type(file, AUDIO_TYPES, '音频文件')
 
 
 def validate_cover_image(file: File) -> tuple[bool, str]:
@@ -68,7 +163,7 @@ def validate_cover_image(file: File) -> tuple[bool, str]:
     if ext not in allowed_extensions:
         return False, f'不支持的图片格式: {ext}，允许的格式: {", ".join(allowed_extensions)}'
     
-    return True, ''
+    return check_sniffed_type(file, IMAGE_TYPES, '封面图片')
 
 
 def validate_title(title: str) -> tuple[bool, str]:
@@ -114,4 +209,4 @@ def validate_background_video(file: File) -> tuple[bool, str]:
     if not (filename.startswith('bg.') or filename.startswith('pv.')):
         return False, '背景视频文件名必须以 bg 或 pv 开头（如: bg.mp4, pv.mp4）'
     
-    return True, ''
+    return check_sniffed_type(file, VIDEO_TYPES, '背景视频')
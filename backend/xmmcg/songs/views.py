@@ -5,17 +5,11 @@ from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from django.http import HttpResponse
 from django.conf import settings
-import io
-import zipfile
 import logging
 import hashlib
 
-from xmmcg.settings import ENABLE_CHART_FORWARD_TO_MAJDATA
-
 logger = logging.getLogger(__name__)
-import os
 
 from .models import Song, Bid, BiddingRound, BidResult, MAX_SONGS_PER_USER, MAX_BIDS_PER_USER, Banner, Announcement, CompetitionPhase, Chart
 from .serializers import (
@@ -31,6 +25,28 @@ from .serializers import (
 from .bidding_service import BiddingService
 
 
+def _conditional_response(request, etag, max_age, build_response):
+    """
+    带 ETag / Cache-Control 的响应：If-None-Match 命中时返回 304，否则调用 build_response 生成响应
+    
+    Args:
+        request: 请求对象
+        etag: 未加引号的 ETag 值
+        max_age: Cache-Control 的 max-age（秒）
+        build_response: 生成完整响应的函数
+    """
+    from django.utils.cache import patch_cache_control, quote_etag
+    
+    etag = quote_etag(etag)
+    if request.headers.get('If-None-Match') == etag:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = build_response()
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_banners(request):
@@ -53,82 +69,31 @@ def get_announcements(request):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_competition_status(request):
-    """公开的比赛状态，用于前端首页展示（从 CompetitionPhase 获取）"""
-    now = timezone.now()
-    
-    # 获取当前活跃的阶段（不限于竞标阶段）
-    current_phase = CompetitionPhase.objects.filter(
-        is_active=True,
-        start_time__lte=now,
-        end_time__gte=now
-    ).first()
-    
-    if not current_phase:
-        # 如果没有当前活跃阶段，尝试获取最近的阶段
-        current_phase = CompetitionPhase.objects.filter(
-            is_active=True
-        ).order_by('-start_time').first()
-    
-    if not current_phase:
-        return Response({
-            'currentRound': '未开始',
-            'status': 'pending',
-            'statusText': '待开始',
-            'participants': 0,
-            'submissions': 0,
-            'peer_review_max_score': getattr(settings, 'PEER_REVIEW_MAX_SCORE', 50),
-            'current_round_id': None,  # 没有活跃轮次
-        }, status=status.HTTP_200_OK)
+    """
+    公开的比赛状态，用于前端首页展示（从 CompetitionPhase 获取）
     
-    # 根据时间判断状态
-    if now < current_phase.start_time:
-        status_val = 'pending'
-        status_text = '待开始'
-    elif now > current_phase.end_time:
-        status_val = 'completed'
-        status_text = '已完成'
-    else:
-        status_val = 'active'
-        status_text = '进行中'
-    
-    # 计算参与人数（全局统计）
-    total_participants = Bid.objects.values('user_id').distinct().count()
-    
-    # 根据阶段的 submissions_type 字段计算提交作品数
-    if current_phase.submissions_type == 'songs':
-        # 统计歌曲数
-        submissions_count = Song.objects.count()
-        submissions_label = '歌曲数'
-    elif current_phase.submissions_type == 'charts':
-        # 统计谱面数
-        from .models import Chart
-        submissions_count = Chart.objects.count()
-        submissions_label = '谱面数'
-    else:
-        # 其他阶段：默认统计歌曲数
-        submissions_count = Song.objects.count()
-        submissions_label = '作品数'
-
-    return Response({
-        'currentRound': current_phase.name,
-        'status': status_val,
-        'statusText': status_text,
-        'participants': total_participants,
-        'submissions': submissions_count,
-        'submissionsLabel': submissions_label,  # 新增：提交作品数的标签
-        'phaseKey': current_phase.phase_key,
-        'startTime': current_phase.start_time,
-        'endTime': current_phase.end_time,
-        'peer_review_max_score': getattr(settings, 'PEER_REVIEW_MAX_SCORE', 50),  # 互评最大分数
-        'current_round_id': current_phase.id,  # 当前轮次ID
-    }, status=status.HTTP_200_OK)
+    阶段来自缓存的时间线，计数器由信号维护在缓存中，稳定状态下不查询数据库；
+    响应带 ETag 和 Cache-Control，内容未变化时对 If-None-Match 返回 304。
+    """
+    import json
+    from django.core.serializers.json import DjangoJSONEncoder
+    from .status_service import CompetitionStatusService
+    
+    data = CompetitionStatusService.get_status()
+    etag = hashlib.md5(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+    return _conditional_response(
+        request, etag, settings.COMPETITION_STATUS_CACHE_MAX_AGE,
+        lambda: Response(data, status=status.HTTP_200_OK)
+    )
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_competition_phases(request):
     """获取所有比赛阶段信息"""
-    phases = CompetitionPhase.objects.filter(is_active=True).order_by('order')
+    from .phase_service import PhaseService
+    
+    phases = PhaseService.get_timeline()
     serializer = CompetitionPhaseSerializer(phases, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -137,41 +102,22 @@ def get_competition_phases(request):
 @permission_classes([AllowAny])
 def get_current_phase(request):
     """获取当前活跃的比赛阶段及权限信息"""
-    now = timezone.now()
+    from .phase_service import PhaseService
     
-    # 获取当前进行中的阶段
-    current_phase = CompetitionPhase.objects.filter(
-        is_active=True,
-        start_time__lte=now,
-        end_time__gte=now
-    ).first()
+    # 当前进行中的阶段；没有时返回下一个即将开始的阶段；都没有则返回最后一个阶段
+    phase = (
+        PhaseService.get_current_phase()
+        or PhaseService.get_next_phase()
+        or PhaseService.get_last_phase()
+    )
     
-    if current_phase:
-        serializer = CompetitionPhaseSerializer(current_phase)
+    if phase:
+        serializer = CompetitionPhaseSerializer(phase)
         return Response(serializer.data, status=status.HTTP_200_OK)
     else:
-        # 如果没有进行中的阶段，返回下一个即将开始的阶段
-        next_phase = CompetitionPhase.objects.filter(
-            is_active=True,
-            start_time__gt=now
-        ).order_by('start_time').first()
-        
-        if next_phase:
-            serializer = CompetitionPhaseSerializer(next_phase)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        else:
-            # 都没有，返回最后一个阶段
-            last_phase = CompetitionPhase.objects.filter(
-                is_active=True
-            ).order_by('-end_time').first()
-            
-            if last_phase:
-                serializer = CompetitionPhaseSerializer(last_phase)
-                return Response(serializer.data, status=status.HTTP_200_OK)
-            else:
-                return Response({
-                    'error': '暂无比赛阶段信息'
-                }, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'error': '暂无比赛阶段信息'
+        }, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['GET'])
@@ -195,29 +141,32 @@ def songs_root(request):
     根路径处理：
     GET /api/songs/ - 列出所有歌曲（任何人）
     POST /api/songs/ - 上传歌曲（需要认证）
+    
+    GET 分页参数（见 KeysetPagination.paginate）：
+    - cursor: 游标分页（首页传空值，之后传上一页的 next_cursor），include_count=1 时返回总数
+    - page / page_size: 页码分页（兼容旧接口）
     """
     if request.method == 'GET':
-        # 列出所有歌曲
-        songs = Song.objects.all()
-        
-        # 分页处理
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 10))
+        from .pagination import KeysetPagination
+        from .status_service import CompetitionStatusService
         
-        start = (page - 1) * page_size
-        end = start + page_size
-        
-        total_count = songs.count()
-        songs_page = songs[start:end]
+        # 列出所有歌曲（总数使用信号维护的缓存计数器）
+        try:
+            songs_page, meta = KeysetPagination.paginate(
+                request, Song.objects.all(), ['-id'],
+                lambda: CompetitionStatusService.get_counters()['songs'],
+            )
+        except ValidationError as e:
+            return Response({
+                'success': False,
+                'message': str(e.message) if hasattr(e, 'message') else str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         serializer = SongListSerializer(songs_page, many=True)
         
         return Response({
             'success': True,
-            'count': total_count,
-            'page': page,
-            'page_size': page_size,
-            'total_pages': (total_count + page_size - 1) // page_size,
+            **meta,
             'results': serializer.data
         }, status=status.HTTP_200_OK)
     
@@ -419,32 +368,27 @@ def user_bids_root(request):
     用户竞标管理
     GET /api/bids/ - 获取当前用户在活跃竞标轮次的竞标
     POST /api/bids/ - 创建新的竞标
+    
+    竞标轮次由阶段调度（python manage.py run_phase_scheduler）在阶段开始时创建，
+    这里只读取，不创建轮次。
     """
+    from .phase_service import PhaseService
+    
     user = request.user
     
     if request.method == 'GET':
         # 获取活跃的竞标轮次
         round_id = request.query_params.get('round_id')
+        round_obj = None
         
         # 如果提供了 round_id，先尝试作为 CompetitionPhase ID
-        # 然后查找或创建对应的 BiddingRound
+        # 然后查找对应的 BiddingRound
         if round_id:
-            try:
-                # 尝试获取 CompetitionPhase
-                phase = CompetitionPhase.objects.get(id=round_id, phase_key__icontains='bidding')
-                
+            phase = PhaseService.get_phase(round_id, bidding_type='song')
+            if phase is not None:
                 # 通过外键查找歌曲竞标轮次
                 round_obj = phase.bidding_rounds.filter(bidding_type='song').first()
-                
-                if not round_obj:
-                    # 自动创建绑定到阶段的轮次
-                    round_obj = BiddingRound.objects.create(
-                        competition_phase=phase,
-                        bidding_type='song',
-                        name=phase.name,
-                        status='active' if timezone.now() < phase.end_time else 'completed'
-                    )
-            except CompetitionPhase.DoesNotExist:
+            else:
                 # 如果不是 CompetitionPhase，尝试作为 BiddingRound ID
                 try:
                     round_obj = BiddingRound.objects.get(id=round_id)
@@ -455,41 +399,31 @@ def user_bids_root(request):
                     }, status=status.HTTP_404_NOT_FOUND)
         else:
             # 获取当前活跃的竞标阶段
-            now = timezone.now()
-            active_phase = CompetitionPhase.objects.filter(
-                phase_key__icontains='bidding',
-                is_active=True,
-                start_time__lte=now,
-                end_time__gte=now
-            ).first()
+            active_phase = PhaseService.get_current_bidding_phase('song')
             
             if active_phase:
-                # 查找或创建对应的 BiddingRound
+                # 查找对应的 BiddingRound
                 round_obj = active_phase.bidding_rounds.filter(bidding_type='song').first()
-                if not round_obj:
-                    round_obj = BiddingRound.objects.create(
-                        competition_phase=active_phase,
-                        bidding_type='song',
-                        name=active_phase.name,
-                        status='active'
-                    )
-            else:
-                return Response({
-                    'success': True,
-                    'message': '当前没有活跃的竞标轮次',
-                    'bids': [],
-                    'bid_count': 0,
-                    'max_bids': MAX_BIDS_PER_USER,
-                }, status=status.HTTP_200_OK)
         
-        # 获取用户在该轮次的所有竞标
-        bids = Bid.objects.filter(
+        if not round_obj:
+            return Response({
+                'success': True,
+                'message': '当前没有活跃的竞标轮次',
+                'bids': [],
+                'bid_count': 0,
+                'max_bids': MAX_BIDS_PER_USER,
+            }, status=status.HTTP_200_OK)
+        
+        # 获取用户在该轮次的所有竞标（预取序列化器用到的关联对象）
+        bids = list(Bid.objects.filter(
             bidding_round=round_obj,
             user=user
-        ).select_related('song').order_by('-amount')
+        ).select_related(
+            'bidding_round', 'user', 'song__user', 'chart__song', 'chart__user'
+        ).order_by('-amount'))
         
-        # 使用序列化器以包含 status 字段
-        bids_data = BidSerializer(bids, many=True).data
+        # 使用序列化器以包含 status 字段（中选结果一次查询得出）
+        bids_data = BidSerializer(bids, many=True, context=BidSerializer.build_status_context(bids)).data
         
         return Response({
             'success': True,
@@ -498,7 +432,7 @@ def user_bids_root(request):
                 'name': round_obj.name,
                 'status': round_obj.status,
             },
-            'bid_count': bids.count(),
+            'bid_count': len(bids),
             'max_bids': MAX_BIDS_PER_USER,
             'bids': bids_data
         }, status=status.HTTP_200_OK)
@@ -545,21 +479,14 @@ def user_bids_root(request):
         # 获取竞标轮次（支持 CompetitionPhase ID 或 BiddingRound ID）
         bid_type = 'song' if song else 'chart'
         
+        round_obj = None
         if round_id:
             # 先尝试作为 CompetitionPhase ID
-            try:
-                phase_key_filter = 'bidding' if bid_type == 'song' else 'second_bidding'
-                phase = CompetitionPhase.objects.get(id=round_id, phase_key__icontains=phase_key_filter)
+            phase = PhaseService.get_phase(round_id, bidding_type=bid_type)
+            if phase is not None:
                 # 通过外键查找对应类型的竞标轮次
                 round_obj = phase.bidding_rounds.filter(bidding_type=bid_type).first()
-                if not round_obj:
-                    round_obj = BiddingRound.objects.create(
-                        competition_phase=phase,
-                        bidding_type=bid_type,
-                        name=phase.name,
-                        status='active'
-                    )
-            except CompetitionPhase.DoesNotExist:
+            else:
                 # 尝试作为 BiddingRound ID
                 try:
                     round_obj = BiddingRound.objects.get(id=round_id)
@@ -576,29 +503,16 @@ def user_bids_root(request):
                     }, status=status.HTTP_404_NOT_FOUND)
         else:
             # 获取当前活跃的竞标阶段
-            now = timezone.now()
-            phase_key_filter = 'bidding' if bid_type == 'song' else 'second_bidding'
-            active_phase = CompetitionPhase.objects.filter(
-                phase_key__icontains=phase_key_filter,
-                is_active=True,
-                start_time__lte=now,
-                end_time__gte=now
-            ).first()
+            active_phase = PhaseService.get_current_bidding_phase(bid_type)
             
             if active_phase:
                 round_obj = active_phase.bidding_rounds.filter(bidding_type=bid_type).first()
-                if not round_obj:
-                    round_obj = BiddingRound.objects.create(
-                        competition_phase=active_phase,
-                        bidding_type=bid_type,
-                        name=active_phase.name,
-                        status='active'
-                    )
-            else:
-                return Response({
-                    'success': False,
-                    'message': '当前没有活跃的竞标轮次'
-                }, status=status.HTTP_404_NOT_FOUND)
+        
+        if not round_obj:
+            return Response({
+                'success': False,
+                'message': '当前没有活跃的竞标轮次'
+            }, status=status.HTTP_404_NOT_FOUND)
         
         try:
             amount = int(amount)
@@ -642,6 +556,8 @@ def target_bids_list(request):
     GET /api/bids/target/?song_id=1&round_id=5
     GET /api/bids/target/?chart_id=2&round_id=5
     """
+    from .phase_service import PhaseService
+    
     song_id = request.query_params.get('song_id')
     chart_id = request.query_params.get('chart_id')
     round_id = request.query_params.get('round_id')
@@ -664,25 +580,16 @@ def target_bids_list(request):
             round_obj = BiddingRound.objects.get(id=round_id)
         except BiddingRound.DoesNotExist:
             # 尝试通过 Phase ID 获取
-            try:
-                phase = CompetitionPhase.objects.get(id=round_id)
-                # 能够查询歌曲，说明是 song 类型；反之亦然
-                b_type = 'song' if song_id else 'chart'
-                round_obj = phase.bidding_rounds.filter(bidding_type=b_type).first()
-            except CompetitionPhase.DoesNotExist:
+            phase = PhaseService.get_phase(round_id)
+            if phase is None:
                 return Response({'success': False, 'message': '轮次不存在'}, status=status.HTTP_404_NOT_FOUND)
+            # 能够查询歌曲，说明是 song 类型；反之亦然
+            b_type = 'song' if song_id else 'chart'
+            round_obj = phase.bidding_rounds.filter(bidding_type=b_type).first()
     else:
         # 未指定轮次，查找当前活跃轮次
-        now = timezone.now()
         b_type = 'song' if song_id else 'chart'
-        phase_key_filter = 'bidding' if b_type == 'song' else 'second_bidding'
-        
-        active_phase = CompetitionPhase.objects.filter(
-            phase_key__icontains=phase_key_filter,
-            is_active=True,
-            start_time__lte=now,
-            end_time__gte=now
-        ).first()
+        active_phase = PhaseService.get_current_bidding_phase(b_type)
 
         if active_phase:
             round_obj = active_phase.bidding_rounds.filter(bidding_type=b_type).first()
@@ -717,11 +624,14 @@ def target_bids_list(request):
         bids_qs = bids_qs.filter(chart_id=chart_id)
 
     # 排序：金额降序，时间升序（先出价的排前面）
-    bids_qs = bids_qs.order_by('-amount', 'created_at').select_related('user')
+    # 只读取需要的列：匿名代号已在竞标保存时生成，不加载用户对象
+    bids_qs = bids_qs.order_by('-amount', 'created_at').values(
+        'id', 'user_id', 'bidder_alias', 'amount', 'created_at', 'is_dropped'
+    )
 
     # 5. 手动序列化 (比用 Serializer 更灵活，且只需返回前端需要的字段)
     results = []
-    current_user = request.user
+    current_user_id = request.user.id
     #若不许访问在这返回dummy data
     if not round_obj.allow_public_view and not request.user.is_staff:
         results.append({
@@ -734,18 +644,17 @@ def target_bids_list(request):
                 'is_dropped': False
             })
     else:
+        from .models import make_bidder_alias
+        
         for bid in bids_qs:
-            raw_username = bid.user.username
-            hash_obj = hashlib.md5(raw_username.encode('utf-8'))
-            anonymous_name = hash_obj.hexdigest()[:6].upper()
             results.append({
-                'id': bid.id,
-                'amount': bid.amount,
-                'username': anonymous_name,  # 显示匿名用户名
-                # 'user_id': bid.user.id,       # 如果需要点击跳转用户主页
-                'created_at': bid.created_at,
-                'is_self': bid.user == current_user,  # 关键字段：是否是当前用户
-                'is_dropped': bid.is_dropped
+                'id': bid['id'],
+                'amount': bid['amount'],
+                # 显示匿名代号（尚未回填代号的旧竞标现场生成）
+                'username': bid['bidder_alias'] or make_bidder_alias(round_obj.id, bid['user_id']),
+                'created_at': bid['created_at'],
+                'is_self': bid['user_id'] == current_user_id,  # 关键字段：是否是当前用户
+                'is_dropped': bid['is_dropped']
             })
 
     return Response({
@@ -765,6 +674,66 @@ def target_bids_list(request):
     }, status=status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def bid_market(request):
+    """
+    竞标行情总览：某轮次所有目标的出价人数、最高/最低/中位出价，以及当前用户自己的出价
+    GET /api/bids/market/?round_id=5
+    GET /api/bids/market/?bidding_type=chart
+    
+    参数:
+    - round_id: 竞标轮次ID或阶段ID（可选，默认当前活跃的竞标轮次）
+    - bidding_type: 未指定 round_id 时查找的竞标类型（song / chart，默认 song）
+    
+    汇总数据来自按轮次缓存的行情快照；轮次关闭公开查看时，普通用户只能看到自己的出价。
+    """
+    from .phase_service import PhaseService
+    from .market_service import BidMarketService
+    
+    round_id = request.query_params.get('round_id')
+    b_type = request.query_params.get('bidding_type', 'song')
+    if b_type not in ('song', 'chart'):
+        return Response({'success': False, 'message': 'bidding_type 必须是 song 或 chart'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    round_obj = None
+    if round_id:
+        # 优先尝试直接获取 BiddingRound，再尝试通过 Phase ID 获取
+        round_obj = BiddingRound.objects.filter(id=round_id).first() if str(round_id).isdigit() else None
+        if round_obj is None:
+            phase = PhaseService.get_phase(round_id)
+            if phase is None:
+                return Response({'success': False, 'message': '轮次不存在'}, status=status.HTTP_404_NOT_FOUND)
+            round_obj = phase.bidding_rounds.filter(bidding_type=b_type).first()
+    else:
+        active_phase = PhaseService.get_current_bidding_phase(b_type)
+        if active_phase:
+            round_obj = active_phase.bidding_rounds.filter(bidding_type=b_type).first()
+    
+    if not round_obj:
+        return Response({
+            'success': True,
+            'message': '当前没有活跃的竞标轮次',
+            'results': []
+        }, status=status.HTTP_200_OK)
+    
+    can_view = round_obj.allow_public_view or request.user.is_staff
+    results = BidMarketService.get_market(round_obj, request.user, can_view=can_view)
+    
+    return Response({
+        'success': True,
+        'round': {
+            'id': round_obj.id,
+            'name': round_obj.name,
+            'status': round_obj.status,
+            'bidding_type': round_obj.bidding_type,
+        },
+        'visible': can_view,
+        'count': len(results),
+        'results': results
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def delete_bid_view(request, bid_id):
@@ -815,7 +784,9 @@ def allocate_bids_view(request):
     执行竞标分配（Admin only）
     POST /api/bids/allocate/
     
-    参数: round_id（可选，不提供则分配最新的活跃轮次）
+    参数:
+        round_id（可选，不提供则分配最新的活跃轮次）
+        preview（可选，为 true 时只返回预览结果，不写入数据库）
     
     算法：
     1. 按竞标金额从高到低排序
@@ -850,6 +821,20 @@ def allocate_bids_view(request):
                     'message': '当前没有活跃的竞标轮次'
                 }, status=status.HTTP_404_NOT_FOUND)
         
+        preview = str(request.data.get('preview', '')).lower() in ('1', 'true', 'yes')
+        if preview:
+            result = BiddingService.preview_allocation(round_obj.id, priority_self=True)
+            return Response({
+                'success': True,
+                'message': '竞标分配预览（未写入数据库）',
+                'round': {
+                    'id': round_obj.id,
+                    'name': round_obj.name,
+                    'status': round_obj.status,
+                },
+                'statistics': result
+            }, status=status.HTTP_200_OK)
+        
         result = BiddingService.allocate_bids(round_obj.id, priority_self=True)
         
         return Response({
@@ -878,6 +863,7 @@ def get_available_charts_for_round(request, round_id):
     GET /api/bidding-rounds/{round_id}/available-charts/
     
     仅对谱面类型的竞标轮次有效，返回所有 status='part_submitted' 的谱面
+    分页参数同 /api/charts/（cursor 游标分页，或 page / page_size 页码分页）
     """
     try:
         round_obj = BiddingRound.objects.get(id=round_id)
@@ -896,19 +882,22 @@ def get_available_charts_for_round(request, round_id):
     
     from .models import Chart
     from .serializers import ChartSerializer
+    from .pagination import KeysetPagination
     
     # 获取所有半成品谱面
-    charts = Chart.objects.filter(
-        status='part_submitted'
-    ).select_related('song', 'user').order_by('-created_at')
+    charts = Chart.objects.filter(status='part_submitted')
     
-    page = int(request.query_params.get('page', 1))
-    page_size = int(request.query_params.get('page_size', 20))
-    start = (page - 1) * page_size
-    end = start + page_size
-    
-    total_count = charts.count()
-    charts_page = charts[start:end]
+    try:
+        charts_page, meta = KeysetPagination.paginate(
+            request, ChartSerializer.setup_eager_loading(charts), ['-created_at', 'id'],
+            lambda: KeysetPagination.cached_count(charts, 'available_charts:count'),
+            default_page_size=20,
+        )
+    except ValidationError as e:
+        return Response({
+            'success': False,
+            'message': str(e.message) if hasattr(e, 'message') else str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     serializer = ChartSerializer(charts_page, many=True, context={'request': request})
     
@@ -919,10 +908,7 @@ def get_available_charts_for_round(request, round_id):
             'name': round_obj.name,
             'bidding_type': round_obj.bidding_type,
         },
-        'count': total_count,
-        'page': page,
-        'page_size': page_size,
-        'total_pages': (total_count + page_size - 1) // page_size,
+        **meta,
         'results': serializer.data
     }, status=status.HTTP_200_OK)
 
@@ -1104,28 +1090,33 @@ def charts_root(request):
     """
     谱面列表
     GET /api/charts/
+    
+    分页参数：
+    - cursor: 游标分页（首页传空值，之后传上一页的 next_cursor），include_count=1 时返回总数
+    - page / page_size: 页码分页（兼容旧接口）
     """
     from .models import Chart
     from .serializers import ChartSerializer
+    from .pagination import KeysetPagination
+    from .status_service import CompetitionStatusService
 
-    charts = Chart.objects.select_related('song', 'user').order_by('-created_at')
-
-    page = int(request.query_params.get('page', 1))
-    page_size = int(request.query_params.get('page_size', 10))
-    start = (page - 1) * page_size
-    end = start + page_size
-
-    total_count = charts.count()
-    charts_page = charts[start:end]
+    # 总数使用信号维护的缓存计数器
+    try:
+        charts_page, meta = KeysetPagination.paginate(
+            request, ChartSerializer.setup_eager_loading(Chart.objects.all()), ['-created_at', 'id'],
+            lambda: CompetitionStatusService.get_counters()['charts'],
+        )
+    except ValidationError as e:
+        return Response({
+            'success': False,
+            'message': str(e.message) if hasattr(e, 'message') else str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
 
     serializer = ChartSerializer(charts_page, many=True, context={'request': request})
 
     return Response({
         'success': True,
-        'count': total_count,
-        'page': page,
-        'page_size': page_size,
-        'total_pages': (total_count + page_size - 1) // page_size,
+        **meta,
         'results': serializer.data
     }, status=status.HTTP_200_OK)
 
@@ -1146,6 +1137,7 @@ def submit_chart(request, result_id):
     
     用户通过竞标获得了歌曲后，可以提交谱面
     """
+    from django.db import transaction
     from .models import BidResult, Chart
     from .serializers import ChartCreateSerializer, ChartSerializer
     
@@ -1217,81 +1209,47 @@ def submit_chart(request, result_id):
         target_status = 'part_submitted'
         status_msg = '半成品'
     
-    # 创建新谱面（已在上方检查过不存在）
-    if bid_result.bid_type == 'song':
-        # 第一阶段：创建半成品谱面（第一部分）
-        chart = Chart.objects.create(
-            bidding_round=bid_result.bidding_round,
-            user=user,
-            song=song_target,
-            bid_result=bid_result,
-            status=target_status,
-            designer=designer,
-            audio_file=new_audio,
-            cover_image=new_cover,
-            background_video=new_video,
-            chart_file=new_file,
-            submitted_at=timezone.now(),
-            is_part_one=True
-        )
-    else:
-        # 第二阶段：创建续写谱面（第二部分），指向第一部分谱面
-        base_chart = bid_result.chart
-        chart = Chart.objects.create(
-            bidding_round=bid_result.bidding_round,
-            user=user,
-            song=song_target,
-            status=target_status,
-            designer=designer,
-            audio_file=new_audio,
-            cover_image=new_cover,
-            background_video=new_video,
-            chart_file=new_file,
-            submitted_at=timezone.now(),
-            is_part_one=False,
-            part_one_chart=base_chart,
-            completion_bid_result=bid_result
-        )
+    # 创建新谱面（已在上方检查过不存在），与 Majdata.net 转发记录在同一事务中写入
+    with transaction.atomic():
+        if bid_result.bid_type == 'song':
+            # 第一阶段：创建半成品谱面（第一部分）
+            chart = Chart.objects.create(
+                bidding_round=bid_result.bidding_round,
+                user=user,
+                song=song_target,
+                bid_result=bid_result,
+                status=target_status,
+                designer=designer,
+                audio_file=new_audio,
+                cover_image=new_cover,
+                background_video=new_video,
+                chart_file=new_file,
+                submitted_at=timezone.now(),
+                is_part_one=True
+            )
+        else:
+            # 第二阶段：创建续写谱面（第二部分），指向第一部分谱面
+            base_chart = bid_result.chart
+            chart = Chart.objects.create(
+                bidding_round=bid_result.bidding_round,
+                user=user,
+                song=song_target,
+                status=target_status,
+                designer=designer,
+                audio_file=new_audio,
+                cover_image=new_cover,
+                background_video=new_video,
+                chart_file=new_file,
+                submitted_at=timezone.now(),
+                is_part_one=False,
+                part_one_chart=base_chart,
+                completion_bid_result=bid_result
+            )
 
-    if  ENABLE_CHART_FORWARD_TO_MAJDATA:
-        # 上传谱面到 Majdata.net
-        from .majdata_service import MajdataService
-        
-        try:
-            # 准备上传数据
-            maidata_content = ''
-            if chart.chart_file:
-                chart.chart_file.seek(0)
-                maidata_content = chart.chart_file.read()
-                if isinstance(maidata_content, bytes):
-                    maidata_content = maidata_content.decode('utf-8')
-            
-            upload_data = {
-                'maidata_content': maidata_content,
-                'audio_file': chart.song.audio_file if chart.song else None,
-                'cover_file': chart.cover_image if chart.cover_image else (chart.song.cover_image if hasattr(chart.song, 'cover_image') else None),
-                'video_file': chart.background_video if chart.background_video else None,
-                'is_part_chart': (chart.status == 'part_submitted'),
-                'folder_name': f"{chart.song.title}_{chart.user.username}" if chart.song else f"Chart_{chart.id}"
-            }
-            
-            upload_result = MajdataService.upload_chart(upload_data)
-            
-            if upload_result:
-                # 保存 Majdata.net 返回的 URL（如果有）
-                if isinstance(upload_result, dict):
-                    external_url = upload_result.get('url') or upload_result.get('chart_url') or upload_result.get('message', '')
-                    # 可以保存到 chart 对象的某个字段（需要在模型中添加）
-                    # chart.majdata_url = external_url
-                    # chart.save()
-                    logger.info(f"✅ 谱面已上传到 Majdata.net: {external_url}")
-            else:
-                logger.warning(f"⚠️ 谱面上传到 Majdata.net 失败，但本地保存成功")
-        
-        except Exception as e:
-            logger.error(f"上传到 Majdata.net 时发生错误: {e}")
-            # 不影响本地保存，继续返回成功
-    
+        if settings.ENABLE_CHART_FORWARD_TO_MAJDATA:
+            # 由 run_majdata_worker 在后台上传到 Majdata.net（失败自动重试），不阻塞本次请求
+            from .majdata_outbox import MajdataOutboxService
+            MajdataOutboxService.enqueue(chart)
     
     result_serializer = ChartSerializer(chart, context={'request': request})
     return Response({
@@ -1307,44 +1265,12 @@ def download_chart_bundle(request, chart_id):
     """
     服务器端打包并下载谱面资源（音频、封面、视频、maidata.txt）。
     GET /api/songs/charts/{chart_id}/bundle/
+    
+    首次下载时打包并缓存（见 BundleCache），之后直接返回缓存文件，支持 ETag 和 Range。
     """
-    chart = get_object_or_404(Chart.objects.select_related('song', 'user'), id=chart_id)
-
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-        # 谱面文件
-        if chart.chart_file and chart.chart_file.storage.exists(chart.chart_file.name):
-            with chart.chart_file.open('rb') as f:
-                zf.writestr('maidata.txt', f.read())
-
-        # 音频
-        if chart.audio_file and chart.audio_file.storage.exists(chart.audio_file.name):
-            audio_ext = os.path.splitext(chart.audio_file.name)[1].lower() or '.mp3'
-            with chart.audio_file.open('rb') as f:
-                zf.writestr(f'track{audio_ext}', f.read())
-
-        # 封面
-        if chart.cover_image and chart.cover_image.storage.exists(chart.cover_image.name):
-            cover_ext = os.path.splitext(chart.cover_image.name)[1].lower() or '.jpg'
-            with chart.cover_image.open('rb') as f:
-                zf.writestr(f'bg{cover_ext}', f.read())
-
-        # 视频（可选）
-        if chart.background_video and chart.background_video.storage.exists(chart.background_video.name):
-            # 文件名包含 bg/pv 时按名称命名，否则默认 bg.mp4
-            basename = os.path.basename(chart.background_video.name).lower()
-            target_name = 'bg.mp4'
-            if basename.startswith('pv') or 'pv.' in basename:
-                target_name = 'pv.mp4'
-            elif basename.endswith('.mp4'):
-                target_name = 'bg.mp4'
-            else:
-                # 保留原扩展名
-                target_name = 'bg' + os.path.splitext(basename)[1].lower()
-            with chart.background_video.open('rb') as f:
-                zf.writestr(target_name, f.read())
+    from .bundle_cache import BundleCache
 
-    buffer.seek(0)
+    chart = get_object_or_404(Chart.objects.select_related('song', 'user'), id=chart_id)
 
     # 安全文件名
     def sanitize_filename(name: str) -> str:
@@ -1352,12 +1278,7 @@ def download_chart_bundle(request, chart_id):
             .replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_').strip() or 'chart'
 
     filename = f"{sanitize_filename(chart.song.title)}_chart.zip"
-    response = HttpResponse(buffer.getvalue(), content_type='application/zip')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    # 提供范围与长度信息（有助于某些下载器）
-    response['Accept-Ranges'] = 'bytes'
-    response['Content-Length'] = str(len(buffer.getvalue()))
-    return response
+    return BundleCache.serve(request, chart, filename)
 
 
 @api_view(['GET'])
@@ -1380,13 +1301,13 @@ def get_user_charts(request):
     if bidding_round_id:
         charts = charts.filter(bidding_round_id=bidding_round_id)
     
-    charts = charts.select_related('song', 'bidding_round').order_by('-created_at')
+    charts = list(ChartSerializer.setup_eager_loading(charts).order_by('-created_at'))
     
     serializer = ChartSerializer(charts, many=True, context={'request': request})
     
     return Response({
         'success': True,
-        'count': charts.count(),
+        'count': len(charts),
         'charts': serializer.data
     }, status=status.HTTP_200_OK)
 
@@ -1400,6 +1321,8 @@ def allocate_peer_reviews(request, round_id):
     
     参数:
     - reviews_per_user: 每个用户的评分任务数（默认8）
+    - mode: 分配模式，flow（默认，存在平衡分配时一定成功）或 greedy
+    - seed: 随机种子（可选，用于复现分配结果）
     """
     from .bidding_service import PeerReviewService
     
@@ -1411,9 +1334,11 @@ def allocate_peer_reviews(request, round_id):
     #     }, status=status.HTTP_403_FORBIDDEN)
     
     reviews_per_user = int(request.data.get('reviews_per_user', 8))
+    mode = request.data.get('mode', 'flow')
+    seed = request.data.get('seed')
     
     try:
-        result = PeerReviewService.allocate_peer_reviews(round_id, reviews_per_user)
+        result = PeerReviewService.allocate_peer_reviews(round_id, reviews_per_user, mode=mode, seed=seed)
         return Response({
             'success': True,
             'message': '互评任务分配成功',
@@ -1431,6 +1356,52 @@ def allocate_peer_reviews(request, round_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def rebalance_peer_reviews(request, round_id):
+    """
+    增量调整互评任务（管理员操作）
+    POST /api/peer-reviews/rebalance/{round_id}/
+    
+    只移动受影响的待完成任务，已完成的评分保持不变，可在互评进行中执行。
+    
+    参数（至少提供一个）:
+    - reviewer_id: 退出的评分者用户ID，其待完成任务转给其他评分者
+    - chart_id: 迟到的谱面ID，为其补充评分者
+    """
+    from .bidding_service import PeerReviewService
+    
+    if not request.user.is_staff:
+        return Response({
+            'success': False,
+            'message': '只有管理员可以调整互评任务'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        reviewer_id = request.data.get('reviewer_id')
+        chart_id = request.data.get('chart_id')
+        reviewer_id = int(reviewer_id) if reviewer_id not in (None, '') else None
+        chart_id = int(chart_id) if chart_id not in (None, '') else None
+    except (TypeError, ValueError):
+        return Response({
+            'success': False,
+            'message': 'reviewer_id 和 chart_id 必须是整数'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        result = PeerReviewService.rebalance_peer_reviews(round_id, reviewer_id=reviewer_id, chart_id=chart_id)
+        return Response({
+            'success': True,
+            'message': '互评任务调整成功',
+            'rebalance': result
+        }, status=status.HTTP_200_OK)
+    except ValidationError as e:
+        return Response({
+            'success': False,
+            'message': str(e.message) if hasattr(e, 'message') else str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_peer_review_tasks(request):
@@ -1492,7 +1463,7 @@ def submit_peer_review(request, allocation_id):
     allocation = get_object_or_404(PeerReviewAllocation, id=allocation_id, reviewer=user)
     
     try:
-        review = PeerReviewService.submit_peer_review(allocation_id, score, comment)
+        review = PeerReviewService.submit_peer_review(allocation_id, score, comment, reviewer=user)
         serializer = PeerReviewSerializer(review)
         return Response({
             'success': True,
@@ -1521,9 +1492,14 @@ def get_chart_reviews(request, chart_id):
     from .models import Chart
     from .serializers import ChartDetailSerializer
     
-    chart = get_object_or_404(Chart, id=chart_id)
+    chart = get_object_or_404(ChartDetailSerializer.setup_eager_loading(Chart.objects.all()), id=chart_id)
     
     serializer = ChartDetailSerializer(chart, context={'request': request})
+    
+    return Response({
+        'success': True,
+        'chart': serializer.data
+    }, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
@@ -1635,43 +1611,75 @@ def get_round_rankings(request, round_id):
     """
     获取某轮次的最终排名（基于平均分）
     GET /api/rankings/{round_id}/
+    
+    只读取排名物化表 RoundRanking（互评写入后增量刷新），不查询谱面表。
+    平均分、总分都相同的谱面并列：rank 为竞赛排名（1, 2, 2, 4），dense_rank 为密集排名（1, 2, 2, 3）。
+    
+    参数（都不提供时返回完整排名，与旧版一致）:
+    - limit: 每页数量（分页时默认100，最大500）
+    - cursor: 上一页返回的 next_cursor（可选）
+    
+    响应带 ETag 和 Cache-Control，排名未变化时对 If-None-Match 返回 304。
     """
-    from .models import Chart
+    from django.db.models import Count, Max, Q
+    from .models import RoundRanking
     
-    try:
-        bidding_round = BiddingRound.objects.get(id=round_id)
-    except BiddingRound.DoesNotExist:
+    bidding_round = BiddingRound.objects.filter(id=round_id).values('id', 'name').first()
+    if bidding_round is None:
         return Response({
             'success': False,
             'message': '竞标轮次不存在'
         }, status=status.HTTP_404_NOT_FOUND)
     
-    # 获取该轮所有已评分的谱面，按平均分排序
-    charts = Chart.objects.filter(
-        bidding_round=bidding_round,
-        status__in=['reviewed']
-    ).select_related('user', 'song').order_by('-average_score', '-total_score')
-    
-    rankings = []
-    for idx, chart in enumerate(charts, 1):
-        rankings.append({
-            'rank': idx,
-            'username': chart.user.username,
-            'song_title': chart.song.title,
-            'average_score': chart.average_score,
-            'review_count': chart.review_count,
-            'total_score': chart.total_score,
-        })
+    cursor = request.query_params.get('cursor', '')
+    # 只有请求分页时才分页，否则返回完整排名
+    limit = None
+    if cursor or 'limit' in request.query_params:
+        try:
+            limit = min(max(int(request.query_params.get('limit', 100)), 1), 500)
+        except (TypeError, ValueError):
+            limit = 100
     
-    return Response({
-        'success': True,
-        'round': {
-            'id': bidding_round.id,
-            'name': bidding_round.name,
-        },
-        'total': len(rankings),
-        'rankings': rankings
-    }, status=status.HTTP_200_OK)
+    rankings = RoundRanking.objects.filter(bidding_round_id=round_id)
+    
+    # 排名行数 + 最近刷新时间 决定 ETag
+    summary = rankings.aggregate(total=Count('id'), last_updated=Max('updated_at'))
+    last_updated = summary['last_updated'].timestamp() if summary['last_updated'] else 0
+    etag = f"{round_id}-{summary['total']}-{last_updated}-{cursor}-{limit}"
+    
+    # 游标：上一页最后一行的 (rank, chart_id)
+    if cursor:
+        try:
+            cursor_rank, cursor_chart_id = (int(part) for part in cursor.split('-'))
+        except ValueError:
+            return Response({
+                'success': False,
+                'message': '无效的游标'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        rankings = rankings.filter(
+            Q(rank__gt=cursor_rank) | Q(rank=cursor_rank, chart_id__gt=cursor_chart_id)
+        )
+    
+    def build_response():
+        rows = rankings.order_by('rank', 'chart_id').values(
+            'rank', 'dense_rank', 'chart_id', 'username', 'song_title',
+            'average_score', 'review_count', 'total_score'
+        )
+        rows = list(rows if limit is None else rows[:limit + 1])
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1]['rank']}-{rows[-1]['chart_id']}"
+        
+        return Response({
+            'success': True,
+            'round': bidding_round,
+            'total': summary['total'],
+            'rankings': rows,
+            'next_cursor': next_cursor
+        }, status=status.HTTP_200_OK)
+    
+    return _conditional_response(request, etag, settings.RANKINGS_CACHE_MAX_AGE, build_response)
 
 # ==================== 第二轮竞标API端点 ====================
 
@@ -0,0 +1,149 @@
+"""
+流式 ZIP 打包
+边读文件边输出 ZIP 数据，每个下载只占用一个读块大小的内存；
+总大小在输出前即可算出，用于 Content-Length
+"""
+
+import struct
+import zlib
+
+# 每次从文件读取的块大小
+CHUNK_SIZE = 64 * 1024
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# 文件名使用 UTF-8 编码（通用标志位第 11 位）
+UTF8_FLAG = 0x0800
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<IHHHHIIH')
+
+
+class ZipEntry:
+    """ZIP 中的一个文件（数据来源为内存字节串或存储中的文件）"""
+
+    def __init__(self, name, method, crc, compressed_size, size, data=None, field_file=None):
+        self.name = name.encode('utf-8')
+        self.method = method
+        self.crc = crc
+        self.compressed_size = compressed_size
+        self.size = size
+        self.data = data
+        self.field_file = field_file
+        self.offset = 0
+
+    def iter_data(self):
+        """输出文件内容（存储中的文件按块读取）"""
+        if self.data is not None:
+            yield self.data
+            return
+        with self.field_file.storage.open(self.field_file.name, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+
+class ZipStream:
+    """
+    流式 ZIP 写入器
+
+    - add_bytes: 小文件（如 maidata.txt），在内存中压缩（ZIP_DEFLATED）
+    - add_file: 存储中的媒体文件（mp3/jpg/mp4 本身已压缩），原样存储（ZIP_STORED），
+      添加时按块计算 CRC32，输出时再按块读取
+
+    不使用 ZIP64，单个包需小于 4GB。
+
+    用法：
+        stream = ZipStream(chart.created_at)
+        stream.add_bytes('maidata.txt', content)
+        stream.add_file('track.mp3', chart.audio_file)
+        response = StreamingHttpResponse(stream, content_type='application/zip')
+        response['Content-Length'] = str(stream.size)
+    """
+
+    def __init__(self, date_time):
+        """
+        Args:
+            date_time: 写入所有条目的修改时间（datetime）
+        """
+        self.entries = []
+        self.dos_time = (date_time.hour << 11) | (date_time.minute << 5) | (date_time.second // 2)
+        self.dos_date = ((max(date_time.year, 1980) - 1980) << 9) | (date_time.month << 5) | date_time.day
+
+    def add_bytes(self, name, data, compress=True):
+        """
+        添加内存中的文件
+
+        Args:
+            name: ZIP 内的文件名
+            data: 文件内容（bytes）
+            compress: 是否使用 ZIP_DEFLATED 压缩
+        """
+        crc = zlib.crc32(data)
+        size = len(data)
+        if compress:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            data = compressor.compress(data) + compressor.flush()
+        method = ZIP_DEFLATED if compress else ZIP_STORED
+        self.entries.append(ZipEntry(name, method, crc, len(data), size, data=data))
+
+    def add_file(self, name, field_file):
+        """
+        添加存储中的文件（原样存储，不压缩）
+
+        Args:
+            name: ZIP 内的文件名
+            field_file: FileField 的文件对象（chart.audio_file 等）
+        """
+        crc = 0
+        size = 0
+        with field_file.storage.open(field_file.name, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        self.entries.append(ZipEntry(name, ZIP_STORED, crc, size, size, field_file=field_file))
+
+    @property
+    def size(self):
+        """完整 ZIP 的字节数"""
+        total = END_OF_CENTRAL_DIRECTORY.size
+        for entry in self.entries:
+            total += LOCAL_HEADER.size + CENTRAL_HEADER.size + 2 * len(entry.name) + entry.compressed_size
+        return total
+
+    def _local_header(self, entry):
+        return LOCAL_HEADER.pack(
+            0x04034b50, 20, UTF8_FLAG, entry.method, self.dos_time, self.dos_date,
+            entry.crc, entry.compressed_size, entry.size, len(entry.name), 0
+        ) + entry.name
+
+    def _central_header(self, entry):
+        return CENTRAL_HEADER.pack(
+            0x02014b50, 20, 20, UTF8_FLAG, entry.method, self.dos_time, self.dos_date,
+            entry.crc, entry.compressed_size, entry.size, len(entry.name), 0, 0, 0, 0,
+            0o100644 << 16, entry.offset
+        ) + entry.name
+
+    def __iter__(self):
+        """按顺序输出 ZIP 数据"""
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            header = self._local_header(entry)
+            yield header
+            yield from entry.iter_data()
+            offset += len(header) + entry.compressed_size
+
+        central_directory = b''.join(self._central_header(entry) for entry in self.entries)
+        yield central_directory
+        yield END_OF_CENTRAL_DIRECTORY.pack(
+            0x06054b50, 0, 0, len(self.entries), len(self.entries),
+            len(central_directory), offset, 0
+        )
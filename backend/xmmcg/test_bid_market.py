@@ -0,0 +1,191 @@
+"""
+竞标行情总览测试脚本
+验证 /api/songs/bids/market/ 一次返回所有目标的竞标深度
+
+测试场景：
+1. 每个目标的出价人数、最高/最低/中位出价与逐个统计一致，没有竞标的目标人数为 0，并返回自己的出价
+2. 快照缓存后请求的查询数与目标数量无关
+3. 新增竞标后快照失效，返回最新数据
+4. 轮次关闭公开查看时，普通用户看不到汇总数据（只看到自己的出价），管理员可以看到
+
+使用方法：
+    python test_bid_market.py
+
+注意：脚本会创建以 markettest_ 开头的用户、歌曲和轮次，结束后自动清除。
+"""
+
+import os
+import sys
+from statistics import median
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from songs.models import Song, BiddingRound, Bid
+
+USER_PREFIX = 'markettest_'
+ROUND_PREFIX = '测试竞标行情轮次'
+MARKET_URL = '/api/songs/bids/market/'
+BIDDER_COUNT = 6
+SONG_COUNT = 5
+
+
+def clear_test_data():
+    """清除之前的测试数据"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    # 占位歌曲没有真实文件，直接用 QuerySet 删除
+    Song.objects.filter(user__in=test_users).delete()
+    test_users.delete()
+
+
+def create_test_data():
+    """
+    创建歌曲竞标轮次：前 SONG_COUNT - 1 首歌曲有不同数量的出价，最后一首没有竞标
+
+    Returns:
+        tuple: (轮次, 竞标者列表, 歌曲列表)
+    """
+    bidding_round = BiddingRound.objects.create(name=ROUND_PREFIX, bidding_type='song', status='active')
+    owner = User.objects.create(username=f'{USER_PREFIX}owner')
+    songs = [
+        Song.objects.create(
+            user=owner,
+            title=f'行情测试歌曲 {i}',
+            audio_file=f'songs/markettest_{i}.mp3',
+            audio_hash=f'markettest_hash_{i}',
+            file_size=0,
+        )
+        for i in range(SONG_COUNT)
+    ]
+    bidders = [User.objects.create(username=f'{USER_PREFIX}{i}') for i in range(BIDDER_COUNT)]
+    Bid.objects.bulk_create([
+        Bid(bidding_round=bidding_round, user=bidder, bid_type='song', song=song, amount=10 * (i + 1) + j)
+        for j, song in enumerate(songs[:-1])
+        for i, bidder in enumerate(bidders[:j + 2])
+    ])
+    return bidding_round, bidders, songs
+
+
+def expected_depth(bidding_round, song):
+    """逐个统计某首歌曲的竞标深度"""
+    amounts = sorted(Bid.objects.filter(
+        bidding_round=bidding_round, song=song, is_dropped=False
+    ).values_list('amount', flat=True))
+    if not amounts:
+        return {'bid_count': 0, 'max_amount': None, 'min_amount': None, 'median_amount': None}
+    return {
+        'bid_count': len(amounts),
+        'max_amount': amounts[-1],
+        'min_amount': amounts[0],
+        'median_amount': median(amounts),
+    }
+
+
+def market_by_target(data):
+    """行情列表 -> {目标ID: 行}"""
+    return {row['target_id']: row for row in data['results']}
+
+
+def test_depth(client, bidding_round, bidders, songs):
+    """场景1：竞标深度与逐个统计一致"""
+    print("\n场景1：竞标深度")
+    client.force_authenticate(bidders[0])
+    rows = market_by_target(client.get(MARKET_URL, {'round_id': bidding_round.id}).json())
+    passed = True
+    for song in songs:
+        row = rows.get(song.id)
+        expected = expected_depth(bidding_round, song)
+        my_bid = Bid.objects.filter(bidding_round=bidding_round, song=song, user=bidders[0]).first()
+        ok = (
+            row is not None
+            and all(row[key] == value for key, value in expected.items())
+            and (row['my_bid'] or {}).get('amount') == (my_bid.amount if my_bid else None)
+        )
+        passed &= ok
+        print(f"  {'✓' if ok else '✗'} {song.title}: {row}")
+    print("✓ 统计一致" if passed else "✗ 统计不一致")
+    return passed
+
+
+def test_query_count(client, bidding_round, bidders):
+    """场景2：缓存后的查询数"""
+    print("\n场景2：查询数")
+    client.force_authenticate(bidders[1])
+    client.get(MARKET_URL, {'round_id': bidding_round.id})
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get(MARKET_URL, {'round_id': bidding_round.id})
+    queries = len(ctx.captured_queries)
+    print(f"  {response.json()['count']} 个目标，{queries} 次查询")
+    passed = response.status_code == 200 and queries <= 2
+    print("✓ 查询数固定" if passed else "✗ 查询数过多")
+    return passed
+
+
+def test_invalidation(client, bidding_round, bidders, songs):
+    """场景3：新增竞标后快照失效"""
+    print("\n场景3：新增竞标后快照失效")
+    client.force_authenticate(bidders[0])
+    client.get(MARKET_URL, {'round_id': bidding_round.id})
+    Bid.objects.create(bidding_round=bidding_round, user=bidders[-1], bid_type='song', song=songs[-1], amount=99)
+    row = market_by_target(client.get(MARKET_URL, {'round_id': bidding_round.id}).json())[songs[-1].id]
+    print(f"  {songs[-1].title}: {row}")
+    passed = row['bid_count'] == 1 and row['max_amount'] == 99
+    print("✓ 返回最新数据" if passed else "✗ 仍返回旧快照")
+    return passed
+
+
+def test_public_view(client, bidding_round, bidders, songs):
+    """场景4：轮次关闭公开查看"""
+    print("\n场景4：关闭公开查看")
+    bidding_round.allow_public_view = False
+    bidding_round.save(update_fields=['allow_public_view'])
+
+    client.force_authenticate(bidders[0])
+    hidden = client.get(MARKET_URL, {'round_id': bidding_round.id}).json()
+    hidden_row = market_by_target(hidden)[songs[0].id]
+
+    staff = User.objects.create(username=f'{USER_PREFIX}staff', is_staff=True)
+    client.force_authenticate(staff)
+    visible_row = market_by_target(client.get(MARKET_URL, {'round_id': bidding_round.id}).json())[songs[0].id]
+    print(f"  普通用户: {hidden_row}")
+    print(f"  管理员: {visible_row}")
+    passed = (
+        hidden['visible'] is False
+        and hidden_row['bid_count'] is None
+        and hidden_row['my_bid'] is not None
+        and visible_row['bid_count'] == expected_depth(bidding_round, songs[0])['bid_count']
+    )
+    print("✓ 按权限隐藏" if passed else "✗ 权限处理错误")
+    return passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    client = APIClient()
+    try:
+        bidding_round, bidders, songs = create_test_data()
+        results = [
+            test_depth(client, bidding_round, bidders, songs),
+            test_query_count(client, bidding_round, bidders),
+            test_invalidation(client, bidding_round, bidders, songs),
+            test_public_view(client, bidding_round, bidders, songs),
+        ]
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+竞标列表查询数测试脚本
+验证 BidSerializer 的 status 由一次查询得到的中选结果映射解析，竞标列表的查询数与竞标数量无关
+
+测试场景：
+1. GET /api/songs/bids/ 在已完成轮次中，2 条竞标与 8 条竞标的查询数相同，状态正确（won / lost）
+2. 谱面竞标直接序列化时，查询数与竞标数量无关，且与逐条查询的结果一致
+
+使用方法：
+    python test_bid_status_queries.py
+
+注意：脚本会创建以 bidqtest_ 开头的用户、歌曲、谱面和阶段，结束后自动清除。
+"""
+
+import os
+import sys
+from datetime import timedelta
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from songs.models import Song, BiddingRound, Bid, BidResult, Chart, CompetitionPhase
+from songs.serializers import BidSerializer
+
+USER_PREFIX = 'bidqtest_'
+ROUND_PREFIX = '测试竞标查询轮次'
+
+
+def clear_test_data():
+    """清除之前的测试数据"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    # 占位歌曲/谱面没有真实文件，直接用 QuerySet 删除
+    Chart.objects.filter(user__in=test_users).delete()
+    Song.objects.filter(user__in=test_users).delete()
+    test_users.delete()
+    CompetitionPhase.objects.filter(phase_key__startswith=USER_PREFIX).delete()
+
+
+def create_song_round(label, bid_count):
+    """
+    创建一个已完成的歌曲竞标轮次，竞标者出价 bid_count 次，中选第一首
+
+    Returns:
+        tuple: (阶段, 竞标者, 中选歌曲ID)
+    """
+    now = timezone.now()
+    phase = CompetitionPhase.objects.create(
+        name=f'{ROUND_PREFIX}{label}',
+        phase_key=f'{USER_PREFIX}{label}_bidding',
+        description='竞标查询数测试',
+        start_time=now - timedelta(hours=2),
+        end_time=now - timedelta(hours=1),
+    )
+    bidding_round = BiddingRound.objects.create(
+        name=f'{ROUND_PREFIX}{label}', bidding_type='song', status='completed', competition_phase=phase
+    )
+    bidder = User.objects.create(username=f'{USER_PREFIX}{label}_bidder')
+    songs = []
+    for i in range(bid_count):
+        owner = User.objects.create(username=f'{USER_PREFIX}{label}_owner_{i}')
+        songs.append(Song.objects.create(
+            user=owner,
+            title=f'竞标查询测试歌曲 {label} {i}',
+            audio_file=f'songs/bidqtest_{label}_{i}.mp3',
+            audio_hash=f'bidqtest_hash_{label}_{i}',
+            file_size=0,
+        ))
+    Bid.objects.bulk_create([
+        Bid(bidding_round=bidding_round, user=bidder, bid_type='song', song=song, amount=10 + i)
+        for i, song in enumerate(songs)
+    ])
+    BidResult.objects.create(
+        bidding_round=bidding_round, user=bidder, bid_type='song', song=songs[0], bid_amount=10
+    )
+    return phase, bidder, songs[0].id
+
+
+def count_view_queries(client, phase, bidder):
+    """请求竞标列表，返回 (查询数, 响应数据)"""
+    client.force_authenticate(bidder)
+    # 预热阶段时间线缓存，只统计稳定状态下的查询
+    client.get('/api/songs/bids/', {'round_id': phase.id})
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get('/api/songs/bids/', {'round_id': phase.id})
+    return len(ctx.captured_queries), response.json()
+
+
+def test_view_query_count():
+    """场景1：竞标列表接口的查询数与竞标数量无关"""
+    print("\n场景1：GET /api/songs/bids/ 查询数")
+    client = APIClient()
+    small_phase, small_bidder, _ = create_song_round('small', 2)
+    large_phase, large_bidder, won_song_id = create_song_round('large', 8)
+
+    small_queries, _ = count_view_queries(client, small_phase, small_bidder)
+    large_queries, data = count_view_queries(client, large_phase, large_bidder)
+    statuses = {bid['song']['id']: bid['status'] for bid in data['bids']}
+    print(f"  2 条竞标: {small_queries} 次查询，8 条竞标: {large_queries} 次查询")
+    print(f"  状态: {sorted(statuses.values())}")
+
+    passed = (
+        small_queries == large_queries
+        and len(statuses) == 8
+        and statuses.pop(won_song_id) == 'won'
+        and set(statuses.values()) == {'lost'}
+    )
+    print("✓ 查询数恒定且状态正确" if passed else "✗ 查询数随竞标数量增长或状态错误")
+    return passed
+
+
+def test_chart_bids_serializer():
+    """场景2：谱面竞标序列化"""
+    print("\n场景2：谱面竞标序列化")
+    bidding_round = BiddingRound.objects.create(name=f'{ROUND_PREFIX}chart', bidding_type='chart', status='completed')
+    bidders = [User.objects.create(username=f'{USER_PREFIX}chart_bidder_{i}') for i in range(3)]
+    charts = []
+    for i in range(4):
+        owner = User.objects.create(username=f'{USER_PREFIX}chart_owner_{i}')
+        song = Song.objects.create(
+            user=owner,
+            title=f'竞标查询测试谱面歌曲 {i}',
+            audio_file=f'songs/bidqtest_chart_{i}.mp3',
+            audio_hash=f'bidqtest_chart_hash_{i}',
+            file_size=0,
+        )
+        charts.append(Chart.objects.create(bidding_round=bidding_round, user=owner, song=song, status='part_submitted'))
+    Bid.objects.bulk_create([
+        Bid(bidding_round=bidding_round, user=bidder, bid_type='chart', chart=chart, amount=10)
+        for bidder in bidders for chart in charts
+    ])
+    for bidder, chart in zip(bidders[:2], charts):
+        BidResult.objects.create(bidding_round=bidding_round, user=bidder, bid_type='chart', chart=chart, bid_amount=10)
+
+    def serialize(limit):
+        bids = list(
+            Bid.objects.filter(bidding_round=bidding_round)
+            .select_related('bidding_round', 'user', 'song__user', 'chart__song', 'chart__user')
+            .order_by('id')[:limit]
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            data = BidSerializer(bids, many=True, context=BidSerializer.build_status_context(bids)).data
+        return len(ctx.captured_queries), data
+
+    small_queries, _ = serialize(2)
+    large_queries, data = serialize(12)
+    # 不传 context 时逐条查询，结果应一致
+    reference = BidSerializer(
+        Bid.objects.filter(bidding_round=bidding_round).order_by('id'), many=True
+    ).data
+    print(f"  2 条竞标: {small_queries} 次查询，12 条竞标: {large_queries} 次查询")
+    passed = (
+        small_queries == large_queries == 1
+        and [bid['status'] for bid in data] == [bid['status'] for bid in reference]
+        and [bid['status'] for bid in data].count('won') == 2
+    )
+    print("✓ 一次查询且与逐条查询一致" if passed else "✗ 查询数或状态错误")
+    return passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    try:
+        results = [
+            test_view_query_count(),
+            test_chart_bids_serializer(),
+        ]
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
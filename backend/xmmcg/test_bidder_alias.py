@@ -0,0 +1,150 @@
+"""
+竞标者匿名代号测试脚本
+验证 Bid.bidder_alias 在保存时生成、同轮次内固定，以及行情列表不再加载用户对象
+
+测试场景：
+1. 同一用户在同一轮次的多条竞标代号相同，不同轮次代号不同，且不等于用户名的 MD5 前缀
+2. bulk_create 写入的竞标没有代号，backfill_bidder_aliases 补齐后与 save() 生成的一致
+3. GET /api/songs/bids/target/ 不查询用户表，查询数与竞标数量无关
+
+使用方法：
+    python test_bidder_alias.py
+
+注意：脚本会创建以 aliastest_ 开头的用户、歌曲和轮次，结束后自动清除。
+"""
+
+import os
+import sys
+import hashlib
+from io import StringIO
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from songs.models import Song, BiddingRound, Bid, make_bidder_alias
+
+USER_PREFIX = 'aliastest_'
+ROUND_PREFIX = '测试匿名代号轮次'
+
+
+def clear_test_data():
+    """清除之前的测试数据"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    # 占位歌曲没有真实文件，直接用 QuerySet 删除
+    Song.objects.filter(user__in=test_users).delete()
+    test_users.delete()
+
+
+def create_songs(count):
+    """创建 count 首占位歌曲"""
+    owner = User.objects.create(username=f'{USER_PREFIX}owner')
+    return [
+        Song.objects.create(
+            user=owner,
+            title=f'匿名代号测试歌曲 {i}',
+            audio_file=f'songs/aliastest_{i}.mp3',
+            audio_hash=f'aliastest_hash_{i}',
+            file_size=0,
+        )
+        for i in range(count)
+    ]
+
+
+def test_stable_alias(songs):
+    """场景1：代号在轮次内固定、跨轮次不同"""
+    print("\n场景1：代号生成")
+    rounds = [BiddingRound.objects.create(name=f'{ROUND_PREFIX}{i}', bidding_type='song') for i in range(2)]
+    user = User.objects.create(username=f'{USER_PREFIX}bidder')
+    aliases = {}
+    for bidding_round in rounds:
+        bids = [
+            Bid.objects.create(bidding_round=bidding_round, user=user, bid_type='song', song=song, amount=10)
+            for song in songs[:2]
+        ]
+        aliases[bidding_round.id] = {bid.bidder_alias for bid in bids}
+    md5_prefix = hashlib.md5(user.username.encode('utf-8')).hexdigest()[:6].upper()
+    print(f"  各轮次代号: {aliases}, 用户名 MD5 前缀: {md5_prefix}")
+    first, second = aliases.values()
+    passed = len(first) == 1 and len(second) == 1 and first != second and md5_prefix not in first | second
+    print("✓ 代号固定且不可由用户名推出" if passed else "✗ 代号生成错误")
+    return passed
+
+
+def test_backfill(songs):
+    """场景2：bulk_create 后回填代号"""
+    print("\n场景2：回填代号")
+    bidding_round = BiddingRound.objects.create(name=f'{ROUND_PREFIX}backfill', bidding_type='song')
+    users = [User.objects.create(username=f'{USER_PREFIX}bulk_{i}') for i in range(3)]
+    Bid.objects.bulk_create([
+        Bid(bidding_round=bidding_round, user=user, bid_type='song', song=song, amount=10)
+        for user in users for song in songs[:2]
+    ])
+    empty_before = Bid.objects.filter(bidding_round=bidding_round, bidder_alias='').count()
+    call_command('backfill_bidder_aliases', stdout=StringIO())
+    rows = Bid.objects.filter(bidding_round=bidding_round).values_list('user_id', 'bidder_alias')
+    passed = empty_before == 6 and all(alias == make_bidder_alias(bidding_round.id, user_id) for user_id, alias in rows)
+    print(f"  回填前无代号: {empty_before} 条")
+    print("✓ 回填完成" if passed else "✗ 回填错误")
+    return passed
+
+
+def test_target_bids_queries(songs):
+    """场景3：行情列表不查询用户表"""
+    print("\n场景3：GET /api/songs/bids/target/ 查询")
+    bidding_round = BiddingRound.objects.create(name=f'{ROUND_PREFIX}target', bidding_type='song', status='active')
+    users = [User.objects.create(username=f'{USER_PREFIX}target_{i}') for i in range(8)]
+    client = APIClient()
+    client.force_authenticate(users[0])
+
+    counts = []
+    touched_users = False
+    for bidders in (users[:2], users):
+        song = songs[len(counts)]
+        for user in bidders:
+            Bid.objects.create(bidding_round=bidding_round, user=user, bid_type='song', song=song, amount=10)
+        params = {'song_id': song.id, 'round_id': bidding_round.id}
+        with CaptureQueriesContext(connection) as ctx:
+            data = client.get('/api/songs/bids/target/', params).json()
+        counts.append(len(ctx.captured_queries))
+        touched_users |= any('"auth_user"' in query['sql'] for query in ctx.captured_queries)
+    self_rows = [row for row in data['results'] if row['is_self']]
+    print(f"  2 条 / 8 条竞标的查询数: {counts}, 查询用户表: {touched_users}")
+    passed = (
+        counts[0] == counts[1]
+        and not touched_users
+        and len(self_rows) == 1
+        and self_rows[0]['username'] == make_bidder_alias(bidding_round.id, users[0].id)
+    )
+    print("✓ 查询数固定且不加载用户" if passed else "✗ 查询错误")
+    return passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    try:
+        songs = create_songs(3)
+        results = [
+            test_stable_alias(songs),
+            test_backfill(songs),
+            test_target_bids_queries(songs),
+        ]
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
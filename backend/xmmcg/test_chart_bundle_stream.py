@@ -0,0 +1,210 @@
+"""
+谱面打包下载测试脚本
+验证 download_chart_bundle 以流式 ZIP 打包并缓存，且内容、大小、压缩方式正确
+
+测试场景：
+1. Content-Length 与实际输出字节数一致，ZIP 可被 zipfile 正常解压且 CRC 校验通过
+2. 每个文件内容与原文件一致；媒体文件为 ZIP_STORED，只有 maidata.txt 为 ZIP_DEFLATED
+3. 每次输出的数据块大小有上限（不把整个包放进内存）
+4. 再次下载直接使用缓存（不重新打包）；ETag 命中返回 304；Range 返回 206 和对应字节
+5. 开启 X-Accel-Redirect 时只返回跳转头；超过上限时按 LRU 淘汰；删除谱面只删除索引，
+   相同内容的打包文件仍可被其他谱面使用，之后由淘汰清理
+
+使用方法：
+    python test_chart_bundle_stream.py
+
+注意：脚本会创建以 bundletest_ 开头的用户、歌曲和谱面（含媒体文件），结束后自动清除。
+"""
+
+import os
+import io
+import shutil
+import sys
+import zipfile
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+from songs.models import Song, BiddingRound, Chart
+from songs.bundle_cache import BundleCache
+from songs.zip_stream import CHUNK_SIZE
+
+USER_PREFIX = 'bundletest_'
+ROUND_PREFIX = '测试谱面打包轮次'
+VIDEO_SIZE = 3 * 1024 * 1024 + 123
+
+
+def clear_test_data():
+    """清除之前的测试数据（逐个删除以同时删除媒体文件）"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    for chart in Chart.objects.filter(user__in=test_users):
+        for field in (chart.audio_file, chart.cover_image, chart.background_video):
+            if field:
+                field.delete(save=False)
+        chart.delete()
+    Song.objects.filter(user__in=test_users).delete()
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    test_users.delete()
+
+
+def create_chart():
+    """
+    创建带全部媒体文件的谱面
+
+    Returns:
+        tuple: (谱面, {ZIP 内文件名: 原始内容})
+    """
+    user = User.objects.create(username=f'{USER_PREFIX}author')
+    song = Song.objects.create(
+        user=user,
+        title='打包测试歌曲',
+        audio_file='songs/bundletest.mp3',
+        audio_hash='bundletest_hash',
+        file_size=0,
+    )
+    bidding_round = BiddingRound.objects.create(name=ROUND_PREFIX, bidding_type='chart')
+    chart = Chart.objects.create(bidding_round=bidding_round, user=user, song=song, status='submitted')
+
+    contents = {
+        'maidata.txt': ('&title=打包测试\n&des=测试谱师\n' + '1,2,3,4,\n' * 2000).encode('utf-8'),
+        'track.mp3': os.urandom(512 * 1024),
+        'bg.jpg': os.urandom(64 * 1024),
+        'bg.mp4': os.urandom(VIDEO_SIZE),
+    }
+    chart.chart_file.save('maidata.txt', ContentFile(contents['maidata.txt']), save=False)
+    chart.audio_file.save('track.mp3', ContentFile(contents['track.mp3']), save=False)
+    chart.cover_image.save('bg.jpg', ContentFile(contents['bg.jpg']), save=False)
+    chart.background_video.save('bg.mp4', ContentFile(contents['bg.mp4']), save=False)
+    chart.save()
+    return chart, contents
+
+
+def test_cache(client, chart, body):
+    """场景4：缓存命中、ETag、Range"""
+    print("\n场景4：缓存、ETag 与 Range")
+    url = f'/api/songs/charts/{chart.id}/bundle/'
+    build = BundleCache._build
+
+    def fail_build(*args, **kwargs):
+        raise AssertionError('不应重新打包')
+
+    BundleCache._build = staticmethod(fail_build)
+    try:
+        cached = client.get(url)
+        cached_body = b''.join(cached.streaming_content)
+        not_modified = client.get(url, HTTP_IF_NONE_MATCH=cached['ETag'])
+        partial = client.get(url, HTTP_RANGE='bytes=100-1123')
+        partial_body = b''.join(partial.streaming_content)
+        suffix = client.get(url, HTTP_RANGE='bytes=-10')
+        suffix_body = b''.join(suffix.streaming_content)
+    finally:
+        BundleCache._build = build
+
+    print(f"  ETag: {cached['ETag']}, 304: {not_modified.status_code}, "
+          f"Range: {partial.status_code} {partial.get('Content-Range')}")
+    passed = (
+        cached_body == body
+        and not_modified.status_code == 304
+        and partial.status_code == 206
+        and partial_body == body[100:1124]
+        and partial['Content-Range'] == f'bytes 100-1123/{len(body)}'
+        and suffix.status_code == 206
+        and suffix_body == body[-10:]
+    )
+    print("✓ 缓存命中且 ETag/Range 正确" if passed else "✗ 缓存或 Range 错误")
+    return passed
+
+
+def test_accel_and_invalidation(client, chart):
+    """场景5：X-Accel-Redirect、删除谱面、LRU 淘汰"""
+    print("\n场景5：X-Accel-Redirect 与缓存清理")
+    url = f'/api/songs/charts/{chart.id}/bundle/'
+    with override_settings(CHART_BUNDLE_USE_X_ACCEL=True):
+        response = client.get(url)
+    path, digest = BundleCache.get_bundle(chart)
+    accel_ok = (
+        response['X-Accel-Redirect'] == f'/protected-bundles/{digest[:2]}/{digest}.zip'
+        and response['ETag'] == f'"{digest}"'
+        and not response.content
+    )
+    print(f"  X-Accel-Redirect: {response['X-Accel-Redirect']}")
+
+    removed = BundleCache.evict(max_bytes=0)
+    evicted_ok = removed >= 1 and not os.path.exists(path)
+    rebuilt_path, _ = BundleCache.get_bundle(chart)
+    print(f"  LRU 淘汰 {removed} 个文件，之后重新打包: {os.path.exists(rebuilt_path)}")
+
+    # 另一张谱面的索引指向同一个打包文件（内容相同）
+    other_index = BundleCache._index_path(0)
+    shutil.copyfile(BundleCache._index_path(chart.id), other_index)
+    chart.delete()
+    shared_ok = os.path.exists(rebuilt_path) and not os.path.exists(BundleCache._index_path(chart.id))
+    os.remove(other_index)
+    BundleCache.evict(max_bytes=0)
+    deleted_ok = shared_ok and not os.path.exists(rebuilt_path)
+    print(f"  删除谱面后只删除索引（共享的打包文件保留）: {shared_ok}，淘汰后清除: {not os.path.exists(rebuilt_path)}")
+    passed = accel_ok and evicted_ok and deleted_ok
+    print("✓ 跳转与清理正确" if passed else "✗ 跳转或清理错误")
+    return passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    results = []
+    client = APIClient()
+    try:
+        chart, contents = create_chart()
+        BundleCache.invalidate(chart.id)
+        response = client.get(f'/api/songs/charts/{chart.id}/bundle/')
+        chunks = list(response.streaming_content)
+        body = b''.join(chunks)
+
+        print("\n场景1：Content-Length 与 ZIP 完整性")
+        archive = zipfile.ZipFile(io.BytesIO(body))
+        passed = (
+            response.status_code == 200
+            and int(response['Content-Length']) == len(body)
+            and archive.testzip() is None
+        )
+        print(f"  Content-Length: {response['Content-Length']}, 实际: {len(body)}")
+        print("✓ 大小一致且 CRC 校验通过" if passed else "✗ ZIP 不完整")
+        results.append(passed)
+
+        print("\n场景2：文件内容与压缩方式")
+        passed = set(archive.namelist()) == set(contents)
+        for info in archive.infolist():
+            expected_type = zipfile.ZIP_DEFLATED if info.filename == 'maidata.txt' else zipfile.ZIP_STORED
+            ok = archive.read(info.filename) == contents.get(info.filename) and info.compress_type == expected_type
+            passed &= ok
+            print(f"  {'✓' if ok else '✗'} {info.filename}: {info.file_size} 字节，压缩方式 {info.compress_type}")
+        print("✓ 内容一致" if passed else "✗ 内容或压缩方式错误")
+        results.append(passed)
+
+        print("\n场景3：输出块大小")
+        largest = max(len(chunk) for chunk in chunks)
+        maidata_size = len(contents['maidata.txt'])
+        print(f"  {len(chunks)} 块，最大 {largest} 字节（读块 {CHUNK_SIZE} 字节）")
+        passed = largest <= max(CHUNK_SIZE, maidata_size)
+        print("✓ 按块输出" if passed else "✗ 存在过大的输出块")
+        results.append(passed)
+
+        results.append(test_cache(client, chart, body))
+        results.append(test_accel_and_invalidation(client, chart))
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
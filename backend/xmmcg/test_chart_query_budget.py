@@ -0,0 +1,143 @@
+"""
+谱面列表查询预算测试脚本
+验证谱面相关接口的查询数固定，不随谱面数量增长（不存在 N+1 查询）
+
+测试场景（每个接口分别在少量谱面和较多谱面下请求，查询数应相同且不超过预算）：
+1. GET /api/songs/charts/                       谱面列表（页码分页与游标分页）
+2. GET /api/songs/charts/me/                    当前用户的谱面
+3. GET /api/songs/bidding-rounds/{id}/available-charts/   可竞标的半成品谱面
+4. GET /api/songs/charts/{id}/reviews/          谱面评分详情（评分数量不同）
+
+使用方法：
+    python test_chart_query_budget.py
+
+注意：脚本会创建以 chartqtest_ 开头的用户及其歌曲、谱面，结束后自动清除。
+"""
+
+import os
+import sys
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from songs.models import Song, BiddingRound, BidResult, Chart, PeerReview, PeerReviewAllocation
+
+USER_PREFIX = 'chartqtest_'
+ROUND_PREFIX = '测试谱面查询轮次'
+
+# 每个接口允许的查询数（稳定状态下）
+QUERY_BUDGETS = {
+    'charts_root': 1,
+    'charts_root_cursor': 1,
+    'user_charts': 1,
+    'available_charts': 2,
+    'chart_reviews': 2,
+}
+
+
+def clear_test_data():
+    """清除之前的测试数据"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    # 占位歌曲/谱面没有真实文件，直接用 QuerySet 删除
+    Chart.objects.filter(user__in=test_users).delete()
+    Song.objects.filter(user__in=test_users).delete()
+    test_users.delete()
+
+
+def create_charts(label, count):
+    """
+    创建 count 对一、二部分谱面（第二部分关联第一部分和续写竞标结果），每张谱面有 2 条评分
+
+    Returns:
+        tuple: (谱面作者, 谱面竞标轮次, 第一张谱面)
+    """
+    bidding_round = BiddingRound.objects.create(name=f'{ROUND_PREFIX}{label}', bidding_type='chart', status='completed')
+    author = User.objects.create(username=f'{USER_PREFIX}{label}_author')
+    reviewers = [User.objects.create(username=f'{USER_PREFIX}{label}_reviewer_{i}') for i in range(2)]
+    first_chart = None
+    for i in range(count):
+        song = Song.objects.create(
+            user=author,
+            title=f'查询预算测试歌曲 {label} {i}',
+            audio_file=f'songs/chartqtest_{label}_{i}.mp3',
+            audio_hash=f'chartqtest_hash_{label}_{i}',
+            file_size=0,
+        )
+        part_one = Chart.objects.create(
+            bidding_round=bidding_round, user=author, song=song, status='part_submitted', designer=f'谱师{i}'
+        )
+        bid_result = BidResult.objects.create(
+            bidding_round=bidding_round, user=author, bid_type='chart', chart=part_one, bid_amount=10
+        )
+        part_two = Chart.objects.create(
+            bidding_round=BiddingRound.objects.create(name=f'{ROUND_PREFIX}{label}_{i}', bidding_type='chart'),
+            user=author, song=song, status='reviewed', is_part_one=False,
+            part_one_chart=part_one, completion_bid_result=bid_result,
+        )
+        for chart in (part_one, part_two):
+            for reviewer in reviewers:
+                allocation = PeerReviewAllocation.objects.create(
+                    bidding_round=bidding_round, reviewer=reviewer, chart=chart, status='completed'
+                )
+                PeerReview.objects.create(allocation=allocation, reviewer=reviewer, chart=chart, score=40, comment='不错')
+        first_chart = first_chart or part_one
+    return author, bidding_round, first_chart
+
+
+def count_queries(client, url, params=None):
+    """预热后请求一次，返回 (查询数, 状态码)"""
+    client.get(url, params or {})
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get(url, params or {})
+    return len(ctx.captured_queries), response.status_code
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    client = APIClient()
+    results = []
+    try:
+        samples = {label: create_charts(label, count) for label, count in (('small', 2), ('large', 10))}
+
+        endpoints = {
+            'charts_root': lambda author, round_obj, chart: ('/api/songs/charts/', {'page_size': 100}),
+            'charts_root_cursor': lambda author, round_obj, chart: ('/api/songs/charts/', {'cursor': '', 'page_size': 100}),
+            'user_charts': lambda author, round_obj, chart: ('/api/songs/charts/me/', None),
+            'available_charts': lambda author, round_obj, chart: (
+                f'/api/songs/bidding-rounds/{round_obj.id}/available-charts/', {'page_size': 100}
+            ),
+            'chart_reviews': lambda author, round_obj, chart: (f'/api/songs/charts/{chart.id}/reviews/', None),
+        }
+
+        for name, build in endpoints.items():
+            counts = {}
+            for label, (author, round_obj, chart) in samples.items():
+                client.force_authenticate(author)
+                url, params = build(author, round_obj, chart)
+                counts[label], status_code = count_queries(client, url, params)
+                if status_code != 200:
+                    counts[label] = None
+            passed = counts['small'] == counts['large'] and counts['large'] is not None \
+                and counts['large'] <= QUERY_BUDGETS[name]
+            print(f"{'✓' if passed else '✗'} {name}: 少量谱面 {counts['small']} 次，"
+                  f"较多谱面 {counts['large']} 次（预算 {QUERY_BUDGETS[name]}）")
+            results.append(passed)
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个接口")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
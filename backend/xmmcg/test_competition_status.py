@@ -0,0 +1,192 @@
+"""
+首页比赛状态缓存测试脚本
+验证 get_competition_status 在稳定状态下不查询数据库，且计数器/阶段随信号更新
+
+测试场景：
+1. 缓存预热后再次请求，不产生任何数据库查询
+2. 新增歌曲、谱面、竞标后计数器随信号更新，与数据库统计一致
+3. 修改比赛阶段后时间线缓存失效，状态接口返回新阶段
+4. ETag 未变化时返回 304
+5. 阶段解析（当前阶段、当前竞标阶段、下一个阶段、按ID查找）在内存中完成
+
+使用方法：
+    python test_competition_status.py
+
+注意：脚本会创建以 statustest_ 开头的用户、歌曲、谱面、竞标和阶段，结束后自动清除。
+"""
+
+import os
+import sys
+from datetime import timedelta
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from songs.models import Song, BiddingRound, Bid, Chart, CompetitionPhase
+from songs.phase_service import PhaseService
+from songs.status_service import CompetitionStatusService
+
+USER_PREFIX = 'statustest_'
+PHASE_PREFIX = 'statustest_'
+ROUND_PREFIX = '测试状态缓存轮次'
+STATUS_URL = '/api/songs/status/'
+
+
+def clear_test_data():
+    """清除之前的测试数据"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    Chart.objects.filter(user__in=test_users).delete()
+    Song.objects.filter(user__in=test_users).delete()
+    test_users.delete()
+    CompetitionPhase.objects.filter(phase_key__startswith=PHASE_PREFIX).delete()
+
+
+def create_phase(key, name, submissions_type='songs', order=0, starts_in=timedelta(hours=-1)):
+    """创建一个阶段（默认正在进行中）"""
+    start_time = timezone.now() + starts_in
+    return CompetitionPhase.objects.create(
+        name=name,
+        phase_key=f'{PHASE_PREFIX}{key}',
+        description='状态缓存测试阶段',
+        submissions_type=submissions_type,
+        start_time=start_time,
+        end_time=start_time + timedelta(hours=2),
+        order=order,
+    )
+
+
+def expected_counters():
+    """从数据库直接统计的计数器"""
+    return {
+        'participants': Bid.objects.values('user_id').distinct().count(),
+        'songs': Song.objects.count(),
+        'charts': Chart.objects.count(),
+    }
+
+
+def test_zero_queries(client):
+    """场景1：缓存预热后再次请求，不产生任何数据库查询"""
+    print("\n场景1：稳定状态下的查询数")
+    client.get(STATUS_URL)
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get(STATUS_URL)
+    print(f"  状态码: {response.status_code}, 查询数: {len(ctx.captured_queries)}")
+    passed = response.status_code == 200 and len(ctx.captured_queries) == 0
+    print("✓ 没有查询数据库" if passed else "✗ 仍在查询数据库")
+    return passed
+
+
+def test_counter_signals(client):
+    """场景2：新增歌曲、谱面、竞标后计数器随信号更新"""
+    print("\n场景2：计数器随信号更新")
+    CompetitionStatusService.get_counters()
+
+    user = User.objects.create(username=f'{USER_PREFIX}user')
+    song = Song.objects.create(
+        user=user,
+        title='状态缓存测试歌曲',
+        audio_file='songs/statustest.mp3',
+        audio_hash='statustest_hash',
+        file_size=0,
+    )
+    bidding_round = BiddingRound.objects.create(name=ROUND_PREFIX, bidding_type='song', status='active')
+    Bid.objects.create(bidding_round=bidding_round, user=user, bid_type='song', song=song, amount=10)
+    Chart.objects.create(bidding_round=bidding_round, user=user, song=song, status='part_submitted')
+
+    counters = CompetitionStatusService.get_counters()
+    expected = expected_counters()
+    print(f"  缓存计数器: {counters}")
+    print(f"  数据库统计: {expected}")
+    passed = counters == expected
+    print("✓ 计数器一致" if passed else "✗ 计数器不一致")
+    return passed
+
+
+def test_phase_invalidation(client):
+    """场景3：修改比赛阶段后时间线缓存失效"""
+    print("\n场景3：阶段修改后时间线失效")
+    phase = create_phase('first', '状态缓存测试阶段一')
+    first = client.get(STATUS_URL).json()
+    phase.name = '状态缓存测试阶段二'
+    phase.submissions_type = 'charts'
+    phase.save()
+    second = client.get(STATUS_URL).json()
+    print(f"  修改前: {first['currentRound']} / {first.get('submissionsLabel')}")
+    print(f"  修改后: {second['currentRound']} / {second.get('submissionsLabel')}")
+    passed = second['currentRound'] == '状态缓存测试阶段二' and second['submissions'] == Chart.objects.count()
+    print("✓ 返回新阶段" if passed else "✗ 仍返回旧阶段")
+    return passed
+
+
+def test_etag(client):
+    """场景4：ETag 未变化时返回 304"""
+    print("\n场景4：ETag")
+    first = client.get(STATUS_URL)
+    second = client.get(STATUS_URL, HTTP_IF_NONE_MATCH=first['ETag'])
+    print(f"  ETag: {first['ETag']}, Cache-Control: {first['Cache-Control']}, 第二次状态码: {second.status_code}")
+    passed = second.status_code == 304
+    print("✓ 返回 304" if passed else "✗ 未返回 304")
+    return passed
+
+
+def test_phase_resolver():
+    """场景5：阶段解析在内存中完成"""
+    print("\n场景5：阶段解析")
+    bidding_phase = create_phase('bidding', '状态缓存测试竞标期', order=1)
+    next_phase = create_phase('mapping', '状态缓存测试制谱期', order=2, starts_in=timedelta(days=1))
+    PhaseService.get_timeline()
+
+    with CaptureQueriesContext(connection) as ctx:
+        current_bidding = PhaseService.get_current_bidding_phase('song')
+        current_chart_bidding = PhaseService.get_current_bidding_phase('chart')
+        upcoming = PhaseService.get_next_phase()
+        by_id = PhaseService.get_phase(str(bidding_phase.id), bidding_type='song')
+        wrong_type = PhaseService.get_phase(bidding_phase.id, bidding_type='chart')
+    print(f"  当前歌曲竞标阶段: {current_bidding}, 当前谱面竞标阶段: {current_chart_bidding}")
+    print(f"  下一个阶段: {upcoming}, 查询数: {len(ctx.captured_queries)}")
+
+    passed = (
+        current_bidding == bidding_phase
+        and current_chart_bidding is None
+        and upcoming == next_phase
+        and by_id == bidding_phase
+        and wrong_type is None
+        and len(ctx.captured_queries) == 0
+    )
+    print("✓ 解析正确且没有查询数据库" if passed else "✗ 解析错误")
+    return passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    cache.clear()
+    client = APIClient()
+    try:
+        results = [
+            test_zero_queries(client),
+            test_counter_signals(client),
+            test_phase_invalidation(client),
+            test_etag(client),
+            test_phase_resolver(),
+        ]
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
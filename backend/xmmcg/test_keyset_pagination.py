@@ -0,0 +1,169 @@
+"""
+列表游标分页测试脚本
+验证 songs_root、charts_root、available-charts 的游标分页与页码分页
+
+测试场景：
+1. 歌曲列表按游标逐页遍历，结果与 -id 排序一致且不重复、不遗漏
+2. 谱面列表在 created_at 相同时按 id 区分，游标遍历结果与 (-created_at, id) 排序一致
+3. 游标分页默认不执行 COUNT 查询，include_count=1 时返回总数
+4. 页码分页保持原有响应格式；无效游标返回 400
+
+使用方法：
+    python test_keyset_pagination.py
+
+注意：脚本会创建以 pagetest_ 开头的用户及其歌曲、谱面，结束后自动清除。
+"""
+
+import os
+import sys
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from songs.models import Song, BiddingRound, Chart
+
+USER_PREFIX = 'pagetest_'
+ROUND_PREFIX = '测试分页轮次'
+SONG_COUNT = 23
+PAGE_SIZE = 5
+
+
+def clear_test_data():
+    """清除之前的测试数据"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    # 占位歌曲/谱面没有真实文件，直接用 QuerySet 删除
+    Chart.objects.filter(user__in=test_users).delete()
+    Song.objects.filter(user__in=test_users).delete()
+    test_users.delete()
+
+
+def create_test_data():
+    """
+    创建歌曲和半成品谱面；每 3 张谱面共用同一个 created_at，用于验证并列时的排序
+
+    Returns:
+        BiddingRound: 谱面竞标轮次
+    """
+    bidding_round = BiddingRound.objects.create(name=ROUND_PREFIX, bidding_type='chart', status='active')
+    now = timezone.now()
+    for i in range(SONG_COUNT):
+        user = User.objects.create(username=f'{USER_PREFIX}{i}')
+        song = Song.objects.create(
+            user=user,
+            title=f'分页测试歌曲 {i}',
+            audio_file=f'songs/pagetest_{i}.mp3',
+            audio_hash=f'pagetest_hash_{i}',
+            file_size=0,
+        )
+        chart = Chart.objects.create(bidding_round=bidding_round, user=user, song=song, status='part_submitted')
+        Chart.objects.filter(id=chart.id).update(created_at=now - timezone.timedelta(seconds=i // 3))
+    return bidding_round
+
+
+def walk(client, url):
+    """按游标遍历列表，返回 (id 列表, 请求次数)"""
+    ids = []
+    cursor = ''
+    requests = 0
+    while True:
+        data = client.get(url, {'cursor': cursor, 'page_size': PAGE_SIZE}).json()
+        requests += 1
+        ids.extend(row['id'] for row in data['results'])
+        cursor = data['next_cursor']
+        if not cursor:
+            return ids, requests
+
+
+def test_songs_cursor(client):
+    """场景1：歌曲列表游标遍历"""
+    print("\n场景1：歌曲列表游标遍历")
+    ids, requests = walk(client, '/api/songs/')
+    expected = list(Song.objects.order_by('-id').values_list('id', flat=True))
+    print(f"  {requests} 次请求，{len(ids)} 首歌曲（期望 {len(expected)}）")
+    passed = ids == expected
+    print("✓ 顺序正确且不重复" if passed else "✗ 遍历结果错误")
+    return passed
+
+
+def test_charts_cursor(client, bidding_round):
+    """场景2：谱面列表在 created_at 相同时的游标遍历"""
+    print("\n场景2：谱面列表游标遍历（created_at 并列）")
+    results = []
+    for url, charts in (
+        ('/api/songs/charts/', Chart.objects.all()),
+        (f'/api/songs/bidding-rounds/{bidding_round.id}/available-charts/', Chart.objects.filter(status='part_submitted')),
+    ):
+        ids, requests = walk(client, url)
+        expected = list(charts.order_by('-created_at', 'id').values_list('id', flat=True))
+        print(f"  {url}: {requests} 次请求，{len(ids)} 张谱面（期望 {len(expected)}）")
+        results.append(ids == expected)
+    passed = all(results)
+    print("✓ 顺序正确且不重复" if passed else "✗ 遍历结果错误")
+    return passed
+
+
+def test_optional_count(client):
+    """场景3：游标分页默认不计数"""
+    print("\n场景3：总数可选")
+    with CaptureQueriesContext(connection) as ctx:
+        data = client.get('/api/songs/charts/', {'cursor': '', 'page_size': PAGE_SIZE}).json()
+    counted = any('COUNT(' in query['sql'].upper() for query in ctx.captured_queries)
+    with_count = client.get('/api/songs/charts/', {'cursor': '', 'include_count': 1}).json()
+    print(f"  默认: count={'count' in data}, COUNT 查询={counted}; include_count=1: count={with_count.get('count')}")
+    passed = 'count' not in data and not counted and with_count.get('count') == Chart.objects.count()
+    print("✓ 总数按需返回" if passed else "✗ 总数处理错误")
+    return passed
+
+
+def test_page_mode(client):
+    """场景4：页码分页兼容与无效游标"""
+    print("\n场景4：页码分页兼容")
+    data = client.get('/api/songs/', {'page': 2, 'page_size': PAGE_SIZE}).json()
+    expected = list(Song.objects.order_by('-id').values_list('id', flat=True)[PAGE_SIZE:PAGE_SIZE * 2])
+    total = Song.objects.count()
+    invalid = client.get('/api/songs/', {'cursor': 'not-a-cursor'})
+    print(f"  第2页: {[row['id'] for row in data['results']]}, count={data['count']}, total_pages={data['total_pages']}")
+    print(f"  无效游标状态码: {invalid.status_code}")
+    passed = (
+        [row['id'] for row in data['results']] == expected
+        and data['count'] == total
+        and data['page'] == 2
+        and data['total_pages'] == (total + PAGE_SIZE - 1) // PAGE_SIZE
+        and invalid.status_code == 400
+    )
+    print("✓ 兼容原有格式" if passed else "✗ 页码分页错误")
+    return passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    client = APIClient()
+    try:
+        bidding_round = create_test_data()
+        client.force_authenticate(User.objects.get(username=f'{USER_PREFIX}0'))
+        results = [
+            test_songs_cursor(client),
+            test_charts_cursor(client, bidding_round),
+            test_optional_count(client),
+            test_page_mode(client),
+        ]
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+"""
+Majdata.net 转发队列测试脚本
+使用本地模拟的 Majdata.net HTTP 服务，验证提交谱面只写入队列、工作进程异步上传并重试
+
+测试场景：
+1. 提交谱面立即返回，转发记录为 pending，请求期间不访问 Majdata.net
+2. 上传失败后按退避时间重新排队并记录原因；到期后重试成功，保存返回地址；成功后不再重复上传
+3. 同一条记录只能被认领一次；上传中超时的记录重新排队
+4. 超过最大次数后标记为 failed，重新排队后可再次上传
+5. 线程池限制同时上传数
+
+注意：脚本会创建以 majdatatest_ 开头的用户、歌曲和谱面（含媒体文件），结束后自动清除。
+"""
+
+import os
+import sys
+import json
+import threading
+import time
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from PIL import Image
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from songs.models import Song, BiddingRound, BidResult, Chart, MajdataUpload
+from songs.majdata_outbox import MajdataOutboxService
+from songs.majdata_service import MajdataService
+
+USER_PREFIX = 'majdatatest_'
+ROUND_PREFIX = '测试Majdata转发轮次'
+MP3 = b'ID3\x04' + b'\x00' * 512
+
+
+def make_jpeg():
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), 'white').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+JPEG = make_jpeg()
+
+
+class StubMajdata:
+    """模拟的 Majdata.net：按 statuses 依次返回上传结果（用完后返回 200），记录请求和并发数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statuses = []
+        self.delay = 0
+        self.uploads = []
+        self.logins = 0
+        self.active = 0
+        self.max_active = 0
+
+    def handler(stub):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path == '/login':
+                    with stub.lock:
+                        stub.logins += 1
+                    self.reply(200, {'code': 114514, 'message': 'ok'}, cookie='token=stub')
+                    return
+
+                with stub.lock:
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                    status = stub.statuses.pop(0) if stub.statuses else 200
+                time.sleep(stub.delay)
+                with stub.lock:
+                    stub.active -= 1
+                    if status == 200:
+                        stub.uploads.append(body)
+                if status == 200:
+                    self.reply(200, {'url': f'https://majdata.stub/chart/{len(stub.uploads)}'})
+                else:
+                    self.reply(status, {'message': 'stub error'})
+
+            def reply(self, status, payload, cookie=None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if cookie:
+                    self.send_header('Set-Cookie', cookie)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def clear_test_data():
+    """清除之前的测试数据（逐个删除以同时删除媒体文件）"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    for chart in Chart.objects.filter(user__in=test_users):
+        chart.delete()
+    for song in Song.objects.filter(user__in=test_users):
+        song.delete()
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    test_users.delete()
+
+
+def create_chart(song, bidding_round, index):
+    """创建谱面（每张谱面一个作者）并加入转发队列"""
+    user = User.objects.create(username=f'{USER_PREFIX}author_{index}')
+    chart = Chart.objects.create(
+        bidding_round=bidding_round, user=user, song=song, status='part_submitted',
+        designer='tester', cover_image=SimpleUploadedFile('bg.jpg', JPEG),
+        chart_file=ContentFile(f'&title=chart{index}\n&des=tester\n'.encode(), name='maidata.txt'),
+        submitted_at=timezone.now(),
+    )
+    MajdataOutboxService.enqueue(chart)
+    return chart
+
+
+def run_worker(threads=2):
+    call_command('run_majdata_worker', '--once', '--threads', str(threads), stdout=StringIO())
+
+
+def test_submit(stub, song, bidding_round):
+    """场景1：提交谱面只写入队列"""
+    print("\n场景1：提交谱面")
+    user = User.objects.create(username=f'{USER_PREFIX}submitter')
+    bid_result = BidResult.objects.create(
+        bidding_round=bidding_round, user=user, song=song, bid_type='song', bid_amount=1,
+    )
+    client = APIClient()
+    client.force_authenticate(user=user)
+    start = time.monotonic()
+    response = client.post(f'/api/songs/charts/{bid_result.id}/submit/', {
+        'audio_file': SimpleUploadedFile('track.mp3', MP3),
+        'cover_image': SimpleUploadedFile('bg.jpg', JPEG),
+        'chart_file': SimpleUploadedFile('maidata.txt', '&title=提交测试\n&des=tester\n'.encode()),
+    }, format='multipart')
+    elapsed = time.monotonic() - start
+
+    upload = MajdataUpload.objects.filter(chart__user=user).first()
+    print(f"  响应 {response.status_code}，耗时 {elapsed:.2f}s，转发状态 {upload.status if upload else None}")
+    passed = (
+        response.status_code == 201
+        and upload is not None
+        and upload.status == 'pending'
+        and not stub.uploads and stub.logins == 0
+    )
+    print("✓ 只写入队列" if passed else "✗ 提交时访问了 Majdata.net 或未写入队列")
+    return passed, upload
+
+
+def test_retry(stub, upload):
+    """场景2：失败重试与成功"""
+    print("\n场景2：失败后重试")
+    stub.statuses = [500]
+    before = timezone.now()
+    run_worker()
+    upload.refresh_from_db()
+    wait = (upload.next_attempt_at - before).total_seconds()
+    print(f"  第一次: {upload.status}，第 {upload.attempts} 次，{wait:.0f} 秒后重试，原因: {upload.last_error}")
+    passed = upload.status == 'pending' and upload.attempts == 1 and 25 <= wait <= 35 and bool(upload.last_error)
+
+    run_worker()
+    upload.refresh_from_db()
+    passed &= upload.status == 'pending' and not stub.uploads
+
+    MajdataUpload.objects.filter(id=upload.id).update(next_attempt_at=timezone.now())
+    run_worker()
+    upload.refresh_from_db()
+    print(f"  第二次: {upload.status}，地址 {upload.external_url}")
+    body = stub.uploads[0] if stub.uploads else b''
+    passed &= (
+        upload.status == 'succeeded'
+        and upload.external_url == 'https://majdata.stub/chart/1'
+        and b'filename="maidata.txt"' in body
+        and b'filename="track.mp3"' in body
+        and b'filename="bg.jpg"' in body
+        and '&title=[谱面碎片]提交测试'.encode() in body
+    )
+
+    MajdataUpload.objects.filter(id=upload.id).update(next_attempt_at=timezone.now())
+    run_worker()
+    passed &= len(stub.uploads) == 1
+    print("✓ 退避重试后上传成功，且不重复上传" if passed else "✗ 重试或上传结果错误")
+    return passed
+
+
+def test_claim_and_stale(song, bidding_round):
+    """场景3：认领与超时重新排队"""
+    print("\n场景3：认领与超时")
+    upload = create_chart(song, bidding_round, 'claim').majdata_upload
+    first = MajdataOutboxService.claim_due(10)
+    second = MajdataOutboxService.claim_due(10)
+    upload.refresh_from_db()
+    print(f"  第一次认领 {first}，第二次认领 {second}，状态 {upload.status}")
+    passed = first == [upload.id] and second == [] and upload.status == 'running'
+
+    MajdataUpload.objects.filter(id=upload.id).update(locked_at=timezone.now() - timedelta(hours=1))
+    requeued = MajdataOutboxService.requeue_stale()
+    upload.refresh_from_db()
+    print(f"  超时重新排队 {requeued} 条，状态 {upload.status}")
+    passed &= requeued == 1 and upload.status == 'pending'
+    upload.delete()
+    print("✓ 只认领一次且超时可恢复" if passed else "✗ 认领或超时处理错误")
+    return passed
+
+
+def test_give_up(stub, song, bidding_round):
+    """场景4：超过最大次数"""
+    print("\n场景4：超过最大次数")
+    upload = create_chart(song, bidding_round, 'giveup').majdata_upload
+    stub.statuses = [500, 500]
+    with override_settings(MAJDATA_OUTBOX_MAX_ATTEMPTS=2):
+        run_worker()
+        MajdataUpload.objects.filter(id=upload.id).update(next_attempt_at=timezone.now())
+        run_worker()
+    upload.refresh_from_db()
+    print(f"  状态 {upload.status}，尝试 {upload.attempts} 次")
+    passed = upload.status == 'failed' and upload.attempts == 2
+
+    MajdataOutboxService.retry(MajdataUpload.objects.filter(id=upload.id))
+    run_worker()
+    upload.refresh_from_db()
+    print(f"  重新排队后: {upload.status}")
+    passed &= upload.status == 'succeeded'
+    print("✓ 放弃后可重新上传" if passed else "✗ 放弃或重新排队错误")
+    return passed
+
+
+def test_pool_bound(stub, song, bidding_round):
+    """场景5：线程池并发上限"""
+    print("\n场景5：线程池")
+    charts = [create_chart(song, bidding_round, i) for i in range(6)]
+    stub.delay = 0.3
+    stub.max_active = 0
+    start = time.monotonic()
+    run_worker(threads=2)
+    elapsed = time.monotonic() - start
+    stub.delay = 0
+    done = MajdataUpload.objects.filter(chart__in=charts, status='succeeded').count()
+    print(f"  {done}/6 上传成功，最大并发 {stub.max_active}，耗时 {elapsed:.2f}s")
+    passed = done == 6 and stub.max_active == 2
+    print("✓ 并发受限" if passed else "✗ 并发数错误")
+    return passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    stub = StubMajdata()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), stub.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    MajdataService.reset_session()
+
+    results = []
+    try:
+        with override_settings(
+            ENABLE_CHART_FORWARD_TO_MAJDATA=True,
+            MAJDATA_LOGIN_URL=f'{base_url}/login',
+            MAJDATA_UPLOAD_URL=f'{base_url}/upload',
+        ):
+            owner = User.objects.create(username=f'{USER_PREFIX}owner')
+            song = Song.objects.create(
+                user=owner, title='转发测试歌曲', audio_file=SimpleUploadedFile('track.mp3', MP3),
+                audio_hash='majdatatest_hash', file_size=len(MP3),
+            )
+            bidding_round = BiddingRound.objects.create(name=ROUND_PREFIX, bidding_type='song')
+
+            passed, upload = test_submit(stub, song, bidding_round)
+            results.append(passed)
+            if upload:
+                results.append(test_retry(stub, upload))
+            results.append(test_claim_and_stale(song, bidding_round))
+            results.append(test_give_up(stub, song, bidding_round))
+            results.append(test_pool_bound(stub, song, bidding_round))
+    finally:
+        server.shutdown()
+        MajdataService.reset_session()
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
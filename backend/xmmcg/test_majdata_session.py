@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""
+Majdata.net 会话测试脚本
+使用本地模拟的 Majdata.net HTTP 服务（可随时让已发放的登录凭证失效），验证多线程共享会话时的登录与自动重新登录
+
+测试场景：
+1. 多个线程同时首次使用，只登录一次
+2. 登录失效（401）时重新登录并重试一次，上传成功
+3. 登录失效（重定向到登录页）时重新登录并重试一次，上传成功
+4. 多个线程同时发现登录失效，只重新登录一次，全部上传成功
+5. 登录失败时上传返回 None，不发送上传请求
+6. 调用统计与连接池大小
+
+注意：脚本不访问数据库，也不访问真实的 Majdata.net。
+"""
+
+import os
+import sys
+import json
+import threading
+import time
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import override_settings
+from songs.majdata_service import MajdataService, session_manager
+
+THREADS = 8
+
+
+class StubMajdata:
+    """模拟的 Majdata.net：登录时发放新凭证，expire() 后旧凭证失效（mode 为 401 或 redirect）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = set()
+        self.logins = 0
+        self.uploads = 0
+        self.rejected = 0
+        self.mode = '401'
+        self.fail_login = False
+        self.delay = 0
+
+    def expire(self, mode):
+        with self.lock:
+            self.tokens.clear()
+            self.mode = mode
+
+    def handler(stub):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                # 登录页（被重定向时到达）
+                self.reply(200, {'message': 'please login'})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path == '/login':
+                    time.sleep(0.05)
+                    with stub.lock:
+                        stub.logins += 1
+                        if stub.fail_login:
+                            self.reply(200, {'code': 403, 'message': 'wrong password'})
+                            return
+                        token = f'token{stub.logins}'
+                        stub.tokens.add(token)
+                    self.reply(200, {'code': 114514, 'message': 'ok'}, cookie=f'token={token}; Path=/')
+                    return
+
+                time.sleep(stub.delay)
+                cookie = self.headers.get('Cookie', '')
+                with stub.lock:
+                    valid = any(f'token={token}' in cookie for token in stub.tokens)
+                    if valid:
+                        stub.uploads += 1
+                    else:
+                        stub.rejected += 1
+                if valid:
+                    self.reply(200, {'url': 'https://majdata.stub/chart/1'})
+                elif stub.mode == 'redirect':
+                    self.send_response(302)
+                    self.send_header('Location', '/login')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                else:
+                    self.reply(401, {'message': 'unauthorized'})
+
+            def reply(self, status, payload, cookie=None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if cookie:
+                    self.send_header('Set-Cookie', cookie)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def make_chart_data():
+    """上传参数（每次新建文件对象）"""
+    return {
+        'maidata_content': '&title=会话测试\n&des=tester\n',
+        'audio_file': SimpleUploadedFile('track.mp3', b'ID3\x04' + b'\x00' * 64),
+        'cover_file': SimpleUploadedFile('bg.jpg', b'\xff\xd8\xff' + b'\x00' * 64),
+        'folder_name': 'session_test',
+    }
+
+
+def run_threads(target):
+    """THREADS 个线程同时执行 target，返回各线程的结果"""
+    barrier = threading.Barrier(THREADS)
+    results = [None] * THREADS
+
+    def run(index):
+        barrier.wait()
+        results[index] = target()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_login(stub):
+    """场景1：并发首次登录"""
+    print("\n场景1：多个线程同时首次使用")
+    sessions = run_threads(MajdataService.get_session)
+    print(f"  登录 {stub.logins} 次，{len({id(s) for s in sessions})} 个 session")
+    passed = stub.logins == 1 and all(sessions) and len({id(s) for s in sessions}) == 1
+    print("✓ 只登录一次" if passed else "✗ 重复登录")
+    return passed
+
+
+def test_expired(stub, mode):
+    """场景2/3：登录失效后重新登录"""
+    logins, uploads, rejected = stub.logins, stub.uploads, stub.rejected
+    stub.expire(mode)
+    result = MajdataService.upload_chart(make_chart_data())
+    print(f"  结果 {result}，重新登录 {stub.logins - logins} 次，被拒绝 {stub.rejected - rejected} 次")
+    passed = (
+        result is not None
+        and stub.logins - logins == 1
+        and stub.rejected - rejected == 1
+        and stub.uploads - uploads == 1
+    )
+    print("✓ 重新登录后重试成功" if passed else "✗ 未重新登录或未重试")
+    return passed
+
+
+def test_concurrent_relogin(stub):
+    """场景4：多个线程同时发现登录失效"""
+    print("\n场景4：多个线程同时发现登录失效")
+    logins, uploads = stub.logins, stub.uploads
+    stub.expire('401')
+    stub.delay = 0.1
+    results = run_threads(lambda: MajdataService.upload_chart(make_chart_data()))
+    stub.delay = 0
+    print(f"  {sum(r is not None for r in results)}/{THREADS} 上传成功，重新登录 {stub.logins - logins} 次")
+    passed = all(r is not None for r in results) and stub.logins - logins == 1 and stub.uploads - uploads == THREADS
+    print("✓ 只重新登录一次" if passed else "✗ 重复登录或上传失败")
+    return passed
+
+
+def test_login_failure(stub):
+    """场景5：登录失败"""
+    print("\n场景5：登录失败")
+    MajdataService.reset_session()
+    stub.fail_login = True
+    rejected, uploads = stub.rejected, stub.uploads
+    result = MajdataService.upload_chart(make_chart_data())
+    stub.fail_login = False
+    metrics = MajdataService.get_metrics()
+    print(f"  结果 {result}，统计 {metrics}")
+    passed = (
+        result is None
+        and stub.rejected == rejected and stub.uploads == uploads
+        and metrics.get('login', {}).get('errors') == 1
+        and 'upload' not in metrics
+    )
+    print("✓ 返回 None 且未发送上传" if passed else "✗ 登录失败处理错误")
+    return passed
+
+
+def test_metrics_and_pool(stub):
+    """场景6：调用统计与连接池"""
+    print("\n场景6：调用统计与连接池")
+    with override_settings(MAJDATA_POOL_SIZE=3):
+        MajdataService.reset_session()
+        for _ in range(3):
+            MajdataService.upload_chart(make_chart_data())
+        session = MajdataService.get_session()
+        adapter = session.get_adapter('http://127.0.0.1/')
+        metrics = MajdataService.get_metrics()
+    upload = metrics.get('upload', {})
+    print(f"  统计 {metrics}，连接池 {adapter._pool_maxsize}")
+    passed = (
+        metrics.get('login', {}).get('count') == 1
+        and upload.get('count') == 3 and upload.get('errors') == 0
+        and 0 < upload.get('avg_ms', 0) <= upload.get('max_ms', 0)
+        and adapter._pool_maxsize == 3
+    )
+    print("✓ 统计和连接池正确" if passed else "✗ 统计或连接池错误")
+    return passed
+
+
+def main():
+    """主函数"""
+    stub = StubMajdata()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), stub.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    MajdataService.reset_session()
+
+    results = []
+    try:
+        with override_settings(
+            MAJDATA_LOGIN_URL=f'{base_url}/login',
+            MAJDATA_UPLOAD_URL=f'{base_url}/upload',
+        ):
+            results.append(test_concurrent_login(stub))
+            print("\n场景2：登录失效（401）")
+            results.append(test_expired(stub, '401'))
+            print("\n场景3：登录失效（重定向到登录页）")
+            results.append(test_expired(stub, 'redirect'))
+            results.append(test_concurrent_relogin(stub))
+            results.append(test_login_failure(stub))
+            results.append(test_metrics_and_pool(stub))
+    finally:
+        server.shutdown()
+        session_manager.reset()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
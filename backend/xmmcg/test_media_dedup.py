@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+媒体文件按内容存储测试脚本
+验证相同内容的媒体文件只保存一份、按引用计数删除，以及 dedupe_media 迁移旧文件
+
+测试场景：
+1. 谱面沿用歌曲原音频时不再复制文件，引用计数为 2
+2. 删除歌曲后文件仍保留；删除最后一个引用（谱面）后文件和记录一起删除
+3. dedupe_media --dry-run 不修改任何内容；执行后旧文件迁移为一份，引用计数正确，旧文件被删除
+4. 引用计数错误时 dedupe_media 按实际引用修正
+5. 迁移每批更新记录时同时增加引用计数（无需等最后重新计数），迁移中删除记录不会删除仍被引用的文件；
+   多个字段引用同一旧文件时，旧文件在所有记录迁移后才删除
+6. 引用计数偏小时，删除记录不会删除仍被引用的文件，并按实际引用修正计数
+7. 保存文件的事务回滚后留下的文件（没有记录）超过保留时间后被 dedupe_media 删除，新文件保留
+
+注意：脚本会创建以 deduptest_ 开头的用户、歌曲和谱面（含媒体文件），结束后自动清除。
+"""
+
+import os
+import sys
+import time
+import hashlib
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from songs.management.commands.dedupe_media import Command as DedupeCommand
+from songs.models import Song, BiddingRound, Chart, MediaBlob
+from songs.storage import BLOB_PREFIX, blob_name_for, media_storage
+
+USER_PREFIX = 'deduptest_'
+ROUND_PREFIX = '测试媒体去重轮次'
+
+
+def clear_test_data():
+    """清除之前的测试数据（逐个删除以同时删除媒体文件）"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    for chart in Chart.objects.filter(user__in=test_users):
+        chart.delete()
+    for song in Song.objects.filter(user__in=test_users):
+        song.delete()
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    test_users.delete()
+
+
+def blob_exists(name):
+    return media_storage.exists(name) and MediaBlob.objects.filter(name=name).exists()
+
+
+def create_song(user, audio, **kwargs):
+    return Song.objects.create(
+        user=user,
+        title='去重测试歌曲',
+        audio_file=SimpleUploadedFile('track.mp3', audio),
+        audio_hash=hashlib.sha256(audio).hexdigest(),
+        file_size=len(audio),
+        **kwargs
+    )
+
+
+def test_shared_audio(user, bidding_round):
+    """场景1、2：共享文件与引用计数"""
+    print("\n场景1：谱面沿用歌曲原音频")
+    audio = b'ID3' + os.urandom(64 * 1024)
+    song = create_song(user, audio)
+    chart = Chart.objects.create(
+        bidding_round=bidding_round, user=user, song=song, status='part_submitted',
+        audio_file=SimpleUploadedFile('chart_audio.mp3', audio),
+        chart_file=ContentFile(b'&des=test\n', name='maidata.txt'),
+    )
+    name = blob_name_for(hashlib.sha256(audio).hexdigest(), 'track.mp3')
+    blob = MediaBlob.objects.get(name=name)
+    print(f"  歌曲: {song.audio_file.name}")
+    print(f"  谱面: {chart.audio_file.name}，引用 {blob.ref_count}")
+    passed = (
+        song.audio_file.name == chart.audio_file.name == name
+        and blob.ref_count == 2
+        and media_storage.exists(name)
+        and not chart.chart_file.name.startswith(BLOB_PREFIX)
+    )
+    print("✓ 只保存一份" if passed else "✗ 文件被重复保存")
+    results = [passed]
+
+    print("\n场景2：按引用计数删除")
+    song_id = song.id
+    Chart.objects.filter(pk=chart.pk).update(song=create_song(user, b'ID3other'))
+    chart.refresh_from_db()
+    Song.objects.get(pk=song_id).delete()
+    after_song = blob_exists(name) and MediaBlob.objects.get(name=name).ref_count == 1
+    chart.delete()
+    after_chart = not media_storage.exists(name) and not MediaBlob.objects.filter(name=name).exists()
+    print(f"  删除歌曲后文件保留: {after_song}，删除谱面后文件删除: {after_chart}")
+    passed = after_song and after_chart
+    print("✓ 引用归零才删除" if passed else "✗ 删除时机错误")
+    results.append(passed)
+    return results
+
+
+def test_dedupe_command(user, bidding_round):
+    """场景3：迁移旧文件"""
+    print("\n场景3：dedupe_media 迁移旧文件")
+    audio = b'ID3' + os.urandom(32 * 1024)
+    cover = b'\xff\xd8\xff' + os.urandom(8 * 1024)
+    legacy_audio = [
+        default_storage.save(f'songs/{USER_PREFIX}audio.mp3', ContentFile(audio)),
+        default_storage.save(f'charts/{USER_PREFIX}audio.mp3', ContentFile(audio)),
+    ]
+    legacy_cover = default_storage.save(f'charts/{USER_PREFIX}cover.jpg', ContentFile(cover))
+
+    song = Song.objects.create(
+        user=user, title='旧歌曲', audio_file=legacy_audio[0],
+        audio_hash=hashlib.sha256(audio).hexdigest(), file_size=len(audio),
+    )
+    chart = Chart.objects.create(
+        bidding_round=bidding_round, user=user, song=song, status='part_submitted',
+        audio_file=legacy_audio[1], cover_image=legacy_cover,
+    )
+
+    out = StringIO()
+    call_command('dedupe_media', '--dry-run', stdout=out, stderr=StringIO())
+    song.refresh_from_db()
+    untouched = song.audio_file.name == legacy_audio[0] and default_storage.exists(legacy_audio[0])
+    print(f"  {out.getvalue().strip().splitlines()[-1]}")
+
+    out = StringIO()
+    call_command('dedupe_media', stdout=out, stderr=StringIO())
+    print(f"  {out.getvalue().strip().splitlines()[-1]}")
+    song.refresh_from_db()
+    chart.refresh_from_db()
+    audio_name = blob_name_for(hashlib.sha256(audio).hexdigest(), 'a.mp3')
+    cover_name = blob_name_for(hashlib.sha256(cover).hexdigest(), 'a.jpg')
+    with media_storage.open(audio_name, 'rb') as f:
+        content_ok = f.read() == audio
+
+    passed = (
+        untouched
+        and song.audio_file.name == chart.audio_file.name == audio_name
+        and chart.cover_image.name == cover_name
+        and MediaBlob.objects.get(name=audio_name).ref_count == 2
+        and MediaBlob.objects.get(name=cover_name).ref_count == 1
+        and content_ok
+        and not any(default_storage.exists(name) for name in legacy_audio + [legacy_cover])
+    )
+    print("✓ 迁移正确" if passed else "✗ 迁移错误")
+    results = [passed]
+
+    print("\n场景4：修正引用计数")
+    MediaBlob.objects.filter(name=audio_name).update(ref_count=7)
+    call_command('dedupe_media', stdout=StringIO(), stderr=StringIO())
+    fixed = MediaBlob.objects.get(name=audio_name).ref_count
+    print(f"  修正后引用: {fixed}")
+    passed = fixed == 2
+    print("✓ 已按实际引用修正" if passed else "✗ 引用计数未修正")
+    results.append(passed)
+    return results
+
+
+def test_refcount_during_migration(user, bidding_round):
+    """场景5、6：迁移过程中的引用计数"""
+    print("\n场景5：迁移中的引用计数")
+    audio = b'ID3' + os.urandom(16 * 1024)
+    legacy = default_storage.save(f'songs/{USER_PREFIX}shared.mp3', ContentFile(audio))
+    song = Song.objects.create(
+        user=user, title='共享旧音频', audio_file=legacy,
+        audio_hash=hashlib.sha256(audio).hexdigest(), file_size=len(audio),
+    )
+    chart = Chart.objects.create(
+        bidding_round=bidding_round, user=user, song=song, status='part_submitted', audio_file=legacy,
+    )
+    name = blob_name_for(hashlib.sha256(audio).hexdigest(), legacy)
+
+    # 不执行最后的重新计数，检查每批写入的引用计数
+    original_recount = DedupeCommand.recount
+    DedupeCommand.recount = lambda self: (0, 0)
+    try:
+        call_command('dedupe_media', '--batch-size', '1', stdout=StringIO(), stderr=StringIO())
+    finally:
+        DedupeCommand.recount = original_recount
+    song.refresh_from_db()
+    chart.refresh_from_db()
+    ref_count = MediaBlob.objects.get(name=name).ref_count
+    migrated = song.audio_file.name == chart.audio_file.name == name and not default_storage.exists(legacy)
+    Song.objects.filter(pk=song.pk).update(audio_file='')
+    chart.delete()
+    kept = blob_exists(name) and MediaBlob.objects.get(name=name).ref_count == 1
+    print(f"  迁移后引用 {ref_count}，两条记录迁移且旧文件已删除: {migrated}，删除谱面后文件保留: {kept}")
+    passed = ref_count == 2 and migrated and kept
+    print("✓ 每批同步引用计数" if passed else "✗ 引用计数未同步")
+    results = [passed]
+
+    print("\n场景6：引用计数偏小时删除")
+    other = Chart.objects.create(
+        bidding_round=BiddingRound.objects.create(name=f'{ROUND_PREFIX}3', bidding_type='song'),
+        user=user, song=create_song(user, b'ID3another'), status='part_submitted', audio_file=name,
+    )
+    Song.objects.filter(pk=song.pk).update(audio_file=name)
+    song.refresh_from_db()
+    MediaBlob.objects.filter(name=name).update(ref_count=1)
+    song.delete()
+    blob = MediaBlob.objects.filter(name=name).first()
+    print(f"  删除歌曲后文件存在: {media_storage.exists(name)}，引用计数 {blob.ref_count if blob else None}")
+    passed = media_storage.exists(name) and blob is not None and blob.ref_count == 1
+    other.delete()
+    passed &= not media_storage.exists(name) and not MediaBlob.objects.filter(name=name).exists()
+    print("✓ 仍被引用的文件未删除" if passed else "✗ 删除了仍被引用的文件")
+    results.append(passed)
+    return results
+
+
+def test_rolled_back_upload():
+    """场景7：事务回滚留下的文件"""
+    print("\n场景7：事务回滚后留下的文件")
+    names = []
+    for _ in range(2):
+        with transaction.atomic():
+            names.append(media_storage.save('track.mp3', ContentFile(b'ID3' + os.urandom(1024))))
+            transaction.set_rollback(True)
+    old, new = names
+    stale = time.time() - 2 * 3600
+    os.utime(media_storage.path(old), (stale, stale))
+    left = media_storage.exists(old) and not MediaBlob.objects.filter(name__in=names).exists()
+
+    out = StringIO()
+    call_command('dedupe_media', stdout=out, stderr=StringIO())
+    print(f"  回滚后文件留下且没有记录: {left}；{out.getvalue().strip().splitlines()[-1]}")
+    passed = left and not media_storage.exists(old) and media_storage.exists(new)
+    media_storage.delete(new)
+    print("✓ 超过保留时间的文件被删除" if passed else "✗ 未清除或误删了新文件")
+    return passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    results = []
+    try:
+        user = User.objects.create(username=f'{USER_PREFIX}author')
+        bidding_round = BiddingRound.objects.create(name=ROUND_PREFIX, bidding_type='song')
+        results.extend(test_shared_audio(user, bidding_round))
+        bidding_round = BiddingRound.objects.create(name=f'{ROUND_PREFIX}2', bidding_type='song')
+        results.extend(test_dedupe_command(user, bidding_round))
+        bidding_round = BiddingRound.objects.create(name=f'{ROUND_PREFIX}4', bidding_type='song')
+        results.extend(test_refcount_during_migration(user, bidding_round))
+        results.append(test_rolled_back_upload())
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
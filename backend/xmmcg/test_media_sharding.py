@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""
+上传文件分片目录测试脚本
+验证新上传文件写入 {prefix}/ab/cd/ 分片目录，以及 shard_media 分批迁移旧文件
+
+测试场景：
+1. 新上传的谱面文件位于 charts/ab/cd/<uuid>/maidata.txt
+2. shard_media --dry-run 不修改任何内容
+3. 迁移中途中断（第二批写库失败）后重新执行，所有文件迁移完成、内容不变，旧文件和旧目录被删除，不存在的文件被跳过
+4. 两条记录引用同一旧文件，第一条迁移后旧文件已删除时中断；重新执行时第二条指向已建立的新文件
+
+注意：脚本会创建以 shardtest_ 开头的用户、歌曲和谱面（含谱面文件），结束后自动清除。
+"""
+
+import os
+import sys
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db.models.query import QuerySet
+from songs.models import Song, BiddingRound, Chart
+from songs.management.commands.shard_media import SHARDED_RE
+
+USER_PREFIX = 'shardtest_'
+ROUND_PREFIX = '测试分片目录轮次'
+LEGACY_COUNT = 5
+
+
+def clear_test_data():
+    """清除之前的测试数据（逐个删除以同时删除谱面文件）"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    for chart in Chart.objects.filter(user__in=test_users):
+        chart.delete()
+    Song.objects.filter(user__in=test_users).delete()
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    test_users.delete()
+
+
+def create_charts():
+    """
+    创建一张新上传的谱面和 LEGACY_COUNT 张旧路径谱面（其中一张文件已丢失）
+
+    Returns:
+        tuple: (新谱面, {旧谱面ID: 谱面内容})
+    """
+    users = [User.objects.create(username=f'{USER_PREFIX}{i}') for i in range(LEGACY_COUNT + 1)]
+    song = Song.objects.create(
+        user=users[0], title='分片测试歌曲', audio_file='songs/shardtest.mp3',
+        audio_hash='shardtest_hash', file_size=0,
+    )
+    bidding_round = BiddingRound.objects.create(name=ROUND_PREFIX, bidding_type='song')
+    new_chart = Chart.objects.create(
+        bidding_round=bidding_round, user=users[0], song=song, status='part_submitted',
+        chart_file=ContentFile(b'&des=new\n', name='maidata.txt'),
+    )
+
+    legacy = {}
+    for i, user in enumerate(users[1:]):
+        content = f'&des={USER_PREFIX}{i}\n'.encode()
+        name = default_storage.save(f'charts/{USER_PREFIX}user{user.id}_song{song.id}/maidata.txt', ContentFile(content))
+        chart = Chart.objects.create(
+            bidding_round=bidding_round, user=user, song=song, status='part_submitted', chart_file=name,
+        )
+        legacy[chart.id] = content
+    # 最后一张谱面的文件丢失
+    missing_id = max(legacy)
+    default_storage.delete(Chart.objects.get(id=missing_id).chart_file.name)
+    legacy.pop(missing_id)
+    return new_chart, legacy
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    results = []
+    try:
+        new_chart, legacy = create_charts()
+
+        print("\n场景1：新上传文件的路径")
+        print(f"  {new_chart.chart_file.name}")
+        passed = bool(SHARDED_RE.match(new_chart.chart_file.name)) and new_chart.chart_file.name.endswith('/maidata.txt')
+        print("✓ 已分片" if passed else "✗ 未分片")
+        results.append(passed)
+
+        print("\n场景2：dry-run")
+        old_names = {c.id: c.chart_file.name for c in Chart.objects.filter(id__in=legacy)}
+        out = StringIO()
+        call_command('shard_media', '--dry-run', stdout=out, stderr=StringIO())
+        print(f"  {out.getvalue().strip().splitlines()[-1]}")
+        passed = all(
+            Chart.objects.get(id=chart_id).chart_file.name == name and default_storage.exists(name)
+            for chart_id, name in old_names.items()
+        )
+        print("✓ 未修改" if passed else "✗ dry-run 修改了数据")
+        results.append(passed)
+
+        print("\n场景3：中断后继续迁移")
+        original_bulk_update = QuerySet.bulk_update
+        calls = []
+
+        def failing_bulk_update(self, objs, fields, *args, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 2:
+                raise RuntimeError('模拟中断')
+            return original_bulk_update(self, objs, fields, *args, **kwargs)
+
+        QuerySet.bulk_update = failing_bulk_update
+        try:
+            call_command('shard_media', '--batch-size', '2', stdout=StringIO(), stderr=StringIO())
+        except RuntimeError:
+            pass
+        finally:
+            QuerySet.bulk_update = original_bulk_update
+        done_after_interrupt = sum(
+            bool(SHARDED_RE.match(c.chart_file.name)) for c in Chart.objects.filter(id__in=legacy)
+        )
+        print(f"  中断时已迁移 {done_after_interrupt}/{len(legacy)}")
+
+        out = StringIO()
+        call_command('shard_media', '--batch-size', '2', stdout=out, stderr=StringIO())
+        print(f"  {out.getvalue().strip().splitlines()[-1]}")
+
+        passed = done_after_interrupt == 2
+        for chart in Chart.objects.filter(id__in=legacy):
+            with chart.chart_file.open('rb') as f:
+                content_ok = f.read() == legacy[chart.id]
+            old_dir = os.path.dirname(default_storage.path(old_names[chart.id]))
+            ok = bool(SHARDED_RE.match(chart.chart_file.name)) and content_ok and not os.path.exists(old_dir)
+            passed &= ok
+            print(f"  {'✓' if ok else '✗'} {old_names[chart.id]} -> {chart.chart_file.name}")
+        print("✓ 迁移完成" if passed else "✗ 迁移错误")
+        results.append(passed)
+
+        print("\n场景4：共享旧文件时中断")
+        first = Chart.objects.get(id=min(legacy))
+        content = f'&des={USER_PREFIX}shared\n'.encode()
+        shared = default_storage.save(f'charts/{USER_PREFIX}shared/maidata.txt', ContentFile(content))
+        second = Chart.objects.create(
+            bidding_round=first.bidding_round, user=User.objects.create(username=f'{USER_PREFIX}shared'),
+            song=first.song, status='part_submitted', chart_file=shared,
+        )
+        Chart.objects.filter(id=first.id).update(chart_file=shared)
+        calls.clear()
+        QuerySet.bulk_update = failing_bulk_update
+        try:
+            call_command('shard_media', '--batch-size', '1', stdout=StringIO(), stderr=StringIO())
+        except RuntimeError:
+            pass
+        finally:
+            QuerySet.bulk_update = original_bulk_update
+        interrupted = not default_storage.exists(shared) and Chart.objects.get(id=second.id).chart_file.name == shared
+
+        err = StringIO()
+        call_command('shard_media', '--batch-size', '1', stdout=StringIO(), stderr=err)
+        names = {Chart.objects.get(id=chart_id).chart_file.name for chart_id in (first.id, second.id)}
+        name = names.pop() if len(names) == 1 else ''
+        content_ok = False
+        if name and default_storage.exists(name):
+            with default_storage.open(name, 'rb') as f:
+                content_ok = f.read() == content
+        print(f"  中断时旧文件已删除、第二条未迁移: {interrupted}，重新执行后: {name}")
+        passed = interrupted and bool(SHARDED_RE.match(name)) and content_ok and shared not in err.getvalue()
+        print("✓ 指向已建立的新文件" if passed else "✗ 记录仍指向已删除的文件")
+        results.append(passed)
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+互评提交并发测试脚本
+用多个线程同时向默认数据库提交互评，验证 submit_peer_review 不会丢失更新
+
+测试场景：
+1. 多名评分者同时给同一张谱面打分（验证 review_count / total_score / average_score 不丢失更新，
+   最后一条评分到达时谱面状态切换为 reviewed）
+2. 同一个分配任务被并发重复提交（验证只有一次提交成功）
+
+使用方法：
+    python test_peer_review_concurrency.py
+    python test_peer_review_concurrency.py 24     # 自定义评分者数量
+
+注意：脚本会创建以 prconc_ 开头的用户及其歌曲、谱面，结束后自动清除。
+"""
+
+import os
+import sys
+import random
+import threading
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection
+from songs.models import Song, BiddingRound, Chart, PeerReviewAllocation, PeerReview
+from songs.bidding_service import PeerReviewService
+
+USER_PREFIX = 'prconc_'
+ROUND_PREFIX = '测试互评并发轮次'
+DEFAULT_REVIEWERS = 12
+DUPLICATE_THREADS = 8
+
+
+def clear_test_data():
+    """清除之前的测试数据"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    # 占位歌曲/谱面没有真实文件，直接用 QuerySet 删除
+    Chart.objects.filter(user__in=test_users).delete()
+    Song.objects.filter(user__in=test_users).delete()
+    test_users.delete()
+
+
+def create_test_data(reviewer_count):
+    """
+    创建一张谱面和 reviewer_count 个指向它的互评任务
+
+    Returns:
+        tuple: (谱面, 分配任务列表)
+    """
+    owner = User.objects.create(username=f'{USER_PREFIX}owner')
+    reviewers = User.objects.bulk_create(
+        [User(username=f'{USER_PREFIX}{i}') for i in range(reviewer_count)]
+    )
+    song = Song.objects.create(
+        user=owner,
+        title='并发测试歌曲',
+        audio_file='songs/prconc.mp3',
+        audio_hash='prconc_hash',
+        file_size=0,
+    )
+    bidding_round = BiddingRound.objects.create(
+        name=ROUND_PREFIX,
+        bidding_type='chart',
+        status='completed'
+    )
+    chart = Chart.objects.create(
+        bidding_round=bidding_round,
+        user=owner,
+        song=song,
+        status='under_review',
+    )
+    PeerReviewAllocation.objects.bulk_create([
+        PeerReviewAllocation(bidding_round=bidding_round, reviewer=reviewer, chart=chart)
+        for reviewer in reviewers
+    ])
+    allocations = list(PeerReviewAllocation.objects.filter(chart=chart).select_related('reviewer'))
+    return chart, allocations
+
+
+def run_concurrently(jobs):
+    """
+    每个任务一个线程，所有线程在屏障处同时开始
+
+    Args:
+        jobs: 可调用对象列表
+
+    Returns:
+        list: 每个任务的结果（返回值或异常）
+    """
+    barrier = threading.Barrier(len(jobs))
+    results = [None] * len(jobs)
+
+    def worker(index, job):
+        try:
+            barrier.wait()
+            results[index] = job()
+        except Exception as e:
+            results[index] = e
+        finally:
+            # 每个线程使用独立的数据库连接，结束时关闭
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(i, job)) for i, job in enumerate(jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_reviews(reviewer_count):
+    """场景1：多名评分者同时给同一张谱面打分"""
+    print("\n" + "=" * 60)
+    print(f"场景1：{reviewer_count} 名评分者同时给同一张谱面打分")
+    print("=" * 60)
+
+    chart, allocations = create_test_data(reviewer_count)
+    scores = [random.randint(0, 50) for _ in allocations]
+
+    results = run_concurrently([
+        (lambda allocation=allocation, score=score: PeerReviewService.submit_peer_review(
+            allocation.id, score, reviewer=allocation.reviewer
+        ))
+        for allocation, score in zip(allocations, scores)
+    ])
+
+    errors = [result for result in results if isinstance(result, Exception)]
+    for error in errors:
+        print(f"  ✗ 提交失败: {error}")
+
+    chart.refresh_from_db()
+    expected_total = sum(scores)
+    expected_average = expected_total / reviewer_count
+    print(f"评分数: {chart.review_count} (期望 {reviewer_count})")
+    print(f"总分: {chart.total_score} (期望 {expected_total})")
+    print(f"平均分: {chart.average_score:.2f} (期望 {expected_average:.2f})")
+    print(f"状态: {chart.status}, 评分完成时间: {chart.review_completed_at}")
+
+    passed = (
+        not errors
+        and chart.review_count == reviewer_count
+        and chart.total_score == expected_total
+        and abs(chart.average_score - expected_average) < 1e-6
+        and chart.status == 'reviewed'
+        and chart.review_completed_at is not None
+        and PeerReview.objects.filter(chart=chart).count() == reviewer_count
+    )
+    print("✓ 没有丢失更新" if passed else "✗ 统计结果不一致")
+    return passed
+
+
+def test_duplicate_submissions():
+    """场景2：同一个分配任务被并发重复提交"""
+    print("\n" + "=" * 60)
+    print(f"场景2：同一个任务被 {DUPLICATE_THREADS} 个线程同时提交")
+    print("=" * 60)
+
+    chart, allocations = create_test_data(2)
+    allocation = allocations[0]
+
+    results = run_concurrently([
+        (lambda: PeerReviewService.submit_peer_review(allocation.id, 30, reviewer=allocation.reviewer))
+        for _ in range(DUPLICATE_THREADS)
+    ])
+
+    succeeded = [result for result in results if isinstance(result, PeerReview)]
+    rejected = [result for result in results if isinstance(result, ValidationError)]
+    unexpected = [result for result in results if result not in succeeded and result not in rejected]
+    for error in unexpected:
+        print(f"  ✗ 意外错误: {error!r}")
+
+    chart.refresh_from_db()
+    print(f"成功: {len(succeeded)}, 被拒绝: {len(rejected)}")
+    print(f"评分数: {chart.review_count}, 总分: {chart.total_score}, 状态: {chart.status}")
+
+    passed = (
+        len(succeeded) == 1
+        and len(rejected) == DUPLICATE_THREADS - 1
+        and chart.review_count == 1
+        and chart.total_score == 30
+        and chart.status == 'under_review'
+        and PeerReview.objects.filter(allocation=allocation).count() == 1
+    )
+    print("✓ 只有一次提交成功" if passed else "✗ 重复提交未被拦截")
+    return passed
+
+
+def main():
+    """主函数"""
+    reviewer_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REVIEWERS
+
+    results = []
+    for scenario in (lambda: test_concurrent_reviews(reviewer_count), test_duplicate_submissions):
+        clear_test_data()
+        try:
+            results.append(scenario())
+        finally:
+            clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+"""
+互评增量调整测试脚本
+验证 rebalance_peer_reviews 只移动待完成的分配，且与并发提交的评分互不覆盖
+
+测试场景：
+1. 评分者退出：其待完成任务转给其他合格评分者，已完成的任务保留，每张谱面的评分数不变
+2. 迟到谱面：补充评分者，其作者只从他人处转来待完成任务，已完成的分配不变，不评自己的谱面
+3. 并发提交：任务在移动前被提交（条件更新失败）时保持原评分者和已完成状态，计入 skipped
+4. 接口权限：普通用户 403 且不修改分配，参数错误 400，管理员 200
+
+使用方法：
+    python test_peer_review_rebalance.py
+
+注意：脚本会创建以 rebaltest_ 开头的用户及其歌曲、谱面，结束后自动清除。
+"""
+
+import os
+import sys
+from collections import Counter
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db.models.query import QuerySet
+from rest_framework.test import APIClient
+from songs.models import Song, BiddingRound, Chart, PeerReviewAllocation
+from songs.bidding_service import PeerReviewService
+
+USER_PREFIX = 'rebaltest_'
+ROUND_PREFIX = '测试互评调整轮次'
+REVIEWER_COUNT = 6
+REVIEWS_PER_CHART = 2
+
+
+def clear_test_data():
+    """清除之前的测试数据"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    # 占位歌曲/谱面没有真实文件，直接用 QuerySet 删除
+    Chart.objects.filter(user__in=test_users).delete()
+    Song.objects.filter(user__in=test_users).delete()
+    test_users.delete()
+
+
+def create_round(name):
+    """
+    创建一轮互评：REVIEWER_COUNT 个用户各有一张谱面，第 i 人评第 i+1..i+REVIEWS_PER_CHART 张
+
+    Returns:
+        tuple: (轮次, 用户列表, 谱面列表)
+    """
+    users = [User.objects.create(username=f'{USER_PREFIX}{name}_{i}') for i in range(REVIEWER_COUNT)]
+    bidding_round = BiddingRound.objects.create(
+        name=f'{ROUND_PREFIX} - {name}', bidding_type='chart', status='completed'
+    )
+    charts = []
+    for user in users:
+        song = Song.objects.create(
+            user=user, title=f'{name}_{user.id}', audio_file='songs/rebaltest.mp3',
+            audio_hash=f'{USER_PREFIX}{user.id}', file_size=0,
+        )
+        charts.append(Chart.objects.create(
+            bidding_round=bidding_round, user=user, song=song, status='under_review',
+        ))
+    PeerReviewAllocation.objects.bulk_create([
+        PeerReviewAllocation(
+            bidding_round=bidding_round, reviewer=user,
+            chart=charts[(i + offset) % REVIEWER_COUNT]
+        )
+        for i, user in enumerate(users)
+        for offset in range(1, REVIEWS_PER_CHART + 1)
+    ])
+    return bidding_round, users, charts
+
+
+def snapshot(bidding_round):
+    """分配ID -> (评分者ID, 谱面ID, 状态)"""
+    return {
+        allocation_id: (reviewer_id, chart_id, status)
+        for allocation_id, reviewer_id, chart_id, status in PeerReviewAllocation.objects.filter(
+            bidding_round=bidding_round
+        ).values_list('id', 'reviewer_id', 'chart_id', 'status')
+    }
+
+
+def valid(bidding_round):
+    """没有人评自己的谱面，也没有重复的 (评分者, 谱面)"""
+    rows = list(PeerReviewAllocation.objects.filter(bidding_round=bidding_round).values_list(
+        'reviewer_id', 'chart_id', 'chart__user_id'
+    ))
+    pairs = [(reviewer_id, chart_id) for reviewer_id, chart_id, _ in rows]
+    return len(pairs) == len(set(pairs)) and all(reviewer_id != owner_id for reviewer_id, _, owner_id in rows)
+
+
+def complete_before_update(allocation_ids):
+    """
+    模拟并发提交：对指定分配执行移动用的条件更新前，先将其标记为已完成
+
+    Returns:
+        function: 恢复原 QuerySet.update 的函数
+    """
+    original_update = QuerySet.update
+
+    def racing_update(self, **kwargs):
+        if self.model is PeerReviewAllocation and 'reviewer_id' in kwargs:
+            original_update(
+                PeerReviewAllocation.objects.filter(id__in=allocation_ids, status='pending'),
+                status='completed'
+            )
+        return original_update(self, **kwargs)
+
+    QuerySet.update = racing_update
+    return lambda: setattr(QuerySet, 'update', original_update)
+
+
+def test_reviewer_quit():
+    """场景1：评分者退出"""
+    print("\n场景1：评分者退出")
+    bidding_round, users, charts = create_round('quit')
+    quitter = users[0]
+    done, pending = PeerReviewAllocation.objects.filter(reviewer=quitter).order_by('id')
+    PeerReviewAllocation.objects.filter(id=done.id).update(status='completed')
+    before = snapshot(bidding_round)
+
+    result = PeerReviewService.rebalance_peer_reviews(bidding_round.id, reviewer_id=quitter.id)
+    after = snapshot(bidding_round)
+    changed = [allocation_id for allocation_id in before if before[allocation_id] != after[allocation_id]]
+    per_chart = Counter(chart_id for _, chart_id, _ in after.values())
+    print(f"  结果 {result['moved']} 移动 / {result['skipped']} 跳过，变化的分配 {changed}")
+    passed = (
+        result['moved'] == 1 and result['skipped'] == 0
+        and changed == [pending.id]
+        and after[done.id] == before[done.id]
+        and after[pending.id][0] != quitter.id
+        and set(per_chart.values()) == {REVIEWS_PER_CHART}
+        and valid(bidding_round)
+    )
+    print("✓ 只移动待完成任务" if passed else "✗ 移动结果错误")
+    return passed
+
+
+def test_late_chart():
+    """场景2：迟到谱面，作者从他人处转来待完成任务"""
+    print("\n场景2：迟到谱面")
+    bidding_round, users, charts = create_round('late')
+    # 大部分任务已完成，只有部分评分者还有待完成任务
+    PeerReviewAllocation.objects.filter(bidding_round=bidding_round).exclude(
+        reviewer__in=users[:3]
+    ).update(status='completed')
+    newcomer = User.objects.create(username=f'{USER_PREFIX}late_newcomer')
+    song = Song.objects.create(
+        user=newcomer, title='迟到谱面', audio_file='songs/rebaltest.mp3',
+        audio_hash=f'{USER_PREFIX}late', file_size=0,
+    )
+    late_chart = Chart.objects.create(bidding_round=bidding_round, user=newcomer, song=song, status='submitted')
+    before = snapshot(bidding_round)
+
+    result = PeerReviewService.rebalance_peer_reviews(bidding_round.id, chart_id=late_chart.id)
+    after = snapshot(bidding_round)
+    completed_kept = all(after[a] == before[a] for a, (_, _, status) in before.items() if status == 'completed')
+    stolen = [a for a in before if after[a][0] == newcomer.id]
+    late_reviews = [a for a, (_, chart_id, _) in after.items() if chart_id == late_chart.id]
+    late_chart.refresh_from_db()
+    print(f"  新建 {result['created']}，转给新作者 {len(stolen)} 个（原状态 "
+          f"{sorted(set(before[a][2] for a in stolen))}），迟到谱面评分数 {len(late_reviews)}")
+    passed = (
+        result['created'] == REVIEWS_PER_CHART
+        and len(late_reviews) == REVIEWS_PER_CHART
+        and len(stolen) > 0
+        and all(before[a][2] == 'pending' for a in stolen)
+        and completed_kept
+        and late_chart.status == 'under_review'
+        and valid(bidding_round)
+    )
+    print("✓ 只转移待完成任务" if passed else "✗ 转移了已完成任务或分配错误")
+    return passed
+
+
+def test_race():
+    """场景3：移动前任务已被提交"""
+    print("\n场景3：并发提交")
+    bidding_round, users, charts = create_round('race')
+    quitter = users[0]
+    quitter_pending = list(PeerReviewAllocation.objects.filter(reviewer=quitter).values_list('id', flat=True))
+    racing = quitter_pending[0]
+
+    restore = complete_before_update([racing])
+    try:
+        result = PeerReviewService.rebalance_peer_reviews(bidding_round.id, reviewer_id=quitter.id)
+    finally:
+        restore()
+    allocation = PeerReviewAllocation.objects.get(id=racing)
+    print(f"  退出: {result['moved']} 移动 / {result['skipped']} 跳过，"
+          f"被提交的任务仍属于 {allocation.reviewer_id == quitter.id and '原评分者' or '其他人'}（{allocation.status}）")
+    passed = (
+        result['skipped'] == 1 and result['moved'] == len(quitter_pending) - 1
+        and allocation.reviewer_id == quitter.id and allocation.status == 'completed'
+        and valid(bidding_round)
+    )
+
+    # 迟到谱面作者转入任务时同样保留已提交的任务
+    newcomer = User.objects.create(username=f'{USER_PREFIX}race_newcomer')
+    song = Song.objects.create(
+        user=newcomer, title='并发迟到谱面', audio_file='songs/rebaltest.mp3',
+        audio_hash=f'{USER_PREFIX}race', file_size=0,
+    )
+    late_chart = Chart.objects.create(bidding_round=bidding_round, user=newcomer, song=song, status='submitted')
+    pending_ids = list(PeerReviewAllocation.objects.filter(
+        bidding_round=bidding_round, status='pending'
+    ).values_list('id', flat=True))
+    before = snapshot(bidding_round)
+    restore = complete_before_update(pending_ids)
+    try:
+        result = PeerReviewService.rebalance_peer_reviews(bidding_round.id, chart_id=late_chart.id)
+    finally:
+        restore()
+    after = snapshot(bidding_round)
+    unchanged = all(after[a][0] == before[a][0] for a in pending_ids)
+    print(f"  迟到谱面: {result['moved']} 移动 / {result['skipped']} 跳过，已提交任务的评分者未变: {unchanged}")
+    passed &= result['moved'] == 0 and result['skipped'] > 0 and unchanged
+    print("✓ 已提交的任务保持不变" if passed else "✗ 覆盖了已提交的任务")
+    return passed
+
+
+def test_view_permission():
+    """场景4：接口权限"""
+    print("\n场景4：接口权限")
+    bidding_round, users, charts = create_round('view')
+    url = f'/api/songs/peer-reviews/rebalance/{bidding_round.id}/'
+    before = snapshot(bidding_round)
+    client = APIClient()
+
+    client.force_authenticate(user=users[1])
+    forbidden = client.post(url, {'reviewer_id': users[0].id}, format='json')
+    unchanged = snapshot(bidding_round) == before
+
+    admin = User.objects.create(username=f'{USER_PREFIX}admin', is_staff=True)
+    client.force_authenticate(user=admin)
+    bad = client.post(url, {'reviewer_id': 'abc'}, format='json')
+    missing = client.post(url, {}, format='json')
+    ok = client.post(url, {'reviewer_id': users[0].id}, format='json')
+    print(f"  普通用户 {forbidden.status_code}，参数错误 {bad.status_code}，缺少参数 {missing.status_code}，"
+          f"管理员 {ok.status_code}")
+    passed = (
+        forbidden.status_code == 403 and unchanged
+        and bad.status_code == 400 and missing.status_code == 400
+        and ok.status_code == 200 and ok.data['rebalance']['moved'] == REVIEWS_PER_CHART
+    )
+    print("✓ 只有管理员可以调整" if passed else "✗ 权限或参数检查错误")
+    return passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    results = []
+    try:
+        results.append(test_reviewer_quit())
+        results.append(test_late_chart())
+        results.append(test_race())
+        results.append(test_view_permission())
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
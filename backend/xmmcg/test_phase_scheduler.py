@@ -0,0 +1,246 @@
+"""
+阶段调度测试脚本
+验证 PhaseScheduler 在阶段时间边界上创建、开启竞标轮次，且 GET 请求不再写数据库
+
+测试场景：
+1. 阶段开始前执行调度，创建待开始（pending）的轮次；重复执行不会重复创建
+2. 阶段开始后执行调度，轮次切换为进行中（active）
+3. 阶段结束后默认不分配；使用 allocate=True 时执行分配并标记为 completed
+4. 竞标接口 GET 请求不创建竞标轮次
+5. 调度在谱面竞标阶段结束时的分配结果与管理员分配接口（allocate_bids_view）一致：
+   落选用户优先获得自己的半成品谱面，代币不足时扣光而不报错
+
+使用方法：
+    python test_phase_scheduler.py
+
+注意：脚本会创建以 schedtest_ 开头的用户和阶段，结束后自动清除。
+"""
+
+import os
+import sys
+import random
+from datetime import timedelta
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.test import APIClient
+from songs.models import BiddingRound, CompetitionPhase, Song, Chart, Bid, BidResult
+from users.models import UserProfile
+from songs.phase_scheduler import PhaseScheduler
+
+USER_PREFIX = 'schedtest_'
+PHASE_PREFIX = 'schedtest_'
+ROUND_PREFIX = '调度测试'
+
+
+def clear_test_data():
+    """清除之前的测试数据"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(competition_phase__phase_key__startswith=PHASE_PREFIX).delete()
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    CompetitionPhase.objects.filter(phase_key__startswith=PHASE_PREFIX).delete()
+    # 占位歌曲/谱面没有真实文件，直接用 QuerySet 删除
+    Chart.objects.filter(user__in=test_users).delete()
+    Song.objects.filter(user__in=test_users).delete()
+    test_users.delete()
+
+
+def phase_rounds(phase):
+    """阶段下的竞标轮次"""
+    return list(BiddingRound.objects.filter(competition_phase=phase).order_by('id'))
+
+
+def test_lifecycle():
+    """场景1-3：轮次随阶段时间推进"""
+    now = timezone.now()
+    phase = CompetitionPhase.objects.create(
+        name='调度测试竞标期',
+        phase_key=f'{PHASE_PREFIX}bidding',
+        description='阶段调度测试',
+        start_time=now + timedelta(hours=1),
+        end_time=now + timedelta(hours=2),
+        order=0,
+    )
+    results = []
+
+    print("\n场景1：阶段开始前创建 pending 轮次，重复执行幂等")
+    PhaseScheduler.tick(now=now)
+    repeat_actions = PhaseScheduler.tick(now=now)
+    rounds = phase_rounds(phase)
+    print(f"  轮次: {[(r.id, r.bidding_type, r.status) for r in rounds]}, 重复执行操作: {repeat_actions}")
+    passed = (
+        len(rounds) == 1
+        and rounds[0].status == 'pending'
+        and rounds[0].bidding_type == 'song'
+        and not [a for a in repeat_actions if a[1] and a[1].competition_phase_id == phase.id]
+    )
+    print("✓ 创建了唯一的 pending 轮次" if passed else "✗ 轮次创建错误")
+    results.append(passed)
+
+    print("\n场景2：阶段开始后切换为 active")
+    PhaseScheduler.tick(now=now + timedelta(hours=1, minutes=1))
+    round_obj = phase_rounds(phase)[0]
+    print(f"  状态: {round_obj.status}, 开始时间: {round_obj.started_at}")
+    passed = round_obj.status == 'active' and round_obj.started_at == phase.start_time
+    print("✓ 已开启" if passed else "✗ 未开启")
+    results.append(passed)
+
+    print("\n场景3：阶段结束后的分配")
+    ended = now + timedelta(hours=3)
+    PhaseScheduler.tick(now=ended)
+    kept_active = phase_rounds(phase)[0].status == 'active'
+    PhaseScheduler.tick(now=ended, allocate=True)
+    round_obj = phase_rounds(phase)[0]
+    print(f"  默认保持进行中: {kept_active}, allocate 后状态: {round_obj.status}")
+    passed = kept_active and round_obj.status == 'completed' and len(phase_rounds(phase)) == 1
+    print("✓ 按配置分配" if passed else "✗ 分配行为错误")
+    results.append(passed)
+
+    return all(results)
+
+
+def test_get_is_read_only():
+    """场景4：竞标接口 GET 请求不创建竞标轮次"""
+    print("\n场景4：GET 请求不创建竞标轮次")
+    now = timezone.now()
+    CompetitionPhase.objects.create(
+        name='调度测试进行中竞标期',
+        phase_key=f'{PHASE_PREFIX}live_bidding',
+        description='阶段调度测试',
+        start_time=now - timedelta(hours=1),
+        end_time=now + timedelta(hours=1),
+        order=1,
+    )
+    user = User.objects.create(username=f'{USER_PREFIX}user')
+    client = APIClient()
+    client.force_authenticate(user)
+
+    before = BiddingRound.objects.count()
+    response = client.get('/api/songs/bids/')
+    after = BiddingRound.objects.count()
+    print(f"  状态码: {response.status_code}, 轮次数: {before} -> {after}")
+    passed = response.status_code == 200 and before == after
+    print("✓ 没有创建轮次" if passed else "✗ GET 请求创建了轮次")
+    return passed
+
+
+def create_part_charts():
+    """
+    三个用户各提交一张半成品谱面
+
+    Returns:
+        tuple: (用户列表, {用户ID: 谱面ID})
+    """
+    song_round = BiddingRound.objects.create(name=f'{ROUND_PREFIX}歌曲轮次', bidding_type='song', status='completed')
+    users = [User.objects.create(username=f'{USER_PREFIX}charter_{i}') for i in range(3)]
+    own_charts = {}
+    for user in users:
+        UserProfile.objects.create(user=user, token=0)
+        song = Song.objects.create(
+            user=user, title=f'调度测试歌曲{user.id}', audio_file='songs/schedtest.mp3',
+            audio_hash=f'{USER_PREFIX}{user.id}', file_size=0,
+        )
+        own_charts[user.id] = Chart.objects.create(
+            bidding_round=song_round, user=user, song=song, status='part_submitted',
+        ).id
+    return users, own_charts
+
+
+def place_bids(round_obj, users, own_charts):
+    """三人都竞标第三人的谱面：第一人出价最高但代币不足，其余两人落选；重置代币"""
+    target = own_charts[users[2].id]
+    for user, amount in zip(users, (100, 50, 30)):
+        Bid.objects.create(bidding_round=round_obj, user=user, bid_type='chart', chart_id=target, amount=amount)
+    for user, token in zip(users, (20, 500, 500)):
+        UserProfile.objects.filter(user=user).update(token=token)
+
+
+def allocation_outcome(round_obj, users):
+    """轮次的分配结果和分配后的代币：{用户名: (谱面ID, 分配类型, 代币)}"""
+    results = {
+        user_id: (chart_id, allocation_type)
+        for user_id, chart_id, allocation_type in BidResult.objects.filter(
+            bidding_round=round_obj
+        ).values_list('user_id', 'chart_id', 'allocation_type')
+    }
+    tokens = dict(UserProfile.objects.filter(user__in=users).values_list('user_id', 'token'))
+    return {user.username: (*results.get(user.id, (None, None)), tokens[user.id]) for user in users}
+
+
+def test_chart_allocation_matches_admin():
+    """场景5：调度分配与管理员分配接口结果一致"""
+    print("\n场景5：谱面竞标阶段结束时的分配与管理员接口一致")
+    now = timezone.now()
+    users, own_charts = create_part_charts()
+
+    # 调度：阶段进行中开启轮次，结束后分配
+    phase = CompetitionPhase.objects.create(
+        name=f'{ROUND_PREFIX}谱面竞标期',
+        phase_key=f'{PHASE_PREFIX}second_bidding',
+        description='阶段调度测试',
+        start_time=now - timedelta(hours=1),
+        end_time=now + timedelta(hours=1),
+        order=2,
+    )
+    PhaseScheduler.tick(now=now)
+    scheduled_round = phase_rounds(phase)[0]
+    place_bids(scheduled_round, users, own_charts)
+    random.seed(0)
+    actions = PhaseScheduler.tick(now=now + timedelta(hours=2), allocate=True)
+    scheduled_round.refresh_from_db()
+    scheduled = allocation_outcome(scheduled_round, users)
+    failed = [a for a in actions if a[0] == 'failed']
+
+    # 管理员接口：相同的竞标与代币
+    admin = User.objects.create(username=f'{USER_PREFIX}admin', is_staff=True)
+    admin_round = BiddingRound.objects.create(
+        name=f'{ROUND_PREFIX}谱面轮次', bidding_type='chart', status='active', started_at=now
+    )
+    place_bids(admin_round, users, own_charts)
+    client = APIClient()
+    client.force_authenticate(admin)
+    random.seed(0)
+    response = client.post('/api/songs/bids/allocate/', {'round_id': admin_round.id}, format='json')
+    admin_result = allocation_outcome(admin_round, users)
+
+    for username in scheduled:
+        print(f"  {username}: 调度 {scheduled[username]}，接口 {admin_result[username]}")
+    loser = users[1]
+    passed = (
+        not failed
+        and scheduled_round.bidding_type == 'chart' and scheduled_round.status == 'completed'
+        and response.status_code == 200
+        and scheduled == admin_result
+        # 落选用户获得自己的半成品谱面；代币不足的中标者被扣光
+        and scheduled[loser.username][:2] == (own_charts[loser.id], 'random')
+        and scheduled[users[0].username] == (own_charts[users[2].id], 'win', 0)
+    )
+    print("✓ 分配结果与代币结算一致" if passed else "✗ 调度分配与管理员接口不一致")
+    return passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    try:
+        results = [
+            test_lifecycle(),
+            test_get_is_read_only(),
+            test_chart_allocation_matches_admin(),
+        ]
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 组测试")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+轮次排名测试脚本
+验证 RoundRanking 物化表在互评写入后增量刷新，以及排名接口的分页和缓存头
+
+测试场景：
+1. 通过 submit_peer_review 提交全部互评后，排名表自动生成（含并列名次）
+2. 与全量重建 rebuild_round 的结果一致
+3. 排名接口的游标分页不重复、不遗漏，且不查询谱面表；不带分页参数时返回完整排名
+4. ETag 未变化时返回 304
+
+使用方法：
+    python test_round_rankings.py
+
+注意：脚本会创建以 ranktest_ 开头的用户及其歌曲、谱面，结束后自动清除。
+"""
+
+import os
+import sys
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from songs.models import Song, BiddingRound, Chart, PeerReviewAllocation, RoundRanking
+from songs.bidding_service import PeerReviewService
+from songs.ranking_service import RankingService
+
+USER_PREFIX = 'ranktest_'
+ROUND_PREFIX = '测试排名轮次'
+
+# 每张谱面收到的评分；第 2、3 张平均分和总分都相同（并列），第 5 张平均分与第 4 张相同但总分更低
+CHART_SCORES = [
+    [50, 48],
+    [40, 40],
+    [45, 35],
+    [30, 30],
+    [30],
+    [10, 20],
+]
+
+
+def clear_test_data():
+    """清除之前的测试数据"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    BiddingRound.objects.filter(name__startswith=ROUND_PREFIX).delete()
+    # 占位歌曲/谱面没有真实文件，直接用 QuerySet 删除
+    Chart.objects.filter(user__in=test_users).delete()
+    Song.objects.filter(user__in=test_users).delete()
+    test_users.delete()
+
+
+def create_test_data():
+    """
+    创建谱面及其互评任务，并逐条提交互评
+
+    Returns:
+        BiddingRound: 竞标轮次
+    """
+    bidding_round = BiddingRound.objects.create(
+        name=ROUND_PREFIX,
+        bidding_type='chart',
+        status='completed'
+    )
+    reviewers = User.objects.bulk_create(
+        [User(username=f'{USER_PREFIX}reviewer_{i}') for i in range(2)]
+    )
+    for i, scores in enumerate(CHART_SCORES):
+        owner = User.objects.create(username=f'{USER_PREFIX}{i}')
+        song = Song.objects.create(
+            user=owner,
+            title=f'排名测试歌曲 {i}',
+            audio_file=f'songs/ranktest_{i}.mp3',
+            audio_hash=f'ranktest_hash_{i}',
+            file_size=0,
+        )
+        chart = Chart.objects.create(
+            bidding_round=bidding_round,
+            user=owner,
+            song=song,
+            status='under_review',
+        )
+        for reviewer, score in zip(reviewers, scores):
+            allocation = PeerReviewAllocation.objects.create(
+                bidding_round=bidding_round,
+                reviewer=reviewer,
+                chart=chart
+            )
+            PeerReviewService.submit_peer_review(allocation.id, score, reviewer=reviewer)
+    return bidding_round
+
+
+def snapshot(bidding_round):
+    """排名表快照：[(rank, dense_rank, username, average_score, total_score)]"""
+    return list(
+        RoundRanking.objects.filter(bidding_round=bidding_round).order_by('rank', 'chart_id')
+        .values_list('rank', 'dense_rank', 'username', 'average_score', 'total_score')
+    )
+
+
+def test_incremental_refresh(bidding_round):
+    """场景1：互评写入后排名表自动生成"""
+    print("\n场景1：提交互评后排名表自动生成")
+    rows = snapshot(bidding_round)
+    for row in rows:
+        print(f"  #{row[0]} (dense {row[1]}) {row[2]}: 平均 {row[3]:.1f}, 总分 {row[4]}")
+
+    ranks = [(rank, dense_rank) for rank, dense_rank, *_ in rows]
+    expected = [(1, 1), (2, 2), (2, 2), (4, 3), (5, 4), (6, 5)]
+    passed = ranks == expected
+    print("✓ 名次正确" if passed else f"✗ 名次错误，期望 {expected}")
+    return passed
+
+
+def test_matches_rebuild(bidding_round):
+    """场景2：增量结果与全量重建一致"""
+    print("\n场景2：增量结果与全量重建一致")
+    before = snapshot(bidding_round)
+    RankingService.rebuild_round(bidding_round.id)
+    passed = snapshot(bidding_round) == before
+    print("✓ 一致" if passed else "✗ 不一致")
+    return passed
+
+
+def test_api_pagination(bidding_round):
+    """场景3/4：游标分页、不查询谱面表、ETag 304"""
+    print("\n场景3：排名接口游标分页")
+    client = APIClient()
+    client.force_authenticate(User.objects.get(username=f'{USER_PREFIX}0'))
+    url = f'/api/songs/rankings/{bidding_round.id}/'
+
+    seen = []
+    cursor = None
+    chart_table = Chart._meta.db_table
+    touched_charts = False
+    while True:
+        params = {'limit': 4}
+        if cursor:
+            params['cursor'] = cursor
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url, params)
+        touched_charts |= any(f'"{chart_table}"' in query['sql'] for query in ctx.captured_queries)
+        data = response.json()
+        seen.extend(row['chart_id'] for row in data['rankings'])
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+
+    expected = list(
+        RoundRanking.objects.filter(bidding_round=bidding_round).order_by('rank', 'chart_id')
+        .values_list('chart_id', flat=True)
+    )
+    full = client.get(url).json()
+    full_ids = [row['chart_id'] for row in full['rankings']]
+    passed = seen == expected and not touched_charts and full_ids == expected and full['next_cursor'] is None
+    print(f"  分页结果: {len(seen)} 行，不分页: {len(full_ids)} 行，查询谱面表: {touched_charts}")
+    print("✓ 分页正确" if passed else "✗ 分页错误")
+
+    print("\n场景4：ETag 未变化时返回 304")
+    first = client.get(url)
+    second = client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+    print(f"  ETag: {first['ETag']}, Cache-Control: {first['Cache-Control']}, 第二次状态码: {second.status_code}")
+    etag_passed = second.status_code == 304
+    print("✓ 返回 304" if etag_passed else "✗ 未返回 304")
+    return passed and etag_passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    try:
+        bidding_round = create_test_data()
+        results = [
+            test_incremental_refresh(bidding_round),
+            test_matches_rebuild(bidding_round),
+            test_api_pagination(bidding_round),
+        ]
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 组测试")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
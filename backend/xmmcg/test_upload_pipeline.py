@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+上传处理测试脚本
+验证上传文件按块写入临时文件，接收时一次性算出 SHA256、大小、格式和谱师名义，序列化器不再重新读取
+
+测试场景：
+1. 上传文件写入临时文件，sha256 / size / sniffed_type 正确；跨块的 &des= 行也能解析
+2. 解析 8MB 上传时内存峰值远小于文件大小
+3. 上传歌曲时 audio_hash 直接使用接收时的哈希，整个请求不再读取上传文件
+4. 文件内容与扩展名不符（PNG 改名为 mp3）时拒绝上传
+
+注意：脚本会创建以 uploadtest_ 开头的用户和歌曲（含媒体文件），结束后自动清除。
+"""
+
+import os
+import sys
+import hashlib
+import tracemalloc
+import django
+
+# 设置 Django 环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xmmcg.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+from songs.models import Song
+from songs.upload_handlers import HashingFileUploadHandler
+
+USER_PREFIX = 'uploadtest_'
+MP3_HEADER = b'ID3\x04\x00\x00\x00\x00\x00\x00'
+PNG_HEADER = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR'
+
+
+class SmallChunkUploadHandler(HashingFileUploadHandler):
+    """使用很小的读块，测试跨块的行"""
+    chunk_size = 16
+
+
+def clear_test_data():
+    """清除之前的测试数据（逐个删除以同时删除媒体文件）"""
+    test_users = User.objects.filter(username__startswith=USER_PREFIX)
+    for song in Song.objects.filter(user__in=test_users):
+        song.delete()
+    test_users.delete()
+
+
+def parse_files(files):
+    """用上传处理器解析 multipart 请求，返回 request.FILES"""
+    request = RequestFactory().post('/upload/', files)
+    return request.FILES
+
+
+def test_handler():
+    """场景1：接收时计算的属性"""
+    print("\n场景1：哈希、大小、格式与谱师名义")
+    audio = MP3_HEADER + os.urandom(200 * 1024)
+    maidata = b'&title=test\n&artist=test\n&des=  \xe6\xb5\x8b\xe8\xaf\x95\xe8\xb0\xb1\xe5\xb8\x88  \r\n&first=0\n'
+
+    with override_settings(FILE_UPLOAD_HANDLERS=['__main__.SmallChunkUploadHandler']):
+        files = parse_files({
+            'audio_file': SimpleUploadedFile('track.mp3', audio),
+            'chart_file': SimpleUploadedFile('maidata.txt', maidata),
+        })
+    audio_file = files['audio_file']
+    chart_file = files['chart_file']
+    print(f"  音频: {audio_file.size} 字节, {audio_file.sniffed_type}, 临时文件 {audio_file.temporary_file_path()}")
+    print(f"  谱师名义: {chart_file.maidata_designer!r}")
+
+    passed = (
+        isinstance(audio_file, TemporaryUploadedFile)
+        and audio_file.sha256 == hashlib.sha256(audio).hexdigest()
+        and audio_file.size == len(audio)
+        and audio_file.sniffed_type == 'mp3'
+        and chart_file.maidata_designer == '测试谱师'
+        and chart_file.sha256 == hashlib.sha256(maidata).hexdigest()
+    )
+
+    files = parse_files({'chart_file': SimpleUploadedFile('maidata.txt', b'&title=test\n&des=')})
+    passed &= files['chart_file'].maidata_designer is None
+    files = parse_files({'chart_file': SimpleUploadedFile('maidata.txt', b'&title=test\n&des=last line')})
+    passed &= files['chart_file'].maidata_designer == 'last line'
+    print("✓ 属性正确" if passed else "✗ 属性错误")
+    return passed
+
+
+def test_memory():
+    """场景2：内存峰值"""
+    print("\n场景2：解析 8MB 上传的内存峰值")
+    size = 8 * 1024 * 1024
+    upload = SimpleUploadedFile('bg.mp4', b'\x00\x00\x00\x18ftypmp42' + os.urandom(size))
+    request = RequestFactory().post('/upload/', {'background_video': upload})
+
+    tracemalloc.start()
+    uploaded = request.FILES['background_video']
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"  文件 {uploaded.size} 字节，峰值 {peak / 1024:.0f} KB")
+    passed = peak < 1024 * 1024 and uploaded.sniffed_type == 'mp4'
+    print("✓ 内存占用与文件大小无关" if passed else "✗ 内存峰值过高")
+    return passed
+
+
+def test_song_upload(client):
+    """场景3：上传歌曲不再重新读取文件"""
+    print("\n场景3：上传歌曲")
+    audio = MP3_HEADER + os.urandom(300 * 1024)
+    reads = []
+    original_read = TemporaryUploadedFile.read
+    original_chunks = TemporaryUploadedFile.chunks
+
+    def counting_read(self, *args, **kwargs):
+        reads.append(self.name)
+        return original_read(self, *args, **kwargs)
+
+    def counting_chunks(self, *args, **kwargs):
+        reads.append(self.name)
+        return original_chunks(self, *args, **kwargs)
+
+    TemporaryUploadedFile.read = counting_read
+    TemporaryUploadedFile.chunks = counting_chunks
+    try:
+        response = client.post('/api/songs/', {
+            'title': '上传测试歌曲',
+            'audio_file': SimpleUploadedFile('track.mp3', audio, content_type='audio/mpeg'),
+        }, format='multipart')
+    finally:
+        TemporaryUploadedFile.read = original_read
+        TemporaryUploadedFile.chunks = original_chunks
+
+    song = Song.objects.filter(user__username__startswith=USER_PREFIX).first()
+    print(f"  响应 {response.status_code}，读取上传文件 {len(reads)} 次")
+    passed = (
+        response.status_code == 201
+        and song is not None
+        and song.audio_hash == hashlib.sha256(audio).hexdigest()
+        and song.file_size == len(audio)
+        and not reads
+    )
+    with song.audio_file.open('rb') as f:
+        passed &= f.read() == audio
+    print("✓ 哈希正确且未重复读取" if passed else "✗ 哈希错误或重复读取了文件")
+    return passed
+
+
+def test_type_mismatch(client):
+    """场景4：内容与扩展名不符"""
+    print("\n场景4：PNG 改名为 mp3 上传")
+    response = client.post('/api/songs/', {
+        'title': '伪装的图片',
+        'audio_file': SimpleUploadedFile('track.mp3', PNG_HEADER + os.urandom(1024), content_type='audio/mpeg'),
+    }, format='multipart')
+    errors = response.data.get('errors', {})
+    print(f"  响应 {response.status_code}: {errors}")
+    passed = response.status_code == 400 and 'audio_file' in errors
+    print("✓ 已拒绝" if passed else "✗ 未拒绝")
+    return passed
+
+
+def main():
+    """主函数"""
+    clear_test_data()
+    results = []
+    try:
+        user = User.objects.create(username=f'{USER_PREFIX}author')
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        results.append(test_handler())
+        results.append(test_memory())
+        results.append(test_song_upload(client))
+        results.append(test_type_mismatch(client))
+    finally:
+        clear_test_data()
+
+    print("\n" + "=" * 60)
+    print(f"通过 {sum(results)}/{len(results)} 个场景")
+    print("=" * 60)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import UserProfile
+from .models import UserProfile, TokenTransaction
+from .token_service import TokenService
 
 
 @admin.register(UserProfile)
@@ -25,10 +26,50 @@ class UserProfileAdmin(admin.ModelAdmin):
         }),
     )
     
+    def save_model(self, request, obj, form, change):
+        """在后台直接修改 token 时，通过代币服务写入流水"""
+        if change and 'token' in form.changed_data:
+            new_token = obj.token
+            obj.token = UserProfile.objects.get(pk=obj.pk).token
+            super().save_model(request, obj, form, change)
+            TokenService.set_balance(
+                obj.user,
+                new_token,
+                transaction_type='admin_grant',
+                note=f'管理员 {request.user.username} 修改'
+            )
+            obj.token = new_token
+            return
+        super().save_model(request, obj, form, change)
+    
     @admin.action(description='重置token数量至默认')
     def reset_tokens(self, request, queryset):
         from django.conf import settings
         default_tokens = getattr(settings, 'DEFAULT_USER_TOKENS', 1000)
-        updated_count = queryset.update(token=default_tokens)
+        updated_count = TokenService.reset_balances(
+            queryset,
+            default_tokens,
+            note=f'管理员 {request.user.username} 重置'
+        )
         self.message_user(request, f'已将 {updated_count} 个用户的token数量重置为默认值 {default_tokens}。')
 
+
+@admin.register(TokenTransaction)
+class TokenTransactionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'transaction_type', 'amount', 'balance_after', 'bidding_round', 'note', 'created_at')
+    list_filter = ('transaction_type', 'created_at')
+    search_fields = ('user__username', 'note')
+    list_select_related = ('user', 'bidding_round')
+    raw_id_fields = ('user', 'bidding_round')
+    ordering = ('-created_at', '-id')
+    
+    # 流水只能由代币服务追加，不允许在后台新增、修改或删除
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class UsersConfig(AppConfig):
+    name = 'users'
+    verbose_name = '用户'
+
+    def ready(self):
+        # 注册信号处理器
+        from . import signals  # noqa: F401
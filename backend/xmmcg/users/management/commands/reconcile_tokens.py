@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from users.models import UserProfile, TokenTransaction
+
+
+class Command(BaseCommand):
+    help = '根据代币流水核对并重建 UserProfile.token 物化余额'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='只报告不一致的用户，不修改余额'
+        )
+        parser.add_argument(
+            '--bootstrap',
+            action='store_true',
+            help='为没有任何流水的用户（启用流水前的老数据）按当前余额补写期初流水'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        ledger_total = Subquery(
+            TokenTransaction.objects.filter(user_id=OuterRef('user_id'))
+            .order_by().values('user_id')
+            .annotate(total=Sum('amount')).values('total')[:1]
+        )
+        has_ledger = Exists(TokenTransaction.objects.filter(user_id=OuterRef('user_id')))
+
+        with transaction.atomic():
+            # 没有流水的老用户：补写期初流水，或跳过（避免把余额重建为0）
+            without_ledger = UserProfile.objects.filter(~has_ledger)
+            if options['bootstrap']:
+                openings = [
+                    TokenTransaction(
+                        user_id=user_id,
+                        transaction_type='opening',
+                        amount=token,
+                        balance_after=token,
+                        note='启用代币流水前的余额',
+                    )
+                    for user_id, token in without_ledger.values_list('user_id', 'token')
+                ]
+                if not dry_run:
+                    TokenTransaction.objects.bulk_create(openings, batch_size=1000)
+                self.stdout.write(f'补写期初流水: {len(openings)} 个用户')
+            else:
+                skipped = without_ledger.count()
+                if skipped:
+                    self.stdout.write(self.style.WARNING(
+                        f'{skipped} 个用户没有任何流水，已跳过（可使用 --bootstrap 补写期初流水）'
+                    ))
+
+            # 一次聚合查询找出余额与流水合计不一致的用户
+            mismatched = UserProfile.objects.filter(has_ledger).annotate(
+                ledger_total=Coalesce(ledger_total, Value(0))
+            ).exclude(token=F('ledger_total'))
+            rows = list(mismatched.values_list('user__username', 'token', 'ledger_total'))
+
+            for username, token, total in rows:
+                self.stdout.write(f'  {username}: 余额 {token}，流水合计 {total}')
+
+            if not rows:
+                self.stdout.write(self.style.SUCCESS('所有用户余额与流水一致'))
+                return
+
+            if dry_run:
+                self.stdout.write(self.style.WARNING(f'发现 {len(rows)} 个用户不一致（--dry-run，未修改）'))
+                return
+
+            # 一条 UPDATE 按流水合计重建余额
+            updated = UserProfile.objects.filter(has_ledger).exclude(
+                token=Coalesce(ledger_total, Value(0))
+            ).update(
+                token=Coalesce(ledger_total, Value(0)),
+                updated_at=timezone.now()
+            )
+            self.stdout.write(self.style.SUCCESS(f'已按流水重建 {updated} 个用户的余额'))
@@ -18,3 +18,56 @@ class UserProfile(models.Model):
 
     def __str__(self):
         return f"{self.user.username}'s profile"
+
+
+class TokenTransaction(models.Model):
+    """
+    代币流水（只追加，不修改）
+
+    每次代币变化都会写入一条流水，并在同一事务中通过条件 F() 更新
+    UserProfile.token；UserProfile.token 是流水的物化余额，读取仍为 O(1)。
+    """
+
+    TRANSACTION_TYPE_CHOICES = [
+        ('opening', '期初余额'),
+        ('bid_settlement', '竞标结算'),
+        ('random_allocation', '保底分配'),
+        ('author_reward', '作者奖励'),
+        ('admin_grant', '管理员调整'),
+        ('manual', '用户接口调整'),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='token_transactions',
+        help_text='代币所属用户'
+    )
+    transaction_type = models.CharField(
+        max_length=30,
+        choices=TRANSACTION_TYPE_CHOICES,
+        help_text='流水类型'
+    )
+    amount = models.IntegerField(help_text='代币变化量（正数为增加，负数为扣除）')
+    balance_after = models.IntegerField(help_text='本条流水入账后的余额')
+    bidding_round = models.ForeignKey(
+        'songs.BiddingRound',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='token_transactions',
+        help_text='关联的竞标轮次（竞标结算、保底分配、作者奖励）'
+    )
+    note = models.CharField(max_length=200, blank=True, default='', help_text='备注')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = '代币流水'
+        verbose_name_plural = '代币流水'
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} {self.get_transaction_type_display()} {self.amount:+d}"
@@ -0,0 +1,21 @@
+"""
+用户相关信号处理
+"""
+
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import UserProfile, TokenTransaction
+
+
+@receiver(post_save, sender=UserProfile)
+def create_opening_transaction(sender, instance, created, **kwargs):
+    """新建用户资料时写入期初余额流水，保证流水合计等于余额"""
+    if not created or kwargs.get('raw'):
+        return
+    TokenTransaction.objects.create(
+        user_id=instance.user_id,
+        transaction_type='opening',
+        amount=instance.token,
+        balance_after=instance.token,
+    )
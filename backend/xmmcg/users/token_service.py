@@ -0,0 +1,142 @@
+"""
+代币服务
+所有代币余额变化都通过此处写入：条件 F() 更新物化余额，并在同一事务中追加流水
+"""
+
+from django.db import transaction
+from django.db.models import F
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .models import UserProfile, TokenTransaction
+
+
+class TokenService:
+    """代币服务类"""
+
+    @staticmethod
+    def get_or_create_profile(user, token=0):
+        """
+        获取用户资料，不存在时创建（创建时由信号写入期初流水）
+
+        Args:
+            user: 用户对象
+            token: 新建资料时的初始代币
+
+        Returns:
+            UserProfile: 用户资料
+        """
+        profile, created = UserProfile.objects.get_or_create(
+            user=user,
+            defaults={'token': token}
+        )
+        return profile
+
+    @staticmethod
+    @transaction.atomic
+    def change_balance(user, amount, transaction_type, note='', bidding_round=None):
+        """
+        增加或扣除代币
+
+        扣除时使用条件更新（token >= 扣除数量），并发请求不会丢失更新，
+        也不会把余额扣成负数。
+
+        Args:
+            user: 用户对象
+            amount: 代币变化量（正数为增加，负数为扣除）
+            transaction_type: 流水类型（见 TokenTransaction.TRANSACTION_TYPE_CHOICES）
+            note: 备注
+            bidding_round: 关联的竞标轮次（可选）
+
+        Returns:
+            TokenTransaction: 写入的流水
+
+        Raises:
+            ValidationError: 如果代币余额不足
+        """
+        TokenService.get_or_create_profile(user)
+
+        profiles = UserProfile.objects.filter(user=user)
+        if amount < 0:
+            profiles = profiles.filter(token__gte=-amount)
+        if not profiles.update(token=F('token') + amount, updated_at=timezone.now()):
+            raise ValidationError('代币余额不足')
+
+        # 更新后该行已被当前事务锁定，读回的余额即为入账后的余额
+        balance_after = UserProfile.objects.filter(user=user).values_list('token', flat=True).get()
+        return TokenTransaction.objects.create(
+            user=user,
+            transaction_type=transaction_type,
+            amount=amount,
+            balance_after=balance_after,
+            bidding_round=bidding_round,
+            note=note,
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def set_balance(user, new_balance, transaction_type='manual', note=''):
+        """
+        将代币余额设置为指定值，差额记入流水
+
+        Args:
+            user: 用户对象
+            new_balance: 新的余额（非负整数）
+            transaction_type: 流水类型
+            note: 备注
+
+        Returns:
+            TokenTransaction: 写入的流水
+
+        Raises:
+            ValidationError: 如果新余额为负数
+        """
+        if new_balance < 0:
+            raise ValidationError('Token 不能为负数')
+
+        TokenService.get_or_create_profile(user)
+        profile = UserProfile.objects.select_for_update().get(user=user)
+        amount = new_balance - profile.token
+
+        UserProfile.objects.filter(pk=profile.pk).update(
+            token=new_balance,
+            updated_at=timezone.now()
+        )
+        return TokenTransaction.objects.create(
+            user=user,
+            transaction_type=transaction_type,
+            amount=amount,
+            balance_after=new_balance,
+            note=note,
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def reset_balances(profiles, new_balance, transaction_type='admin_grant', note=''):
+        """
+        批量将一组用户资料的余额设置为同一值，差额记入流水
+
+        Args:
+            profiles: UserProfile 查询集
+            new_balance: 新的余额
+            transaction_type: 流水类型
+            note: 备注
+
+        Returns:
+            int: 更新的用户数量
+        """
+        balances = list(profiles.select_for_update().values_list('pk', 'user_id', 'token'))
+        TokenTransaction.objects.bulk_create([
+            TokenTransaction(
+                user_id=user_id,
+                transaction_type=transaction_type,
+                amount=new_balance - token,
+                balance_after=new_balance,
+                note=note,
+            )
+            for _, user_id, token in balances
+            if token != new_balance
+        ])
+        return UserProfile.objects.filter(
+            pk__in=[pk for pk, _, _ in balances]
+        ).update(token=new_balance, updated_at=timezone.now())
@@ -6,6 +6,7 @@ from rest_framework.response import Response
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from django.middleware.csrf import get_token
+from django.core.exceptions import ValidationError
 
 from .serializers import (
     UserRegistrationSerializer,
@@ -15,6 +16,7 @@ from .serializers import (
     UpdateTokenSerializer,
 )
 from .models import UserProfile
+from .token_service import TokenService
 
 
 @api_view(['POST'])
@@ -275,10 +277,7 @@ def get_user_token(request):
     GET: 返回用户的 token 余额
     """
     user = request.user
-    try:
-        profile = user.profile
-    except UserProfile.DoesNotExist:
-        profile = UserProfile.objects.create(user=user, token=0)
+    profile = TokenService.get_or_create_profile(user)
     
     return Response({
         'success': True,
@@ -302,15 +301,9 @@ def update_user_token(request):
     serializer = UpdateTokenSerializer(data=request.data)
     
     if serializer.is_valid():
-        try:
-            profile = user.profile
-        except UserProfile.DoesNotExist:
-            profile = UserProfile.objects.create(user=user, token=0)
-        
         new_token = serializer.validated_data['token']
-        old_token = profile.token
-        profile.token = new_token
-        profile.save()
+        entry = TokenService.set_balance(user, new_token, transaction_type='manual')
+        old_token = new_token - entry.amount
         
         return Response({
             'success': True,
@@ -354,15 +347,9 @@ def add_user_token(request):
             'message': '增加数量必须为正数，如需扣除请使用 /token/deduct/ 端点'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    try:
-        profile = user.profile
-    except UserProfile.DoesNotExist:
-        profile = UserProfile.objects.create(user=user, token=0)
-    
-    old_token = profile.token
-    new_token = old_token + amount
-    profile.token = new_token
-    profile.save()
+    entry = TokenService.change_balance(user, amount, transaction_type='manual')
+    new_token = entry.balance_after
+    old_token = new_token - amount
     
     return Response({
         'success': True,
@@ -411,23 +398,18 @@ def deduct_user_token(request):
             'message': '扣除数量必须大于 0'
         }, status=status.HTTP_400_BAD_REQUEST)
     
+    # 条件扣除，防止 token 变成负数（并发扣除也不会丢失更新）
     try:
-        profile = user.profile
-    except UserProfile.DoesNotExist:
-        profile = UserProfile.objects.create(user=user, token=0)
-    
-    old_token = profile.token
-    new_token = old_token - amount
-    
-    # 防止 token 变成负数
-    if new_token < 0:
+        entry = TokenService.change_balance(user, -amount, transaction_type='manual')
+    except ValidationError:
+        current_token = TokenService.get_or_create_profile(user).token
         return Response({
             'success': False,
-            'message': f'Token 余额不足。当前余额: {old_token}，无法扣除 {amount}'
+            'message': f'Token 余额不足。当前余额: {current_token}，无法扣除 {amount}'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    profile.token = new_token
-    profile.save()
+    new_token = entry.balance_after
+    old_token = new_token + amount
     
     return Response({
         'success': True,
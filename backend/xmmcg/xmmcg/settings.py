@@ -158,10 +158,30 @@ if not DEBUG:
 else:
     MEDIA_ROOT = BASE_DIR / "media"
 
+# 谱面打包缓存（见 songs/bundle_cache.py）
+# 生产环境由 nginx 通过 X-Accel-Redirect 发送缓存文件（nginx.conf 中的 /protected-bundles/ 指向 objects 目录）
+CHART_BUNDLE_CACHE_DIR = config('CHART_BUNDLE_CACHE_DIR', default='/var/www/xmmcg/bundles' if not DEBUG else str(BASE_DIR / 'bundle_cache'))
+CHART_BUNDLE_CACHE_MAX_MB = config('CHART_BUNDLE_CACHE_MAX_MB', default=2048, cast=int)  # 缓存总大小上限，超出后按最近访问时间淘汰
+CHART_BUNDLE_USE_X_ACCEL = config('CHART_BUNDLE_USE_X_ACCEL', default=not DEBUG, cast=bool)
+CHART_BUNDLE_ACCEL_PREFIX = config('CHART_BUNDLE_ACCEL_PREFIX', default='/protected-bundles/')
+
 # File Upload Settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 25 * 1024 * 1024  # 25MB (支持20MB视频文件)
+# 上传文件一律按块写入临时文件，同时计算 SHA256 / 识别格式（见 songs/upload_handlers.py），不整体放进内存
+FILE_UPLOAD_HANDLERS = ['songs.upload_handlers.HashingFileUploadHandler']
+FILE_UPLOAD_TEMP_DIR = config('FILE_UPLOAD_TEMP_DIR', default=None)  # 临时文件目录，默认使用系统临时目录
+FILE_UPLOAD_MAX_MEMORY_SIZE = 25 * 1024 * 1024  # 25MB (支持20MB视频文件；只对内存上传处理器生效)
 DATA_UPLOAD_MAX_MEMORY_SIZE = 25 * 1024 * 1024  # 25MB
 
+# Cache Configuration
+# gunicorn 的多个 worker 进程需要共享缓存（信号触发的失效才能对所有进程生效），默认使用文件缓存
+# 可通过环境变量 CACHE_BACKEND / CACHE_LOCATION 切换为 Redis、Memcached 等后端
+CACHES = {
+    "default": {
+        "BACKEND": config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        "LOCATION": config('CACHE_LOCATION', default='/var/cache/xmmcg' if not DEBUG else str(BASE_DIR / 'cache')),
+    }
+}
+
 # CORS Configuration
 # 生产环境域名通过环境变量 PRODUCTION_DOMAIN 配置
 PRODUCTION_DOMAIN = config('PRODUCTION_DOMAIN', default='xmmcg.majdata.net')
@@ -261,16 +281,31 @@ MAJDATA_UPLOAD_URL = config('MAJDATA_UPLOAD_URL', default='https://majdata.net/a
 MAJDATA_USERNAME = config('MAJDATA_USERNAME', default='xmmcg5')
 MAJDATA_PASSWD_HASHED = config('MAJDATA_PASSWD_HASHED', default='123')
 
+# 连接（所有线程共享一个已登录的 session，见 songs/majdata_service.py 的 MajdataSessionManager）
+MAJDATA_POOL_SIZE = config('MAJDATA_POOL_SIZE', default=10, cast=int)  # 连接池大小，应不小于同时上传的线程数
+MAJDATA_CONNECT_RETRIES = config('MAJDATA_CONNECT_RETRIES', default=2, cast=int)  # 建立连接失败时的重试次数（请求发出后不重试）
+MAJDATA_LOGIN_TIMEOUT = config('MAJDATA_LOGIN_TIMEOUT', default=10, cast=int)  # 登录超时秒数
+MAJDATA_UPLOAD_TIMEOUT = config('MAJDATA_UPLOAD_TIMEOUT', default=120, cast=int)  # 上传超时秒数
+
+# 转发队列（提交谱面时写入，由 python manage.py run_majdata_worker 上传，见 songs/majdata_outbox.py）
+MAJDATA_OUTBOX_MAX_ATTEMPTS = config('MAJDATA_OUTBOX_MAX_ATTEMPTS', default=8, cast=int)  # 最多尝试次数，超过后标记为失败
+MAJDATA_OUTBOX_BACKOFF_SECONDS = config('MAJDATA_OUTBOX_BACKOFF_SECONDS', default=30, cast=int)  # 首次失败后的等待秒数，之后每次翻倍
+MAJDATA_OUTBOX_BACKOFF_MAX_SECONDS = config('MAJDATA_OUTBOX_BACKOFF_MAX_SECONDS', default=3600, cast=int)  # 等待秒数上限
+MAJDATA_OUTBOX_STALE_SECONDS = config('MAJDATA_OUTBOX_STALE_SECONDS', default=600, cast=int)  # 上传中超过该秒数视为工作进程中断，重新排队
+
 
 # 注意：登录逻辑已迁移到 songs/majdata_service.py
-# 使用方法：from songs.majdata_service import MajdataService
-#          session = MajdataService.get_session()
+# 使用方法：from songs.majdata_service import session_manager
+#          response = session_manager.request('调用名', 'GET', url)  # 登录失效时自动重新登录并重试一次
 
 
 # ========= Peer Review System Settings =========
 # 互评系统配置
 PEER_REVIEW_TASKS_PER_USER = config('PEER_REVIEW_TASKS_PER_USER', default=8, cast=int)  # 每个用户需要完成的评分任务数
 PEER_REVIEW_MAX_SCORE = config('PEER_REVIEW_MAX_SCORE', default=50, cast=int)  # 互评满分
+RANKINGS_CACHE_MAX_AGE = config('RANKINGS_CACHE_MAX_AGE', default=30, cast=int)  # 排名接口的浏览器/CDN缓存秒数
+COMPETITION_STATUS_CACHE_MAX_AGE = config('COMPETITION_STATUS_CACHE_MAX_AGE', default=10, cast=int)  # 首页比赛状态接口的浏览器/CDN缓存秒数
+BIDDER_ALIAS_SECRET = config('BIDDER_ALIAS_SECRET', default=SECRET_KEY)  # 竞标者匿名代号的 HMAC 密钥（修改后只影响新生成的代号）
 # ==================== 可配置常量 ====================
 # 新用户注册时获得的默认代币数量
 DEFAULT_USER_TOKENS = 1000
\ No newline at end of file
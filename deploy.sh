@@ -22,9 +22,11 @@ BACKEND_DIR="$PROJECT_DIR/backend/xmmcg"
 FRONTEND_DIR="$PROJECT_DIR/front"
 STATIC_DIR="/var/www/xmmcg/static"
 MEDIA_DIR="/var/www/xmmcg/media"
+BUNDLE_DIR="/var/www/xmmcg/bundles"
 FRONTEND_DIST_DIR="/var/www/xmmcg/frontend"
 LOG_DIR="/var/log/gunicorn"
 SOCKET_DIR="/var/run/gunicorn"
+CACHE_DIR="/var/cache/xmmcg"
 
 
 echo "📦 步骤 1/10: 更新系统包..."
@@ -68,9 +70,11 @@ echo "📁 步骤 3/10: 创建项目目录..."
 mkdir -p $PROJECT_DIR
 mkdir -p $STATIC_DIR
 mkdir -p $MEDIA_DIR
+mkdir -p $BUNDLE_DIR
 mkdir -p $FRONTEND_DIST_DIR
 mkdir -p $LOG_DIR
 mkdir -p $SOCKET_DIR
+mkdir -p $CACHE_DIR
 
 echo "📥 步骤 4/10: 克隆代码仓库..."
 if [ -d "$PROJECT_DIR/.git" ]; then
@@ -151,9 +155,11 @@ echo "👤 步骤 9/10: 设置权限..."
 chown -R www-data:www-data $PROJECT_DIR
 chown -R www-data:www-data $STATIC_DIR
 chown -R www-data:www-data $MEDIA_DIR
+chown -R www-data:www-data $BUNDLE_DIR
 chown -R www-data:www-data $FRONTEND_DIST_DIR
 chown -R www-data:www-data $LOG_DIR
 chown -R www-data:www-data $SOCKET_DIR
+chown -R www-data:www-data $CACHE_DIR
 chmod -R 755 $MEDIA_DIR
 
 echo "🔧 步骤 10/10: 配置服务..."
@@ -162,6 +168,16 @@ systemctl daemon-reload
 systemctl enable gunicorn
 systemctl start gunicorn
 
+cp $PROJECT_DIR/backend/phase-scheduler.service /etc/systemd/system/phase-scheduler.service
+systemctl daemon-reload
+systemctl enable phase-scheduler
+systemctl start phase-scheduler
+
+cp $PROJECT_DIR/backend/majdata-worker.service /etc/systemd/system/majdata-worker.service
+systemctl daemon-reload
+systemctl enable majdata-worker
+systemctl start majdata-worker
+
 cp $PROJECT_DIR/backend/nginx.conf /etc/nginx/sites-available/xmmcg
 ln -sf /etc/nginx/sites-available/xmmcg /etc/nginx/sites-enabled/
 rm -f /etc/nginx/sites-enabled/default
@@ -181,6 +197,8 @@ echo "4. 创建管理员: cd /opt/xmmcg/backend/xmmcg && source /opt/xmmcg/venv/
 echo ""
 echo "🔍 服务状态检查："
 echo "  - Gunicorn: sudo systemctl status gunicorn"
+echo "  - 阶段调度: sudo systemctl status phase-scheduler"
+echo "  - Majdata 转发: sudo systemctl status majdata-worker"
 echo "  - Nginx: sudo systemctl status nginx"
 echo "  - 日志: sudo journalctl -u gunicorn -f"
 echo ""
@@ -34,6 +34,7 @@ pip install -r $BACKEND_DIR/requirements.txt
 echo "🗄️ 步骤 3/6: 应用数据库迁移..."
 cd $BACKEND_DIR
 python manage.py migrate
+python manage.py backfill_bidder_aliases
 
 echo "📦 步骤 4/6: 收集静态文件..."
 python manage.py collectstatic --noinput
@@ -48,6 +49,8 @@ echo "🔄 步骤 6/6: 重启服务..."
 chown -R www-data:www-data $PROJECT_DIR
 chown -R www-data:www-data /var/www/xmmcg
 systemctl restart gunicorn
+systemctl restart phase-scheduler
+systemctl restart majdata-worker
 systemctl reload nginx
 
 echo ""